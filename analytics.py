@@ -0,0 +1,169 @@
+# analytics.py — Tendencias de varios meses, retención y ocupación por día y hora.
+#
+# No depende de Streamlit (igual que reports.py). Todo sale de UNA lista de
+# sesiones de un rango (store.sessions_between) pasada a un DataFrame; los
+# meses, días y horas se agrupan con operaciones vectorizadas de pandas, sin
+# recorrer mes por mes. La app guarda el resultado por store.generation.
+import datetime as dt
+from operator import attrgetter, itemgetter
+from typing import Dict, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from records import Record
+from reports import parse_ts
+
+DIAS_ES = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+
+
+def month_range(year: int, month: int, months: int):
+    """(inicio, fin exclusivo) de los `months` meses que terminan en year/month."""
+    first = year * 12 + (month - 1) - (months - 1)
+    start = dt.datetime(first // 12, first % 12 + 1, 1)
+    end = dt.datetime(year + (month == 12), month % 12 + 1, 1)
+    return start, end
+
+
+def sessions_frame(rows: List[Dict]) -> "pd.DataFrame":
+    """client_id, client, ts (hora local, sin zona) y amount de cada sesión."""
+    import pandas as pd
+
+    # Una lista por columna (sin tuplas intermedias por fila); con registros
+    # (records.Session) por atributo, bastante más rápido que r["campo"]
+    getter = attrgetter if rows and isinstance(rows[0], Record) else itemgetter
+    cid, client, ts_iso, amount = (
+        list(map(getter(f), rows)) for f in ("client_id", "client", "ts_iso", "amount_int")
+    )
+
+    ts = pd.Series(ts_iso, dtype="object")
+    try:
+        parsed = pd.to_datetime(ts, format="ISO8601")
+    except ValueError:
+        # mezcla de fechas con y sin zona: una por una, como el resto de la app
+        parsed = pd.Series([parse_ts(x) for x in ts_iso], dtype="datetime64[ns]")
+    if parsed.dt.tz is not None:
+        # con zona (Supabase): a la hora local, como parse_ts
+        parsed = parsed.dt.tz_convert(dt.datetime.now().astimezone().tzinfo).dt.tz_localize(None)
+    return pd.DataFrame({
+        "client_id": pd.array(cid, dtype="Int64"),
+        "client": pd.Series(client, dtype="object"),
+        "ts": parsed,
+        "amount": pd.Series(amount, dtype="float64").fillna(0).astype("int64"),
+    })
+
+
+def _month_index(df: "pd.DataFrame", start: dt.datetime):
+    """Mes de cada sesión como entero: 0 = mes de `start`."""
+    return (df["ts"].dt.year.to_numpy() * 12 + df["ts"].dt.month.to_numpy()) - (start.year * 12 + start.month)
+
+
+def _months(start: dt.datetime, end: dt.datetime):
+    import pandas as pd
+
+    return pd.date_range(start, end - dt.timedelta(days=1), freq="MS")
+
+
+def revenue_trend(df: "pd.DataFrame", start: dt.datetime, end: dt.datetime) -> "pd.DataFrame":
+    """Por mes del rango (incluidos los meses sin clases): Clases, Monto y Clientes."""
+    import numpy as np
+    import pandas as pd
+
+    months = _months(start, end)
+    n = len(months)
+    idx = _month_index(df, start)
+    codes, _ = pd.factorize(df["client_id"])
+    ok = (idx >= 0) & (idx < n)
+    # clientes distintos por mes: pares (mes, cliente) únicos
+    pairs = np.unique(idx[ok] * (codes.max() + 1 if len(codes) else 1) + codes[ok])
+    per_client = pairs // (codes.max() + 1 if len(codes) else 1)
+    return pd.DataFrame({
+        "Mes": months,
+        "Clases": np.bincount(idx[ok], minlength=n),
+        "Monto": np.bincount(idx[ok], weights=df["amount"].to_numpy()[ok], minlength=n).astype("int64"),
+        "Clientes": np.bincount(per_client, minlength=n),
+    })
+
+
+def retention(df: "pd.DataFrame", start: dt.datetime, end: dt.datetime) -> Dict[str, "pd.DataFrame"]:
+    """
+    "meses": por mes, clientes activos, nuevos (su primer mes en el rango),
+    retenidos (también vinieron el mes anterior), perdidos (vinieron el mes
+    anterior y este no) y % de retención.
+    "clientes": por cliente, clases, meses activos, primera y última clase y
+    días desde la última.
+    """
+    import numpy as np
+    import pandas as pd
+
+    months = _months(start, end)
+    n = len(months)
+    idx = _month_index(df, start)
+    ok = (idx >= 0) & (idx < n)
+    codes, uniques = pd.factorize(df["client_id"])
+    # matriz cliente x mes (True si tuvo al menos una clase)
+    a = np.zeros((len(uniques), n), dtype=bool)
+    a[codes[ok], idx[ok]] = True
+    prev = np.zeros_like(a)
+    prev[:, 1:] = a[:, :-1]
+    first = np.zeros_like(a)
+    if a.size:
+        first[np.arange(a.shape[0]), a.argmax(axis=1)] = a.any(axis=1)
+    retenidos = (a & prev).sum(axis=0)
+    anteriores = prev.sum(axis=0)
+    meses = pd.DataFrame({
+        "Mes": months,
+        "Activos": a.sum(axis=0),
+        "Nuevos": (a & first).sum(axis=0).astype(float),
+        "Retenidos": retenidos,
+        "Perdidos": (prev & ~a).sum(axis=0).astype(float),
+        "Retención %": np.round(100 * retenidos / np.where(anteriores > 0, anteriores, np.nan), 1),
+    })
+    # el primer mes no tiene mes anterior dentro del rango
+    if n:
+        meses.loc[0, ["Nuevos", "Perdidos", "Retención %"]] = np.nan
+
+    per = df.groupby("client_id", sort=False).agg(
+        Cliente=("client", "last"), Clases=("amount", "size"), Monto=("amount", "sum"),
+        Primera=("ts", "min"), Ultima=("ts", "max"),
+    )
+    per["Meses activos"] = pd.Series(a.sum(axis=1), index=pd.Index(uniques)).reindex(per.index).fillna(0).astype(int)
+    ref = min(pd.Timestamp(end), pd.Timestamp.now().normalize() + pd.Timedelta(days=1))
+    per["Días sin venir"] = (ref - per["Ultima"]).dt.days
+    per = per.rename(columns={"Ultima": "Última"}).sort_values(["Días sin venir", "Cliente"])
+    return {"meses": meses, "clientes": per.reset_index(drop=True)}
+
+
+def occupancy(df: "pd.DataFrame", start: dt.datetime, end: dt.datetime) -> "pd.DataFrame":
+    """
+    Ocupación por día de la semana y hora: clases totales y promedio por
+    semana del rango. Formato largo (Día, Hora, Clases, Por semana) para el
+    mapa de calor, de la primera a la última hora con clases.
+    """
+    import numpy as np
+    import pandas as pd
+
+    weeks = max((end - start).days / 7, 1)
+    slot = df["ts"].dt.weekday.to_numpy() * 24 + df["ts"].dt.hour.to_numpy()
+    grid = np.bincount(slot, minlength=7 * 24).reshape(7, 24)
+    used = np.flatnonzero(grid.sum(axis=0))
+    hours = np.arange(used.min(), used.max() + 1) if len(used) else np.arange(0)
+    counts = grid[:, hours]
+    return pd.DataFrame({
+        "Día": pd.Categorical.from_codes(np.repeat(np.arange(7), len(hours)), DIAS_ES),
+        "Hora": np.tile(hours, 7),
+        "Clases": counts.ravel(),
+        "Por semana": np.round(counts.ravel() / weeks, 2),
+    })
+
+
+def build(rows: List[Dict], start: dt.datetime, end: dt.datetime) -> Dict[str, "pd.DataFrame"]:
+    """Todo lo que muestra la vista de analítica, a partir de las sesiones del rango."""
+    df = sessions_frame(rows)
+    ret = retention(df, start, end)
+    return {
+        "tendencia": revenue_trend(df, start, end),
+        "retencion": ret["meses"],
+        "clientes": ret["clientes"],
+        "ocupacion": occupancy(df, start, end),
+    }
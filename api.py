@@ -0,0 +1,381 @@
+# api.py — API HTTP/JSON sobre el Backend para otras herramientas (formulario
+# de reservas, sincronización con hojas de cálculo). Solo biblioteca estándar.
+#
+#   python api.py --port 8502                # SQLite (--sqlite) o Supabase del entorno
+#   API_TOKEN=secreto python api.py          # exige "Authorization: Bearer secreto"
+#
+#   GET    /clients?q=ana&limit=20
+#   POST   /clients                 {name, phone, payment_method, account, note}  crea o actualiza por nombre
+#   GET    /clients/<id>
+#   DELETE /clients/<id>
+#   GET    /sessions?month=2025-03  (o from=2025-01&to=2025-03, meses incluidos)
+#          filtros opcionales: client_id, min_amount, max_amount, paid=true|false,
+#          order=ts_iso|amount_int, desc, limit, offset
+#   POST   /sessions                {client | client_id, ts_iso, amount_int, uid}
+#   DELETE /sessions/<id>
+#   GET    /summary?month=2025-03   clases y monto por cliente
+#   GET    /payments?month=2025-03&client_id=7
+#   PUT    /payments                {client_id, year, month, paid, paid_on_iso}
+#   GET    /balances                saldo pendiente por cliente (todos los meses)
+#   GET    /invoices/<client_id>.pdf?month=2025-03
+#
+# Un solo backend y un solo DataStore para todo el proceso: las lecturas salen
+# de la caché y las escrituras la parchan, como en la app. Lo que escriben
+# otros (la app, cli.py) se ve a más tardar en --ttl segundos, cuando la caché
+# se vacía. Cada GET lleva ETag y con If-None-Match igual se responde 304 sin
+# cuerpo; el JSON ya serializado se guarda por DataStore.generation. Los PDF
+# pasan por jobs.shared(): pedidos iguales a la vez se generan una sola vez.
+# Los pedidos se atienden en un pool fijo de hilos (--workers).
+#
+# POST /sessions con uid (utils.new_uid, o cualquier texto único) se puede
+# reintentar sin duplicar la clase.
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from analytics import month_range
+from records import Record
+from store import DataStore
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(o):
+    if isinstance(o, Record):
+        return o.as_dict()
+    return str(o)
+
+
+def _dumps(obj):
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _month(value, name="month"):
+    try:
+        y, m = (int(x) for x in (value or "").split("-"))
+        if not 1 <= m <= 12:
+            raise ValueError
+    except ValueError:
+        raise ApiError(400, f"{name} debe ser AAAA-MM")
+    return y, m
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} debe ser un entero")
+
+
+class Api:
+    def __init__(self, backend, ttl=30.0, token=None, max_responses=512):
+        self.backend = backend
+        self.store = DataStore(backend)
+        self.ttl = ttl
+        self.token = token
+        self.max_responses = max_responses
+        # (ruta, query) -> (generation, etag, cuerpo, content-type)
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        self._loaded = time.monotonic()
+
+    # ---- entrada ----
+    def handle(self, method, path, query, headers, body):
+        """Devuelve (status, headers, cuerpo). Sin HTTP de por medio: sirve para probar."""
+        try:
+            if self.token and headers.get("Authorization") != f"Bearer {self.token}":
+                raise ApiError(401, "Falta el token (Authorization: Bearer ...)")
+            self._expire()
+            segs = [s for s in path.split("/") if s]
+            q = dict(query)
+            if method == "GET":
+                return self._get(segs, q, headers.get("If-None-Match"))
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ApiError(400, "El cuerpo debe ser un objeto JSON")
+            status, out = self._write(method, segs, data)
+            return status, {"Content-Type": "application/json; charset=utf-8"}, _dumps(out)
+        except ApiError as e:
+            return self._error(e.status, str(e))
+        except json.JSONDecodeError:
+            return self._error(400, "JSON inválido")
+        except LookupError as e:
+            return self._error(404, str(e).strip("'\""))
+        except sqlite3.IntegrityError as e:
+            # p. ej. un año archivado (solo lectura)
+            return self._error(409, str(e))
+        except Exception as e:
+            return self._error(500, f"{type(e).__name__}: {e}")
+
+    def _error(self, status, message):
+        return status, {"Content-Type": "application/json; charset=utf-8"}, _dumps({"error": message})
+
+    def _expire(self):
+        if self.ttl and time.monotonic() - self._loaded > self.ttl:
+            self._loaded = time.monotonic()
+            self.store.invalidate()
+
+    # ---- lecturas ----
+    def _get(self, segs, q, if_none_match):
+        if segs[:1] == ["invoices"] and len(segs) == 2:
+            return self._invoice(segs[1], q, if_none_match)
+        key = ("/".join(segs), tuple(sorted(q.items())))
+        gen = self.store.generation
+        with self._lock:
+            hit = self._responses.get(key)
+            if hit and hit[0] == gen:
+                self._responses.move_to_end(key)
+        if not (hit and hit[0] == gen):
+            body = _dumps(self._read(segs, q))
+            hit = (gen, '"%s"' % hashlib.sha1(body).hexdigest()[:20], body, "application/json; charset=utf-8")
+            with self._lock:
+                self._responses[key] = hit
+                while len(self._responses) > self.max_responses:
+                    self._responses.popitem(last=False)
+        _, etag, body, ctype = hit
+        return self._conditional(etag, if_none_match, body, ctype)
+
+    def _conditional(self, etag, if_none_match, body, ctype):
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return 304, headers, b""
+        return 200, dict(headers, **{"Content-Type": ctype}), body
+
+    def _read(self, segs, q):
+        store = self.store
+        if segs == ["clients"]:
+            limit = _int(q.get("limit", 20), "limit")
+            return store.search_clients(q["q"], limit) if q.get("q") else store.clients()
+        if segs[:1] == ["clients"] and len(segs) == 2:
+            cid = _int(segs[1], "id")
+            cli = next((c for c in store.clients() if c["id"] == cid), None)
+            if cli is None:
+                raise ApiError(404, f"No existe el cliente {cid}")
+            return cli
+        if segs == ["sessions"]:
+            months = self._months(q)
+            filters = {k: q[k] for k in self.SESSION_FILTERS if k in q}
+            if not filters:
+                return [r for start, end in months for r in store.sessions_between(start, end)]
+            # con filtros: una sola consulta al backend (query_sessions) para todo el rango
+            for k in ("client_id", "min_amount", "max_amount", "limit", "offset"):
+                if k in filters:
+                    filters[k] = _int(filters[k], k)
+            for k in ("paid", "desc"):
+                if k in filters:
+                    filters[k] = filters[k].lower() in ("1", "true", "si", "sí")
+            try:
+                return store.query_sessions(start_iso=months[0][0], end_iso=months[-1][1], **filters)
+            except ValueError as e:
+                raise ApiError(400, str(e))
+        if segs == ["summary"]:
+            tot = {}
+            for start, end in self._months(q):
+                for cid, t in store.totals_between(start, end).items():
+                    acc = tot.setdefault(cid, {"client_id": cid, "client": t["client"], "clases": 0, "monto": 0})
+                    acc["clases"] += t["clases"]
+                    acc["monto"] += t["monto"]
+            return sorted(tot.values(), key=lambda t: t["client"] or "")
+        if segs == ["payments"]:
+            y, m = _month(q.get("month"))
+            cid = _int(q.get("client_id"), "client_id")
+            return dict(store.month_payment(cid, y, m), client_id=cid, year=y, month=m)
+        if segs == ["balances"]:
+            return store.outstanding_balances()
+        raise ApiError(404, "Ruta desconocida")
+
+    # parámetros de GET /sessions que van a backend.query_sessions
+    SESSION_FILTERS = ("client_id", "min_amount", "max_amount", "paid", "order", "desc", "limit", "offset")
+
+    def _months(self, q):
+        """Rangos (inicio, fin) de cada mes pedido; por mes, para que la caché se comparta."""
+        if "month" in q:
+            first = last = _month(q["month"])
+        else:
+            first = _month(q.get("from"), "from")
+            last = _month(q.get("to") or q.get("from"), "to")
+        n = (last[0] * 12 + last[1]) - (first[0] * 12 + first[1]) + 1
+        if not 1 <= n <= 120:
+            raise ApiError(400, "Rango de meses inválido (máximo 120)")
+        out = []
+        for i in range(n):
+            k = first[0] * 12 + first[1] - 1 + i
+            start, end = month_range(k // 12, k % 12 + 1, 1)
+            out.append((start.isoformat(), end.isoformat()))
+        return out
+
+    def _invoice(self, name, q, if_none_match):
+        import jobs
+        from reports import invoice_data
+
+        cid = _int(name[:-4] if name.endswith(".pdf") else name, "id")
+        y, m = _month(q.get("month"))
+        cli = next((c for c in self.store.clients() if c["id"] == cid), None)
+        if cli is None:
+            raise ApiError(404, f"No existe el cliente {cid}")
+        (start, end), = self._months({"month": f"{y}-{m}"})
+        rows = self.store.query_sessions(start_iso=start, end_iso=end, client_id=cid)
+        if not rows:
+            raise ApiError(404, "El cliente no tiene clases en ese mes")
+        invoice = invoice_data(
+            cli, y, m, rows,
+            logo_url=os.getenv("APP_LOGO_URL", ""),
+            emisor=os.getenv("EMISOR_NOMBRE", ""),
+            nota=os.getenv("EMISOR_NOTA", ""),
+        )
+        # el id del trabajo sale de los datos: sirve de ETag sin generar el PDF
+        key = ("pdf", invoice)
+        etag = '"%s"' % jobs.job_id(key)
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return 304, {"ETag": etag, "Cache-Control": "no-cache"}, b""
+        reg = jobs.shared()
+        pdf = reg.result(reg.submit(key, _render_pdf, invoice), timeout=120)
+        status, headers, body = self._conditional(etag, None, pdf, "application/pdf")
+        headers["Content-Disposition"] = f'inline; filename="cuenta_{cid}_{y}_{m:02d}.pdf"'
+        return status, headers, body
+
+    # ---- escrituras ----
+    def _write(self, method, segs, data):
+        backend, store = self.backend, self.store
+        if method == "POST" and segs == ["clients"]:
+            if not (data.get("name") or "").strip():
+                raise ApiError(400, "Falta name")
+            row = backend.upsert_client(
+                data["name"], data.get("phone"), data.get("payment_method"), data.get("account"), data.get("note"),
+            )
+            store.apply_client(row)
+            return 200, row
+        if method == "POST" and segs == ["sessions"]:
+            client = data.get("client_id")
+            client = _int(client, "client_id") if client is not None else (data.get("client") or "").strip()
+            if not client or not data.get("ts_iso"):
+                raise ApiError(400, "Faltan client/client_id o ts_iso")
+            amount = _int(data.get("amount_int") or 0, "amount_int")
+            cli, row = backend.record_class(client, data["ts_iso"], amount, uid=data.get("uid"))
+            if store.client_by_name(cli["name"]) is None:
+                store.apply_client(cli)
+            store.apply_session(row)
+            return 201, {"client": cli, "session": row}
+        if method == "PUT" and segs == ["payments"]:
+            y, m = _int(data.get("year"), "year"), _int(data.get("month"), "month")
+            row = backend.set_month_payment(
+                _int(data.get("client_id"), "client_id"), y, m, bool(data.get("paid")), data.get("paid_on_iso"),
+            )
+            store.apply_payment(row)
+            return 200, row
+        if method == "DELETE" and len(segs) == 2 and segs[0] in ("clients", "sessions"):
+            rid = _int(segs[1], "id")
+            if segs[0] == "clients":
+                row = backend.delete_client(rid)
+                remove = store.remove_client
+            else:
+                row = backend.delete_session(rid)
+                remove = store.remove_session
+            if row is None:
+                raise ApiError(404, f"No existe {segs[0][:-1]} {rid}")
+            remove(rid)
+            return 200, row
+        raise ApiError(404 if method in ("POST", "PUT", "DELETE") else 405, "Ruta desconocida")
+
+
+def _render_pdf(invoice):
+    from pdf_utils import build_invoice_pdf
+
+    return build_invoice_pdf(invoice)
+
+
+# ---------------------------
+# Servidor
+# ---------------------------
+class PooledHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer con un pool fijo de hilos en vez de uno por conexión."""
+
+    def __init__(self, addr, handler, workers=16):
+        super().__init__(addr, handler)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="api")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+def make_server(api, host="127.0.0.1", port=8502, workers=16):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _handle(self, method, head=False):
+            parts = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            status, headers, body = api.handle(
+                method, parts.path, parse_qsl(parts.query, keep_blank_values=True), self.headers, raw,
+            )
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            # HEAD: mismos encabezados que GET (Content-Length incluido), sin cuerpo
+            if not head:
+                self.wfile.write(body)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_HEAD(self):
+            self._handle("GET", head=True)
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+    return PooledHTTPServer((host, port), Handler, workers)
+
+
+def main(argv=None):
+    from db import backend_from_env
+
+    ap = argparse.ArgumentParser(description="API HTTP/JSON sobre la base de entrenamientos.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8502)
+    ap.add_argument("--sqlite", default="entrenos.db", help="base SQLite si no hay Supabase en el entorno")
+    ap.add_argument("--ttl", type=float, default=30.0, help="segundos antes de volver a leer del backend")
+    ap.add_argument("--workers", type=int, default=16, help="hilos que atienden pedidos")
+    args = ap.parse_args(argv)
+
+    backend = backend_from_env(args.sqlite)
+    api = Api(backend, ttl=args.ttl, token=os.getenv("API_TOKEN"))
+    srv = make_server(api, args.host, args.port, args.workers)
+    print(f"API ({backend.label}) en http://{args.host}:{srv.server_address[1]}", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+
+
+if __name__ == "__main__":
+    main()
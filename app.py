@@ -5,16 +5,28 @@
 import io
 import json
 import math
+import os
 import datetime as dt
-from typing import List, Dict
+from typing import List, Dict, Optional, TYPE_CHECKING
 
-import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
 from auth import require_login, sign_out
 from db import get_backend
-from pdf_utils import build_invoice_pdf  # debe devolver bytes (PDF)
+from store import DataStore
+from metrics import Metrics, instrument
+from profiling import Profiler
+from reports import (
+    month_start_end, month_table, summary_from_totals, to_calendar,
+    EXPORT_FORMATS, available_export_formats, export_bytes, invoice_data,
+)
+from utils import file_key, new_uid
+
+# pandas y reportlab (pdf_utils) se importan donde se usan: la pantalla de
+# acceso y el calendario no los necesitan y el arranque en frío es más corto.
+if TYPE_CHECKING:
+    import pandas as pd
 
 # ---------------------------
 # Utilidades de formato/fechas
@@ -33,14 +45,6 @@ def format_cop(n: int) -> str:
     s = f"{v:,}".replace(",", ".")
     return f"${s}"
 
-def month_start_end(year: int, month: int):
-    start = dt.datetime(year, month, 1, 0, 0, 0)
-    if month == 12:
-        end = dt.datetime(year + 1, 1, 1, 0, 0, 0) - dt.timedelta(seconds=1)
-    else:
-        end = dt.datetime(year, month + 1, 1, 0, 0, 0) - dt.timedelta(seconds=1)
-    return start, end
-
 def normalize_name(raw: str) -> str:
     if not raw:
         return ""
@@ -48,6 +52,15 @@ def normalize_name(raw: str) -> str:
     s = s.title()
     return s
 
+def app_setting(name: str, default=None):
+    """Lee un ajuste de st.secrets y, si no está, de las variables de entorno."""
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return os.environ.get(name, default)
+
 def backend_name(b) -> str:
     # best-effort label
     return getattr(b, "label", None) or getattr(b, "name", None) or (
@@ -57,17 +70,17 @@ def backend_name(b) -> str:
 # ---------------
 # Carga de datos
 # ---------------
-def load_clients(backend) -> List[Dict]:
+def load_clients(store) -> List[Dict]:
     try:
-        return backend.list_clients()  # [{'id','name','payment_method','account','phone','note'}]
+        return store.clients()  # [{'id','name','payment_method','account','phone','note'}]
     except Exception as e:
         st.error(f"No se pudieron cargar clientes: {e}")
         return []
 
-def load_sessions_month(backend, year: int, month: int) -> List[Dict]:
+def load_sessions_month(store, year: int, month: int) -> List[Dict]:
     start, end = month_start_end(year, month)
     try:
-        items = backend.list_sessions_between(
+        items = store.sessions_between(
             start.isoformat(), end.isoformat()
         )
         # Se espera [{'id','client_id','client','ts_iso','amount_int'}]
@@ -76,42 +89,86 @@ def load_sessions_month(backend, year: int, month: int) -> List[Dict]:
         st.error(f"No se pudieron cargar clases del mes: {e}")
         return []
 
-def monthly_summary(rows: List[Dict]) -> pd.DataFrame:
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return pd.DataFrame(columns=["Cliente", "Clases", "Monto"])
-    # campos esperados: client (str) y amount_int (int)
-    df["Cliente"] = df.get("client", "")
-    df["Monto"] = df.get("amount_int", 0).astype(int)
-    grp = df.groupby("Cliente", dropna=False, as_index=False).agg(
-        Clases=("Cliente", "count"),
-        Monto=("Monto", "sum")
-    )
-    grp = grp.sort_values(["Cliente"]).reset_index(drop=True)
-    return grp
+def load_client_sessions_month(store, client_id: int, year: int, month: int) -> List[Dict]:
+    start, end = month_start_end(year, month)
+    try:
+        return store.query_sessions(start_iso=start.isoformat(), end_iso=end.isoformat(), client_id=client_id)
+    except Exception as e:
+        st.error(f"No se pudieron cargar las clases del cliente: {e}")
+        return []
 
-def to_calendar(rows: List[Dict]) -> Dict[int, List[Dict]]:
-    cal = {d: [] for d in range(1, 32)}
-    for r in rows:
-        ts = r.get("ts_iso")
-        try:
-            dtm = dt.datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(None)
-        except Exception:
-            # best effort
-            dtm = dt.datetime.fromisoformat(ts[:19])
-        day = dtm.day
-        cal.setdefault(day, []).append(r | {"_dt": dtm})
-    return cal
+def load_month_totals(store, year: int, month: int) -> Dict[int, Dict]:
+    start, end = month_start_end(year, month)
+    try:
+        return store.totals_between(start.isoformat(), end.isoformat())
+    except Exception as e:
+        st.error(f"No se pudieron cargar los totales del mes: {e}")
+        return {}
 
-# ----------------
-# Export helpers
-# ----------------
-def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
-    return df.to_csv(index=False).encode("utf-8")
+def load_balances(store) -> List[Dict]:
+    try:
+        return store.outstanding_balances()
+    except Exception as e:
+        st.error(f"No se pudieron cargar los saldos: {e}")
+        return []
 
 # ----------------
 # UI components
 # ----------------
+def export_button(store, label: str, make_df, file_stem: str, columns: Optional[List[str]] = None):
+    """
+    Botón de descarga en el formato elegido en la barra lateral. Los bytes se
+    generan solo la primera vez y se reutilizan mientras store.generation no
+    cambie (es decir, mientras no se escriba nada); make_df puede ser un
+    callable para no armar el DataFrame si ya está en caché.
+    """
+    fmt = st.session_state.get("exp_formato", "CSV")
+    ext, mime = EXPORT_FORMATS[fmt]
+    cache = st.session_state.setdefault("exports", {})
+    key = (file_stem, fmt, tuple(columns or ()), store.generation)
+    data = cache.get(key)
+    if data is None:
+        for k in [k for k in cache if k[-1] != store.generation]:
+            del cache[k]
+        df = make_df() if callable(make_df) else make_df
+        data = cache[key] = export_bytes(df, fmt, columns)
+    st.download_button(
+        f"{label} ({fmt})",
+        data=data,
+        file_name=f"{file_stem}.{ext}",
+        mime=mime,
+        use_container_width=True,
+    )
+
+def metrics_table(d: Dict, cols=("n", "ms", "max_ms", "rows", "bytes_in", "errors")) -> "pd.DataFrame":
+    import pandas as pd
+
+    df = pd.DataFrame.from_dict(d, orient="index")
+    if df.empty:
+        return df
+    df = df[[c for c in cols if c in df.columns]].sort_values(cols[1], ascending=False)
+    return df.round(1)
+
+def performance_panel(rec: Dict, session: Dict, reruns: int):
+    """Panel lateral con lo medido en el último rerun y en toda la sesión."""
+    with st.sidebar.expander("⏱ Rendimiento", expanded=True):
+        if rec:
+            st.caption(
+                f"Rerun #{rec['rerun']} · {rec['wall_ms']:.0f} ms en total · "
+                f"{rec['backend_ms']:.0f} ms en backend"
+            )
+            if rec["calls"]:
+                st.dataframe(metrics_table(rec["calls"]), use_container_width=True)
+            if rec["http"]:
+                st.dataframe(metrics_table(rec["http"], ("n", "ms", "rows", "bytes_out", "bytes_in", "errors")), use_container_width=True)
+            if rec["cache"]:
+                st.dataframe(metrics_table(rec["cache"], ("hit", "miss")), use_container_width=True)
+        st.caption(f"Sesión: {reruns} reruns · {session['backend_ms']:.0f} ms en backend")
+        if session["calls"]:
+            st.dataframe(metrics_table(session["calls"]), use_container_width=True)
+        if session["cache"]:
+            st.dataframe(metrics_table(session["cache"], ("hit", "miss")), use_container_width=True)
+
 def copy_payment_button(cli: Dict):
     pay_txt = f"{cli.get('payment_method','') or ''} · {cli.get('account','') or ''}".strip(" ·")
     if not pay_txt:
@@ -139,6 +196,13 @@ def copy_payment_button(cli: Dict):
     </script>
     """, height=40)
 
+def profile_panel(profiler: Profiler, files: List[str]):
+    import pandas as pd
+
+    with st.expander("🔬 Perfil de este rerun", expanded=True):
+        st.caption("Guardado en: " + " · ".join(f"`{f}`" for f in files))
+        st.dataframe(pd.DataFrame(profiler.top_functions(20)), use_container_width=True, hide_index=True)
+
 # =========================
 #  APP
 # =========================
@@ -149,13 +213,32 @@ user = require_login()
 if not user:
     st.stop()
 
+# --- Modo perfil: ?profile=1 en la URL o PROFILE en secrets ---
+# El perfilador arranca dentro del try de la vista (abajo): así siempre se
+# detiene y se guarda, aunque la vista falle o un botón haga st.rerun().
+profiling = st.query_params.get("profile") == "1" or str(app_setting("PROFILE", "")).lower() in ("1", "true")
+profiler = None
+
 st.sidebar.success(f"Sesión: {user['email']}")
 if st.sidebar.button("Salir"):
     sign_out()
 
 
-# --- Backend ---
-backend = get_backend()
+# --- Backend + caché de datos (uno por sesión de usuario) ---
+if "store" not in st.session_state:
+    # METRICS_FILE vacío desactiva el archivo; el panel sigue funcionando
+    metrics = Metrics(path=app_setting("METRICS_FILE", "metrics.jsonl") or None)
+    store = DataStore(instrument(get_backend(), metrics))
+    store.metrics = metrics
+    st.session_state["store"] = store
+    st.session_state["metrics"] = metrics
+store = st.session_state["store"]
+metrics = st.session_state["metrics"]
+backend = store.backend
+if st.sidebar.button("Recargar datos"):
+    store.invalidate()
+st.sidebar.selectbox("Formato de exportación", available_export_formats(), key="exp_formato")
+show_perf = st.sidebar.toggle("⏱ Rendimiento", key="perf_panel")
 st.caption(f"Backend activo: **{backend_name(backend)}** • Moneda: **COP** • Formato: **$30.000**")
 
 # --- Parámetros Año/Mes (query params para persistir) ---
@@ -178,177 +261,274 @@ st.query_params.update({"y": str(year), "m": mes_name})
 month = MES_TO_NUM[mes_name]
 
 # -------------
-# Tabs
+# Vistas
 # -------------
-tab1, tab2, tab3 = st.tabs(["📋 Registro & Resumen", "📆 Calendario", "👥 Clientes & cobros"])
+# Solo se ejecuta la vista activa: el resto no carga datos ni dibuja nada.
+VISTAS = ["📋 Registro & Resumen", "📆 Calendario", "👥 Clientes & cobros", "📈 Analítica"]
+
+# Prefijos de las keys de widgets de cada vista. Streamlit borra el estado de
+# los widgets que no se dibujan en un rerun; al reasignarlos aquí, lo que el
+# usuario escribió en una vista sigue ahí cuando vuelve a ella.
+VIEW_STATE_PREFIXES = ("reg_", "pago_", "cli_", "inv_", "ana_")
+
+def keep_view_state(defaults: Dict):
+    for k in list(st.session_state.keys()):
+        if isinstance(k, str) and k.startswith(VIEW_STATE_PREFIXES):
+            st.session_state[k] = st.session_state[k]
+    # Valores iniciales vía session_state (no con value=) para que Streamlit
+    # no avise de valores duplicados al reasignarlos.
+    for k, v in defaults.items():
+        st.session_state.setdefault(k, v)
+
+def keep_choice(key: str, options: List):
+    """Descarta una selección guardada que ya no está entre las opciones."""
+    if key in st.session_state and st.session_state[key] not in options:
+        del st.session_state[key]
+
+NUEVO_CLIENTE = "(Escribir nombre nuevo)"
+
+def client_picker(store, key: str, label: str = "Cliente", extra: List[str] = (), limit: int = 30):
+    """
+    Buscador + selector de clientes. El selectbox solo lleva las coincidencias
+    de backend.search_clients (sin tildes, por parte del nombre), no todos los
+    clientes: la búsqueda la hace la base. Devuelve el nombre elegido (o una
+    opción de `extra`).
+    """
+    q = st.text_input(f"Buscar {label.lower()}", key=f"{key}_q", placeholder="Escribe parte del nombre")
+    try:
+        names = [c.get("name", "") for c in store.search_clients(q, limit)]
+    except Exception as e:
+        st.error(f"No se pudieron buscar clientes: {e}")
+        names = []
+    options = list(extra) + names
+    current = st.session_state.get(key)
+    if not q and current and current not in options and current in (
+        c.get("name", "") for c in store.search_clients(current, limit)
+    ):
+        options.append(current)
+    keep_choice(key, options)
+    # al cambiar la búsqueda queda elegida la mejor coincidencia
+    if q and names and q != st.session_state.get(f"{key}_prev"):
+        st.session_state[key] = names[0]
+    st.session_state[f"{key}_prev"] = q
+    if not q and len(names) >= limit:
+        st.caption(f"Primeros {limit} clientes; escribe para buscar.")
+    return st.selectbox(label, options, key=key) if options else None
 
 # ============
-# TAB 1: Registro y Resumen
+# VISTA 1: Registro y Resumen
 # ============
-with tab1:
+# Las secciones con botón de guardar son fragments: al hacer clic solo se
+# re-ejecuta el fragment y los datos en caché se parchean, sin recargar el mes.
+@st.fragment
+def fragment_registrar_clase(store):
     st.subheader("Registrar una clase")
 
-    # --- Clientes: selector + opción de nuevo ---
-    clients = load_clients(backend)
-    names = ["(Escribir nombre nuevo)"] + [c.get("name", "") for c in clients]
-    sel = st.selectbox("Cliente", names, index=0)
+    # --- Clientes: buscador + opción de nuevo ---
+    sel = client_picker(store, "reg_cliente", extra=[NUEVO_CLIENTE])
     new_name = ""
-    if sel == "(Escribir nombre nuevo)":
-        new_name = st.text_input("Nuevo nombre", placeholder="Nombre y apellido")
-    valor = st.number_input("Valor de la clase (COP)", min_value=0, step=1000, value=30000)
+    if sel == NUEVO_CLIENTE:
+        new_name = st.text_input("Nuevo nombre", placeholder="Nombre y apellido", key="reg_nuevo")
+    valor = st.number_input("Valor de la clase (COP)", min_value=0, step=1000, key="reg_valor")
     c1, c2 = st.columns(2)
     with c1:
-        f = st.date_input("Fecha", value=now.date())
+        f = st.date_input("Fecha", key="reg_fecha")
     with c2:
-        t = st.time_input("Hora", value=dt.time(hour=18, minute=0))
+        t = st.time_input("Hora", key="reg_hora")
 
     if st.button("Guardar clase", use_container_width=True):
         try:
-            # 1) Resolver cliente
-            if sel != "(Escribir nombre nuevo)":
+            # Cliente conocido -> su id; nuevo -> el nombre (se crea en la misma operación)
+            if sel != NUEVO_CLIENTE:
                 cli_name = normalize_name(sel)
-                cli = next((c for c in clients if normalize_name(c.get("name","")) == cli_name), None)
-                if not cli:
-                    # por si cambiaron lista; creamos
-                    backend.upsert_client(cli_name, None, None, None, None)
-                    clients = load_clients(backend)
-                    cli = next((c for c in clients if normalize_name(c.get("name","")) == cli_name), None)
             else:
                 cli_name = normalize_name(new_name)
                 if not cli_name:
                     st.warning("Escribe un nombre de cliente.")
-                    st.stop()
-                backend.upsert_client(cli_name, None, None, None, None)
-                clients = load_clients(backend)
-                cli = next((c for c in clients if normalize_name(c.get("name","")) == cli_name), None)
-
-            client_id = cli.get("id") if cli else None
+                    return
+            known = store.client_by_name(cli_name)
 
-            # 2) Timestamp y registro
+            # Un solo llamado al backend; cliente y sesión guardados van directo a la caché
             ts = dt.datetime.combine(f, t)
-            ts_iso = ts.isoformat()
+            # La misma clase conserva su uid hasta guardarse: si el intento
+            # anterior llegó pero su respuesta no (timeout), volver a pulsar
+            # devuelve esa sesión en vez de crear otra.
+            datos = (cli_name, ts.isoformat(), int(valor))
+            pend = st.session_state.get("registro_pendiente")
+            if not pend or pend[0] != datos:
+                pend = st.session_state["registro_pendiente"] = (datos, new_uid())
+            cli, row = store.backend.record_class(
+                known["id"] if known else cli_name, ts.isoformat(), int(valor), uid=pend[1]
+            )
+            del st.session_state["registro_pendiente"]
+            if not known:
+                store.apply_client(cli)
+            store.apply_session(row)
+
+            st.success(f"Clase registrada: {cli['name']} · {ts.strftime('%d/%m %H:%M')} · {format_cop(row['amount_int'])}")
+        except Exception as e:
+            st.error(f"No se pudo guardar: {e}")
 
-            # diferentes firmas según tu db.py
+@st.fragment
+def fragment_estado_pago(store, year: int, month: int):
+    st.subheader("Actualizar estado de pago mensual")
+
+    sel_cli = client_picker(store, "pago_cliente")
+    if sel_cli:
+        cli = store.client_by_name(sel_cli)
+        client_id = cli.get("id") if cli else None
+
+        # total del cliente en el mes
+        total_cli = load_month_totals(store, year, month).get(client_id, {}).get("monto", 0)
+        st.caption(f"Total del mes para **{sel_cli}**: {format_cop(total_cli)}")
+        try:
+            actual = store.month_payment(client_id, year, month)
+            if actual.get("paid"):
+                st.caption(f"Estado actual: **pagado** ({actual.get('paid_on_iso') or 'sin fecha'})")
+            else:
+                st.caption("Estado actual: **pendiente**")
+        except Exception:
+            pass
+
+        paid = st.checkbox("Pagado", key="pago_pagado")
+        paid_on = st.date_input("Fecha de pago", key="pago_fecha")
+        if st.button("Guardar estado de pago", use_container_width=True):
             try:
-                backend.add_session(client_id, ts_iso, int(valor))
-            except TypeError:
-                backend.add_session(cli_name, ts_iso, int(valor))
+                row = store.backend.set_month_payment(client_id, year, month, bool(paid), paid_on.isoformat() if paid else None)
+                store.apply_payment(row)
+                st.success("Estado de pago actualizado.")
+            except Exception as e:
+                st.error(f"No se pudo actualizar: {e}")
+
+@st.fragment
+def fragment_conciliar(store, year: int, month: int):
+    st.subheader("Conciliar extractos del mes")
+    files = st.file_uploader(
+        "Extractos CSV (Nequi, Bancolombia, Nu, Lulo: el canal sale del nombre del archivo)",
+        type=["csv"], accept_multiple_files=True, key="conc_archivos",
+    )
+    if not files:
+        return
 
-            st.success("Clase registrada.")
+    import reconcile
+
+    # se recalcula solo si cambian los archivos, el mes o los datos
+    key = (tuple((f.name, f.size) for f in files), year, month, store.generation)
+    cache = st.session_state.get("conciliacion")
+    if not cache or cache[0] != key:
+        start, end = month_start_end(year, month)
+        try:
+            tx = reconcile.read_statements(files)
+            unpaid = store.query_sessions(start_iso=start.isoformat(), end_iso=end.isoformat(), paid=False)
+            charges = reconcile.charges_frame(load_clients(store), unpaid)
+            res = reconcile.reconcile(tx, charges, year, month)
         except Exception as e:
-            st.error(f"No se pudo guardar: {e}")
+            st.error(f"No se pudieron conciliar los extractos: {e}")
+            return
+        cache = st.session_state["conciliacion"] = (key, res, len(tx))
+    _, res, n_tx = cache
+
+    m = res["matches"]
+    conf = m[m["estado"] == "confirmado"]
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Abonos", n_tx)
+    c2.metric("Confirmados", len(conf))
+    c3.metric("Por revisar", int((m["estado"] == "revisar").sum()))
+    cols = {"date": "Fecha", "amount": "Valor", "channel": "Canal", "text": "Detalle",
+            "client": "Cliente", "score": "Score", "motivo": "Coincide en"}
+    for estado, titulo in (("confirmado", "Confirmados"), ("revisar", "Por revisar (marcar a mano)")):
+        part = m[m["estado"] == estado][list(cols)].rename(columns=cols)
+        if not part.empty:
+            st.caption(titulo)
+            part["Fecha"] = part["Fecha"].dt.strftime("%d/%m/%Y")
+            part["Valor"] = part["Valor"].apply(format_cop)
+            st.dataframe(part, use_container_width=True, hide_index=True)
+    if not res["pendientes"].empty:
+        st.caption(f"Sin abono que coincida: {', '.join(res['pendientes']['client'])}")
+
+    if not conf.empty and st.button(f"Marcar {len(conf)} pagos confirmados", use_container_width=True):
+        try:
+            for row in store.backend.set_month_payments(reconcile.payment_rows(m, year, month)):
+                store.apply_payment(row)
+            st.success(f"{len(conf)} pagos marcados.")
+        except Exception as e:
+            st.error(f"No se pudieron marcar los pagos: {e}")
+
+def view_registro(store, year: int, month: int, mes_name: str):
+    fragment_registrar_clase(store)
 
     st.markdown("---")
     st.subheader(f"Clases del mes: {mes_name} {year}")
 
-    rows = load_sessions_month(backend, year, month)
+    rows = load_sessions_month(store, year, month)
 
     # Tabla amigable
-    def _rows_to_df(_rows):
-        out = []
-        for i, r in enumerate(sorted(_rows, key=lambda x: x.get("ts_iso")), start=1):
-            ts = r.get("ts_iso")
-            try:
-                dtt = dt.datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(None)
-            except Exception:
-                dtt = dt.datetime.fromisoformat(ts[:19])
-            out.append({
-                "N°": i,
-                "ID": r.get("id"),
-                "Cliente": r.get("client"),
-                "Fecha": dtt.strftime("%d/%m/%Y"),
-                "Hora": dtt.strftime("%H:%M"),
-                "Valor": format_cop(int(r.get("amount_int", 0))),
-            })
-        return pd.DataFrame(out)
-
-    df_mes = _rows_to_df(rows)
-    st.dataframe(df_mes.drop(columns=["ID"], errors="ignore"), use_container_width=True,hide_index=True)
+    df_mes = month_table(rows)
+    st.dataframe(df_mes, column_order=[c for c in df_mes.columns if c != "ID"], use_container_width=True, hide_index=True)
 
 
     col_d1, col_d2, col_d3 = st.columns(3)
     with col_d1:
         if not df_mes.empty:
-            st.download_button(
-                "⭳ Exportar clases del mes (CSV)",
-                data=df_to_csv_bytes(df_mes.drop(columns=["ID"])),
-                file_name=f"clases_{year}_{month:02d}.csv",
-                mime="text/csv",
-                use_container_width=True,
+            export_button(
+                store, "⭳ Exportar clases del mes", df_mes, f"clases_{year}_{month:02d}",
+                columns=[c for c in df_mes.columns if c != "ID"],
             )
     with col_d2:
         if not df_mes.empty:
             st.caption(f"Total clases: **{len(df_mes)}**")
     with col_d3:
         if not df_mes.empty:
-            total_mes = sum(int(r.get("amount_int", 0)) for r in rows)
+            total_mes = sum(t["monto"] for t in load_month_totals(store, year, month).values())
             st.caption(f"Total a cobrar: **{format_cop(total_mes)}**")
 
     # Borrado (por ID)
     if not df_mes.empty:
         with st.expander("Borrar un registro"):
-            id_to_del = st.selectbox("Selecciona el N° de la fila a borrar", df_mes["N°"].tolist())
+            keep_choice("reg_borrar", df_mes["N°"].tolist())
+            id_to_del = st.selectbox("Selecciona el N° de la fila a borrar", df_mes["N°"].tolist(), key="reg_borrar")
             if st.button("Borrar", type="primary"):
                 try:
-                    real_id = df_mes.loc[df_mes["N°"] == id_to_del, "ID"].values[0]
-                    backend.delete_session(real_id)
-                    st.success("Registro borrado.")
-                    st.rerun()
+                    real_id = int(df_mes.loc[df_mes["N°"] == id_to_del, "ID"].values[0])
+                    if store.backend.delete_session(real_id) is None:
+                        # p. ej. una clase de un año archivado (solo lectura)
+                        st.error("No se pudo borrar: el registro no existe o su año está archivado.")
+                    else:
+                        store.remove_session(real_id)
+                        st.success("Registro borrado.")
+                        st.rerun()
                 except Exception as e:
                     st.error(f"No se pudo borrar: {e}")
 
     st.markdown("---")
     st.subheader(f"Resumen por persona (mes seleccionado)")
 
-    df_res = monthly_summary(rows)
+    df_res = summary_from_totals(load_month_totals(store, year, month))
     if df_res.empty:
         st.info("Sin clases registradas este mes.")
     else:
         df_show = df_res.copy()
         df_show["Monto"] = df_show["Monto"].apply(format_cop)
         st.dataframe(df_show, use_container_width=True, hide_index=True)
-        st.download_button(
-            "⭳ Exportar resumen (CSV)",
-            data=df_to_csv_bytes(df_res),
-            file_name=f"resumen_{year}_{month:02d}.csv",
-            mime="text/csv",
-            use_container_width=True,
-        )
+        export_button(store, "⭳ Exportar resumen", df_res, f"resumen_{year}_{month:02d}")
 
     st.markdown("---")
-    st.subheader("Actualizar estado de pago mensual")
-
-    clients = load_clients(backend)
-    sel_cli = st.selectbox("Cliente", [c.get("name", "") for c in clients]) if clients else None
-    if sel_cli:
-        cli = next((c for c in clients if c.get("name","") == sel_cli), None)
-        client_id = cli.get("id") if cli else None
-
-        # total del cliente en el mes
-        total_cli = sum(int(r.get("amount_int", 0)) for r in rows if r.get("client") == sel_cli)
-        st.caption(f"Total del mes para **{sel_cli}**: {format_cop(total_cli)}")
+    fragment_estado_pago(store, year, month)
 
-        paid = st.checkbox("Pagado")
-        paid_on = st.date_input("Fecha de pago", value=now.date())
-        if st.button("Guardar estado de pago", use_container_width=True):
-            try:
-                backend.set_month_payment(client_id, year, month, bool(paid), paid_on.isoformat() if paid else None)
-                st.success("Estado de pago actualizado.")
-            except Exception as e:
-                st.error(f"No se pudo actualizar: {e}")
+    st.markdown("---")
+    fragment_conciliar(store, year, month)
 
 # ============
-# TAB 2: Calendario
+# VISTA 2: Calendario
 # ============
-with tab2:
+def view_calendario(store, year: int, month: int, mes_name: str):
     st.subheader(f"Calendario — {mes_name.capitalize()} {year}")
-    rows = load_sessions_month(backend, year, month)
+    rows = load_sessions_month(store, year, month)
     cal = to_calendar(rows)
 
     # Render simple: semana Lun-Dom
     start, _ = month_start_end(year, month)
     first_weekday = (start.weekday())  # 0=Lun
-    days_in_month = max(d for d in cal.keys() if len(cal[d]) or True)
     grid = []
     week = [""] * first_weekday
     for d in range(1, 32):
@@ -373,150 +553,366 @@ with tab2:
                     st.write("")
                     continue
                 st.markdown(f"**{day:02d}**")
-                items = sorted(cal.get(day, []), key=lambda r: r.get("ts_iso"))
                 tot_day = 0
-                for it in items:
-                    _dt = it.get("_dt")
-                    hhmm = _dt.strftime("%H:%M") if _dt else ""
+                for _dt, it in sorted(cal.get(day, ()), key=lambda p: p[0]):
+                    hhmm = _dt.strftime("%H:%M")
                     st.caption(f"{hhmm} · {it.get('client','')} · {format_cop(int(it.get('amount_int',0)))}")
                     tot_day += int(it.get("amount_int", 0))
                 if tot_day:
                     st.write(f"**Total día: {format_cop(tot_day)}**")
 
 # ============
-# TAB 3: Clientes & cobros
 # ============
-with tab3:
-    st.subheader("Gestión de clientes")
-
-    clients = load_clients(backend)
-    df_cli = pd.DataFrame(clients)
-    if not df_cli.empty:
-        show = df_cli[["name", "phone", "payment_method", "account", "note"]].rename(columns={
-            "name":"Nombre", "phone":"Teléfono", "payment_method":"Método de pago",
-            "account":"Cuenta/Alias", "note":"Nota"
-        })
-        st.dataframe(show, use_container_width=True, hide_index=True)
-        st.download_button(
-            "⭳ Exportar clientes (CSV)",
-            data=df_to_csv_bytes(show),
-            file_name="clientes.csv",
-            mime="text/csv",
-            use_container_width=True,
-        )
-    else:
-        st.info("Aún no tienes clientes.")
-
-    st.markdown("---")
+# VISTA 3: Clientes & cobros
+# ============
+@st.fragment
+def fragment_editar_cliente(store):
     st.subheader("Crear/Editar cliente")
 
     col1, col2 = st.columns(2)
     with col1:
-        cli_name = st.text_input("Nombre (único, normalizado)", "")
-        phone = st.text_input("Teléfono (opcional)", "")
-        method = st.selectbox("Método de pago", ["", "Nequi", "Bancolombia", "Nu", "Lulo", "Otro"])
+        cli_name = st.text_input("Nombre (único, normalizado)", "", key="cli_nombre")
+        phone = st.text_input("Teléfono (opcional)", "", key="cli_telefono")
+        method = st.selectbox("Método de pago", ["", "Nequi", "Bancolombia", "Nu", "Lulo", "Otro"], key="cli_metodo")
     with col2:
-        account = st.text_input("Cuenta/Alias", "")
-        note = st.text_area("Nota (opcional)", "", height=80)
+        account = st.text_input("Cuenta/Alias", "", key="cli_cuenta")
+        note = st.text_area("Nota (opcional)", "", height=80, key="cli_nota")
 
     if st.button("Guardar cliente", use_container_width=True):
         try:
-            backend.upsert_client(normalize_name(cli_name), phone or None, method or None, account or None, note or None)
+            name = normalize_name(cli_name)
+            row = store.backend.upsert_client(name, phone or None, method or None, account or None, note or None)
+            store.apply_client(row)
             st.success("Cliente guardado.")
-            st.rerun()
         except Exception as e:
             st.error(f"No se pudo guardar el cliente: {e}")
 
+    clients = load_clients(store)
     if clients:
         with st.expander("Borrar cliente"):
-            del_name = st.selectbox("Selecciona el cliente a borrar", [c.get("name","") for c in clients])
+            del_name = client_picker(store, "cli_borrar", "Cliente a borrar")
             if st.button("Borrar cliente definitivamente", type="primary"):
                 try:
-                    cli = next((c for c in clients if c.get("name","")==del_name), None)
-                    backend.delete_client(cli.get("id"))
+                    cli = store.client_by_name(del_name)
+                    store.backend.delete_client(cli.get("id"))
+                    store.remove_client(cli.get("id"))
                     st.success("Cliente borrado.")
-                    st.rerun()
+                    st.rerun(scope="fragment")
                 except Exception as e:
                     st.error(f"No se pudo borrar: {e}")
 
-    st.markdown("---")
+def render_invoice_pdf(invoice: Dict) -> bytes:
+    from pdf_utils import build_invoice_pdf  # reportlab solo al generar un PDF
+
+    return build_invoice_pdf(invoice)
+
+@st.fragment(run_every=0.5)
+def pdf_job_status(job: str):
+    """Se repite cada medio segundo mientras el PDF se genera; al terminar, rerun."""
+    import jobs
+
+    if jobs.shared().state(job) == "running":
+        st.caption("⏳ Generando PDF…")
+    else:
+        st.rerun()
+
+@st.fragment
+def fragment_cuenta_cobro(store):
     st.subheader("Generar cuenta de cobro mensual")
 
-    clients = load_clients(backend)
+    clients = load_clients(store)
     if not clients:
         st.info("Primero crea clientes.")
-    else:
-        ccol1, ccol2, ccol3 = st.columns(3)
-        with ccol1:
-            cli_name = st.selectbox("Cliente", [c.get("name","") for c in clients])
-        with ccol2:
-            inv_year = st.number_input("Año", min_value=2020, max_value=2100, value=year, step=1)
-        with ccol3:
-            inv_mes_name = st.selectbox("Mes", MESES_ES, index=MESES_ES.index(mes_name), key="mes_invoice")
-
-        inv_month = MES_TO_NUM[inv_mes_name]
-        # datos cliente
-        cli = next((c for c in clients if c.get("name","")==cli_name), None)
-        if cli:
-            st.caption(f"Método: **{cli.get('payment_method','')}** — Cuenta/Alias: **{cli.get('account','')}**")
-            copy_payment_button(cli)
-
-        # sesiones del mes/cliente
-        all_rows = load_sessions_month(backend, inv_year, inv_month)
-        items_cli = [r for r in all_rows if r.get("client")==cli_name]
-        det = []
-        total = 0
-        for r in sorted(items_cli, key=lambda x: x.get("ts_iso")):
-            ts = r.get("ts_iso")
-            try:
-                dtt = dt.datetime.fromisoformat(ts.replace("Z","+00:00")).astimezone(None)
-            except Exception:
-                dtt = dt.datetime.fromisoformat(ts[:19])
-            det.append({"fecha": dtt.strftime("%d/%m/%Y"), "hora": dtt.strftime("%H:%M"), "valor": int(r.get("amount_int",0))})
-            total += int(r.get("amount_int",0))
-
-        if items_cli:
-            st.write(f"Total clases: **{len(items_cli)}** — Total a cobrar: **{format_cop(total)}**")
-            # CSV detalle
-            df_det = pd.DataFrame([{"Fecha":d["fecha"], "Hora":d["hora"], "Valor":format_cop(d["valor"])} for d in det])
-            st.download_button(
-                "⭳ Descargar detalle (CSV)",
-                data=df_to_csv_bytes(df_det),
-                file_name=f"cuenta_{cli_name}_{inv_year}_{inv_month:02d}.csv",
-                mime="text/csv",
-                use_container_width=True,
-            )
+        return
 
-            # PDF cuenta (plantilla simple en pdf_utils.build_invoice_pdf)
-            if st.button("⭳ Descargar cuenta de cobro (PDF)", use_container_width=True):
+    ccol1, ccol2, ccol3 = st.columns(3)
+    with ccol1:
+        cli_name = client_picker(store, "inv_cliente")
+    with ccol2:
+        inv_year = st.number_input("Año", min_value=2020, max_value=2100, step=1, key="inv_anio")
+    with ccol3:
+        inv_mes_name = st.selectbox("Mes", MESES_ES, key="inv_mes")
+
+    inv_month = MES_TO_NUM[inv_mes_name]
+    # datos cliente
+    cli = store.client_by_name(cli_name) if cli_name else None
+    if cli:
+        st.caption(f"Método: **{cli.get('payment_method','')}** — Cuenta/Alias: **{cli.get('account','')}**")
+        copy_payment_button(cli)
+
+    # sesiones del mes de este cliente: solo sus filas (índice cliente + fecha)
+    items_cli = load_client_sessions_month(store, cli["id"], inv_year, inv_month) if cli else []
+
+    if items_cli and cli:
+        import pandas as pd
+
+        # Lo mismo que va al PDF; logo/emisor/nota se leen aquí para que el
+        # PDF se pueda generar fuera del hilo de Streamlit
+        invoice = invoice_data(
+            cli, inv_year, inv_month, items_cli,
+            logo_url=app_setting("APP_LOGO_URL", ""),
+            emisor=app_setting("EMISOR_NOMBRE", ""),
+            nota=app_setting("EMISOR_NOTA", ""),
+        )
+        det = invoice["clases"]
+        st.write(f"Total clases: **{len(det)}** — Total a cobrar: **{format_cop(invoice['total_int'])}**")
+        # CSV detalle
+        export_button(
+            store, "⭳ Descargar detalle",
+            lambda: pd.DataFrame({
+                "Fecha": [d["fecha_str"] for d in det],
+                "Hora": [d["hora_str"] for d in det],
+                "Valor": [format_cop(d["valor_int"]) for d in det],
+            }),
+            f"cuenta_{file_key(cli_name)}_{inv_year}_{inv_month:02d}",
+        )
+
+        # PDF en segundo plano (jobs.py): la UI sigue respondiendo y un doble
+        # clic o un rerun no lo vuelven a generar
+        import jobs
+
+        file_name = f"cuenta_{file_key(cli_name)}_{inv_year}_{inv_month:02d}.pdf"
+        if st.button("⭳ Descargar cuenta de cobro (PDF)", use_container_width=True):
+            st.session_state["inv_pdf_job"] = jobs.shared().submit(("pdf", invoice), render_invoice_pdf, invoice)
+        job = st.session_state.get("inv_pdf_job")
+        # solo si el trabajo es el de este cliente/mes (y no de uno anterior)
+        if job and job == jobs.job_id(("pdf", invoice)):
+            state = jobs.shared().state(job)
+            if state == "running":
+                pdf_job_status(job)
+            elif state == "done":
+                st.download_button(
+                    "Descargar PDF",
+                    data=jobs.shared().result(job),
+                    file_name=file_name,
+                    mime="application/pdf",
+                    use_container_width=True,
+                )
+            elif state == "failed":
                 try:
-                    invoice = {
-                        "client": cli_name,
-                        "year": inv_year,
-                        "month": inv_month,
-                        "month_name": inv_mes_name,
-                        "items": det,
-                        "total": total,
-                        "method": cli.get("payment_method",""),
-                        "account": cli.get("account",""),
-                        "created_at": dt.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    }
-                    try:
-                        pdf_bytes = build_invoice_pdf(invoice)  # firma recomendada
-                    except TypeError:
-                        # fallback si tu pdf_utils usa parámetros separados
-                        pdf_bytes = build_invoice_pdf(
-                            cli_name, inv_year, inv_month, det, total,
-                            cli.get("payment_method",""), cli.get("account","")
-                        )
-                    st.download_button(
-                        "Descargar PDF",
-                        data=pdf_bytes,
-                        file_name=f"cuenta_{cli_name}_{inv_year}_{inv_month:02d}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True,
-                    )
+                    jobs.shared().result(job)
                 except Exception as e:
                     st.error(f"No se pudo generar el PDF: {e}")
-        else:
-            st.info("Ese cliente no tiene clases registradas en el mes seleccionado.")
+    else:
+        st.info("Ese cliente no tiene clases registradas en el mes seleccionado.")
+
+@st.fragment
+def fragment_respaldo(store):
+    st.subheader("Respaldo de datos")
+    st.caption("Todas las tablas en un archivo NDJSON comprimido; sirve también para pasar de SQLite a Supabase.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Generar respaldo", use_container_width=True):
+            import backup
+
+            try:
+                buf = io.BytesIO()
+                counts = backup.dump(store.backend, buf)
+                st.caption(" · ".join(f"{t}: {n}" for t, n in counts.items()))
+                st.download_button(
+                    "⭳ Descargar respaldo",
+                    data=buf.getvalue(),
+                    file_name=f"respaldo_{dt.date.today().isoformat()}.ndjson.gz",
+                    mime="application/gzip",
+                    use_container_width=True,
+                )
+            except Exception as e:
+                st.error(f"No se pudo generar el respaldo: {e}")
+    with col2:
+        up = st.file_uploader("Restaurar desde un respaldo", type=["gz"], key="respaldo_archivo")
+        if up is not None and st.button("Restaurar", type="primary", use_container_width=True):
+            import backup
+
+            try:
+                counts = backup.restore(store.backend, up)
+                store.invalidate()
+                st.success("Respaldo restaurado: " + " · ".join(f"{t}: {n}" for t, n in counts.items()))
+            except Exception as e:
+                st.error(f"No se pudo restaurar: {e}")
+
+    # Solo SQLite: años cerrados a su propio archivo, en solo lectura
+    backend = store.backend
+    if hasattr(backend, "archive_year"):
+        with st.expander("Archivar años cerrados"):
+            archived = backend.archived_years()
+            if archived:
+                st.caption("Archivados: " + " · ".join(f"{y} ({n} clases)" for y, n in archived.items()))
+            closed = {y: n for y, n in backend.session_years().items() if y < dt.date.today().year}
+            if not closed:
+                st.caption("No hay años cerrados por archivar.")
+            else:
+                y = st.selectbox("Año", list(closed), format_func=lambda y: f"{y} ({closed[y]} clases)", key="archivar_anio")
+                st.caption("Las clases de ese año se siguen viendo, pero ya no se pueden agregar ni borrar.")
+                if st.button("Archivar", use_container_width=True):
+                    try:
+                        n = backend.archive_year(y)
+                        st.success(f"{y} archivado: {n} clases en {os.path.basename(backend.archive_path(y))}.")
+                    except Exception as e:
+                        st.error(f"No se pudo archivar: {e}")
+
+def view_clientes(store, year: int, month: int, mes_name: str):
+    st.subheader("Gestión de clientes")
+
+    import pandas as pd
+
+    clients = load_clients(store)
+    if clients:
+        cols = {
+            "name":"Nombre", "phone":"Teléfono", "payment_method":"Método de pago",
+            "account":"Cuenta/Alias", "note":"Nota"
+        }
+        show = pd.DataFrame({label: [c.get(k) for c in clients] for k, label in cols.items()})
+        st.dataframe(show, use_container_width=True, hide_index=True)
+        export_button(store, "⭳ Exportar clientes", show, "clientes")
+    else:
+        st.info("Aún no tienes clientes.")
+
+    st.markdown("---")
+    st.subheader("Saldos pendientes (todos los meses)")
+    saldos = load_balances(store)
+    if saldos:
+        df_saldos = pd.DataFrame({
+            "Cliente": [r["client"] for r in saldos],
+            "Meses sin pagar": [r["unpaid_months"] for r in saldos],
+            "Clases": [r["classes"] for r in saldos],
+            "Cobrado": [r["charged_int"] for r in saldos],
+            "Pagado": [r["paid_int"] for r in saldos],
+            "Saldo": [r["balance_int"] for r in saldos],
+        })
+        st.metric("Total por cobrar", format_cop(int(df_saldos["Saldo"].sum())))
+        df_show = df_saldos.copy()
+        for col in ("Cobrado", "Pagado", "Saldo"):
+            df_show[col] = df_show[col].apply(format_cop)
+        st.dataframe(df_show, use_container_width=True, hide_index=True)
+        export_button(store, "⭳ Exportar saldos", df_saldos, "saldos")
+    else:
+        st.info("Nadie tiene meses pendientes de pago.")
+
+    st.markdown("---")
+    fragment_editar_cliente(store)
+
+    st.markdown("---")
+    fragment_cuenta_cobro(store)
+
+    st.markdown("---")
+    fragment_respaldo(store)
+
+# ============
+# VISTA 4: Analítica
+# ============
+def load_analytics(store, year: int, month: int, months: int) -> Dict:
+    """
+    Tablas de analytics.build para los `months` meses que terminan en
+    year/month: una sola consulta por rango y el resultado se guarda mientras
+    store.generation no cambie.
+    """
+    import analytics
+
+    cache = st.session_state.setdefault("analytics", {})
+    key = (year, month, months, store.generation)
+    if key not in cache:
+        for k in [k for k in cache if k[-1] != store.generation]:
+            del cache[k]
+        start, end = analytics.month_range(year, month, months)
+        rows = store.sessions_between(start.isoformat(), end.isoformat())
+        cache[key] = analytics.build(rows, start, end)
+    return cache[key]
+
+def view_analitica(store, year: int, month: int, mes_name: str):
+    import altair as alt
+
+    c1, c2 = st.columns([3, 1])
+    with c2:
+        months = st.radio("Meses", [12, 24], horizontal=True, key="ana_meses")
+    with c1:
+        st.subheader(f"Analítica — {months} meses hasta {mes_name} {year}")
+    try:
+        data = load_analytics(store, year, month, months)
+    except Exception as e:
+        st.error(f"No se pudo calcular la analítica: {e}")
+        return
+
+    trend = data["tendencia"]
+    tot1, tot2, tot3 = st.columns(3)
+    tot1.metric("Ingresos", format_cop(int(trend["Monto"].sum())))
+    tot2.metric("Clases", int(trend["Clases"].sum()))
+    tot3.metric("Clientes", len(data["clientes"]))
+
+    st.markdown("**Ingresos y clases por mes**")
+    base = alt.Chart(trend).encode(x=alt.X("yearmonth(Mes):T", title=None))
+    st.altair_chart(
+        alt.layer(
+            base.mark_bar(opacity=0.7).encode(y=alt.Y("Monto:Q", title="Ingresos (COP)")),
+            base.mark_line(point=True, color="#e4572e").encode(y=alt.Y("Clases:Q", title="Clases")),
+        ).resolve_scale(y="independent"),
+        use_container_width=True,
+    )
+
+    st.markdown("**Ocupación por día y hora** (clases por semana, promedio)")
+    st.altair_chart(
+        alt.Chart(data["ocupacion"]).mark_rect().encode(
+            x=alt.X("Hora:O"),
+            y=alt.Y("Día:O", sort=list(data["ocupacion"]["Día"].cat.categories), title=None),
+            color=alt.Color("Por semana:Q", scale=alt.Scale(scheme="greens")),
+            tooltip=["Día", "Hora", "Clases", "Por semana"],
+        ),
+        use_container_width=True,
+    )
+
+    st.markdown("**Retención mes a mes**")
+    ret = data["retencion"].copy()
+    ret["Mes"] = ret["Mes"].dt.strftime("%Y-%m")
+    st.dataframe(ret, use_container_width=True, hide_index=True)
+
+    st.markdown("**Clientes** (los que hace más tiempo no vienen, al final)")
+    st.dataframe(
+        data["clientes"],
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "Monto": st.column_config.NumberColumn(format="$%d"),
+            "Primera": st.column_config.DateColumn(format="DD/MM/YYYY"),
+            "Última": st.column_config.DateColumn(format="DD/MM/YYYY"),
+        },
+    )
+    export_button(store, "⭳ Exportar clientes", lambda: data["clientes"], f"analitica_clientes_{year}_{month:02d}_{months}m")
+
+# -------------
+# Navegación
+# -------------
+keep_view_state({
+    "reg_valor": 30000,
+    "reg_hora": dt.time(hour=18, minute=0),
+    "inv_anio": year,
+    "inv_mes": mes_name,
+})
+
+# La vista activa también va en la URL (?v=1, ?v=2...) junto a año/mes
+if "vista" not in st.session_state:
+    try:
+        st.session_state["vista"] = VISTAS[int(qp.get("v", 0))]
+    except Exception:
+        st.session_state["vista"] = VISTAS[0]
+
+vista = st.radio("Vista", VISTAS, horizontal=True, key="vista", label_visibility="collapsed")
+st.query_params["v"] = str(VISTAS.index(vista))
+
+VIEWS = {
+    VISTAS[0]: view_registro,
+    VISTAS[1]: view_calendario,
+    VISTAS[2]: view_clientes,
+    VISTAS[3]: view_analitica,
+}
+metrics.begin_rerun(vista)
+try:
+    if profiling:
+        profiler = Profiler(app_setting("PROFILE_DIR", "profiles")).start()
+    VIEWS[vista](store, year, month, mes_name)
+finally:
+    rec = metrics.end_rerun(year=year, month=month)
+    if show_perf:
+        performance_panel(rec, metrics.session, metrics.reruns)
+    if profiler is not None:
+        profiler.stop()
+        profile_panel(profiler, profiler.save(vista))
@@ -54,7 +54,7 @@ def require_login():
 
 def sign_out():
     """Cerrar sesión sencilla: limpiar estado y recargar."""
-    for k in ("logged_in", "user_email", "pkce_verifier", "access_token"):
+    for k in ("logged_in", "user_email", "pkce_verifier", "access_token", "store"):
         st.session_state.pop(k, None)
     os.environ.pop("OWNER_EMAIL", None)
     st.query_params.clear()
@@ -0,0 +1,160 @@
+# backup.py — Respaldo y restauración completos en NDJSON comprimido (gzip).
+#
+#   python backup.py dump respaldo.ndjson.gz                 # desde entrenos.db
+#   python backup.py load respaldo.ndjson.gz --sqlite otra.db
+#   python backup.py dump respaldo.ndjson.gz --supabase      # SUPABASE_URL / SUPABASE_ANON_KEY
+#
+# Formato: una línea JSON por registro
+#   {"backup": 1, "created_at": "...", "source": "SQLite"}
+#   {"table": "clients", "columns": ["id", "name", ...]}
+#   [1, "Ana Gómez", ...]             <- una fila por línea, en el orden de columns
+#   {"end": "clients", "rows": 500}
+#   ... (sessions, monthly_payments, invoices)
+#
+# Se lee y se escribe en streaming (páginas de iter_rows / lotes de
+# insert_rows), así que la memoria no depende del tamaño de la base; lo único
+# que se guarda completo es el mapa de ids de clientes para reasignar client_id.
+import argparse
+import datetime as dt
+import gzip
+import json
+import os
+import sys
+import time
+
+from db import TABLE_COLS
+from utils import name_norm_key
+
+FORMAT_VERSION = 1
+
+
+def dump(backend, out, page_size=5000, tables=None, progress=None):
+    """
+    Escribe el respaldo en `out` (ruta o archivo binario). Devuelve
+    {tabla: filas}.
+    """
+    counts = {}
+    with gzip.open(out, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "backup": FORMAT_VERSION,
+            "created_at": dt.datetime.now().isoformat(timespec="seconds"),
+            "source": getattr(backend, "label", type(backend).__name__),
+        }) + "\n")
+        for table in tables or TABLE_COLS:
+            cols = TABLE_COLS[table].split(",")
+            f.write(json.dumps({"table": table, "columns": cols}) + "\n")
+            n = 0
+            for row in backend.iter_rows(table, page_size):
+                f.write(json.dumps([row.get(c) for c in cols], ensure_ascii=False, separators=(",", ":")) + "\n")
+                n += 1
+            f.write(json.dumps({"end": table, "rows": n}) + "\n")
+            counts[table] = n
+            if progress:
+                progress(table, n)
+    return counts
+
+
+def restore(backend, src, chunk_size=5000, progress=None):
+    """
+    Carga un respaldo (ruta o archivo binario) en `backend` con inserciones
+    masivas. Los client_id se reasignan a los ids del destino por nombre; las
+    filas de clientes que no se pudieron resolver se cuentan en "skipped".
+    Cada tabla cuenta las filas que de verdad se escribieron: las que ya
+    estaban (mismo nombre, uid o cuenta) no suman. Las sesiones de años que
+    el destino tiene archivados (solo lectura, SQLiteBackend.archive_year) no
+    se insertan: se cuentan en "archived".
+    """
+    counts = {"skipped": 0, "archived": 0}
+    archived = set(getattr(backend, "archived_years", dict)())
+    old_keys = {}  # id de origen -> name_norm
+    idmap = None
+    table, cols, chunk = None, None, []
+
+    def flush():
+        if chunk:
+            counts[table] += backend.insert_rows(table, chunk)
+            chunk.clear()
+
+    with gzip.open(src, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("backup") != FORMAT_VERSION:
+            raise ValueError("El archivo no es un respaldo válido (o es de otra versión).")
+        for line in f:
+            rec = json.loads(line)
+            if isinstance(rec, list):
+                row = dict(zip(cols, rec))
+                if table == "clients":
+                    old_keys[row["id"]] = name_norm_key(row["name"])
+                else:
+                    if idmap is None:
+                        idmap = _client_idmap(backend, old_keys)
+                    row["client_id"] = idmap.get(row["client_id"])
+                    if row["client_id"] is None:
+                        counts["skipped"] += 1
+                        continue
+                    if table == "sessions" and int(row["ts_iso"][:4]) in archived:
+                        counts["archived"] += 1
+                        continue
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    flush()
+            elif "table" in rec:
+                table, cols = rec["table"], rec["columns"]
+                counts[table] = 0
+            elif "end" in rec:
+                flush()
+                if progress:
+                    progress(table, counts[table])
+    return counts
+
+
+def _client_idmap(backend, old_keys):
+    """id de origen -> id en el destino, emparejando por name_norm."""
+    new_ids = {name_norm_key(c["name"]): c["id"] for c in backend.list_clients()}
+    return {old: new_ids.get(key) for old, key in old_keys.items()}
+
+
+# ---------------------------
+# Línea de comandos
+# ---------------------------
+def _backend(args):
+    if args.supabase:
+        from db import SupabaseBackend
+
+        url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY")
+        if not (url and key):
+            sys.exit("Faltan SUPABASE_URL / SUPABASE_ANON_KEY en el entorno.")
+        b = SupabaseBackend(url, key)
+        b.label = "Supabase"
+        return b
+    from db import SQLiteBackend
+
+    b = SQLiteBackend(args.sqlite)
+    b.label = "SQLite"
+    return b
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Respaldo y restauración en NDJSON comprimido.")
+    ap.add_argument("action", choices=("dump", "load"))
+    ap.add_argument("path", help="archivo .ndjson.gz")
+    ap.add_argument("--sqlite", default="entrenos.db", help="base SQLite (por defecto entrenos.db)")
+    ap.add_argument("--supabase", action="store_true", help="usar Supabase con las variables de entorno")
+    ap.add_argument("--chunk", type=int, default=5000, help="filas por página / lote")
+    args = ap.parse_args(argv)
+
+    backend = _backend(args)
+    t0 = time.perf_counter()
+
+    def progress(table, n):
+        print(f"{table}: {n} filas ({time.perf_counter() - t0:.1f} s)", file=sys.stderr)
+
+    if args.action == "dump":
+        counts = dump(backend, args.path, args.chunk, progress=progress)
+    else:
+        counts = restore(backend, args.path, args.chunk, progress=progress)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
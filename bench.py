@@ -0,0 +1,446 @@
+# bench.py — Micro-benchmarks del backend, las transformaciones y el PDF.
+#
+#   python bench.py                        # escalas s, m y l
+#   python bench.py --scales s,m --out bench.json
+#   python bench.py --backend fake --latency 40 --jitter 10
+#   python bench.py --imports              # solo tiempos de importación
+#   python bench.py --compare viejo.json nuevo.json
+#
+# Para cada escala se genera una base SQLite sintética (synthetic.py) y se mide
+# cada operación: tiempo (mediana y mínimo de --repeat corridas), memoria
+# (pico y neto con tracemalloc) y round trips al backend (sentencias SQL en
+# SQLite, requests HTTP con --backend fake, que corre SupabaseBackend contra
+# fake_postgrest.py). El resultado es JSON para poder comparar entre commits.
+#
+# Los tiempos de importación se miden con `python -X importtime` en un proceso
+# nuevo por corrida (arranque en frío): las importaciones de cabecera de
+# app.py y algunos módulos sueltos.
+import argparse
+import ast
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# nombre -> código a importar (None = las importaciones de cabecera de app.py)
+IMPORT_TARGETS = {
+    "app": None,
+    "db": "import db",
+    "reports": "import reports",
+    "pdf_utils": "import pdf_utils",
+    "cli": "import cli",
+}
+
+# escala -> (clientes, sesiones)
+SCALES = {
+    "s": (20, 1_000),
+    "m": (100, 10_000),
+    "l": (500, 100_000),
+}
+
+
+# ---------------------------
+# Conteo de round trips
+# ---------------------------
+class RoundTrips:
+    """Cuenta las idas al backend: sentencias SQL o requests al servidor falso."""
+
+    def __init__(self, backend, server=None):
+        self.server = server
+        self._sql = 0
+        if server is None and hasattr(backend, "_conn"):
+            orig = backend._conn
+
+            def _conn():
+                con = orig()
+                con.set_trace_callback(self._hit)
+                return con
+
+            backend._conn = _conn
+
+        if server is None and hasattr(backend, "_write"):
+            orig_write = backend._write
+
+            # las escrituras corren en el hilo escritor con su propia conexión
+            # (transaction=False y demás argumentos pasan tal cual)
+            def _write(fn, *args, **kwargs):
+                def traced(con):
+                    con.set_trace_callback(self._hit)
+                    try:
+                        return fn(con)
+                    finally:
+                        con.set_trace_callback(None)
+                return orig_write(traced, *args, **kwargs)
+
+            backend._write = _write
+
+    def _hit(self, *_):
+        self._sql += 1
+
+    def total(self):
+        return self.server.request_count if self.server is not None else self._sql
+
+
+def measure(fn, repeat, trips=None, setup=None):
+    """
+    Corre fn `repeat` veces cronometradas y una más bajo tracemalloc. setup,
+    si hay, corre antes de cada vez y no se mide (ni sus round trips).
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+
+    if setup:
+        setup()
+    before = trips.total() if trips is not None else 0
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(
+        median_ms=round(statistics.median(times), 3),
+        min_ms=round(min(times), 3),
+        peak_kib=round((peak - base) / 1024, 1),
+        net_kib=round((current - base) / 1024, 1),
+        round_trips=(trips.total() - before) if trips is not None else None,
+    )
+
+
+# ---------------------------
+# Casos
+# ---------------------------
+def backend_cases(backend, info):
+    """
+    Un caso por cada método de Backend: (nombre, fn) o (nombre, fn, setup).
+    archive_year solo existe en SQLite; con --backend fake no se mide.
+    """
+    from utils import new_uid
+
+    end = dt.date.fromisoformat(info["end"])
+    last = end - dt.timedelta(days=1)
+    m_start = dt.datetime(last.year, last.month, 1)
+    m_end = dt.datetime(end.year, end.month, 1)
+    y_start = dt.datetime(last.year, 1, 1)
+
+    some = backend.list_clients()[len(backend.list_clients()) // 2]
+    seq = iter(range(10**9))
+    created_clients, created_sessions = [], []
+
+    def add_client():
+        created_clients.append(backend.add_client({"name": f"Bench Cliente {next(seq)}"}))
+
+    def log_session():
+        created_sessions.append(backend.log_session(some["id"], m_start.isoformat(), 30000)["id"])
+
+    def add_session():
+        created_sessions.append(backend.add_session(some["name"], m_start.isoformat(), 30000)["id"])
+
+    def record_class():
+        created_sessions.append(backend.record_class(some["name"], m_start.isoformat(), 30000)[1]["id"])
+
+    def delete_session():
+        backend.delete_session(created_sessions.pop() if created_sessions else -1)
+
+    def delete_client():
+        backend.delete_client(created_clients.pop() if created_clients else -1)
+
+    # 20 clientes pagados en el último mes (se sobrescriben en cada corrida)
+    payments = [
+        dict(client_id=c["id"], year=last.year, month=last.month, paid=True, paid_on_iso=last.isoformat())
+        for c in backend.list_clients()[:20]
+    ]
+
+    # insert_rows: 100 sesiones nuevas (uid distinto) en un año sin datos
+    old = y_start.replace(year=y_start.year - 5)
+
+    def insert_rows():
+        backend.insert_rows("sessions", [
+            {"client_id": some["id"], "ts_iso": (old + dt.timedelta(hours=i)).isoformat(),
+             "amount_int": 30000, "uid": new_uid()}
+            for i in range(100)
+        ])
+
+    # archive_year: cada corrida archiva un año distinto (un año archivado no
+    # se vuelve a abrir). El setup, sin medir, copia las sesiones del primer
+    # año de la base a un año libre (1990, 1991, ...).
+    y0 = int(backend.query_sessions(limit=1)[0]["ts_iso"][:4])
+    first = backend.query_sessions(start_iso=f"{y0}-01-01", end_iso=f"{y0 + 1}-01-01")
+    years = iter(range(1990, 2000))
+    target = []
+
+    def copy_year():
+        target.append(next(years))
+        backend.insert_rows("sessions", [
+            {"client_id": r["client_id"], "ts_iso": f"{target[-1]}{r['ts_iso'][4:]}",
+             "amount_int": r["amount_int"], "uid": new_uid()}
+            for r in first
+        ])
+
+    def month_filters():
+        return dict(start_iso=m_start.isoformat(), end_iso=m_end.isoformat())
+
+    cases = [
+        ("list_clients", backend.list_clients),
+        ("get_client_by_name_ci", lambda: backend.get_client_by_name_ci(some["name"].upper())),
+        ("add_client", add_client),
+        ("update_client", lambda: backend.update_client(some["id"], {"note": "bench"})),
+        ("upsert_client", lambda: backend.upsert_client(some["name"], some["phone"], "Nequi", "bench", None)),
+        ("log_session", log_session),
+        ("add_session", add_session),
+        ("record_class", record_class),
+        ("list_sessions_between[month]", lambda: backend.list_sessions_between(m_start.isoformat(), m_end.isoformat())),
+        ("list_sessions_between[year]", lambda: backend.list_sessions_between(y_start.isoformat(), m_end.isoformat())),
+        ("delete_session", delete_session),
+        ("get_month_payment", lambda: backend.get_month_payment(some["id"], last.year, last.month)),
+        ("set_month_payment", lambda: backend.set_month_payment(some["id"], last.year, last.month, True, last.isoformat())),
+        ("set_month_payments[20]", lambda: backend.set_month_payments(payments)),
+        ("delete_client", delete_client),
+        ("search_clients", lambda: backend.search_clients(some["name"].split()[0][:3])),
+        ("query_sessions[client, month]", lambda: backend.query_sessions(client_id=some["id"], **month_filters())),
+        ("query_sessions[unpaid, month, top 50]", lambda: backend.query_sessions(
+            paid=False, order="amount_int", desc=True, limit=50, **month_filters())),
+        ("outstanding_balances", backend.outstanding_balances),
+        ("rebuild_ledger[dry_run]", lambda: backend.rebuild_ledger(dry_run=True)),
+        ("rebuild_ledger", backend.rebuild_ledger),
+        ("iter_rows[sessions]", lambda: sum(1 for _ in backend.iter_rows("sessions"))),
+        ("insert_rows[100]", insert_rows),
+    ]
+    if hasattr(backend, "archive_year"):
+        cases.append(("archive_year", lambda: backend.archive_year(target[-1]), copy_year))
+    return cases, (m_start, m_end)
+
+
+def transform_cases(backend, month_range):
+    import reports
+    from store import DataStore
+
+    start, end = (d.isoformat() for d in month_range)
+    rows = backend.list_sessions_between(start, end)
+    store = DataStore(backend)
+    store.sessions_between(start, end)
+
+    def cold_totals():
+        store._totals.clear()
+        return store.totals_between(start, end)
+
+    return [
+        ("month_table", lambda: reports.month_table(rows)),
+        ("monthly_summary", lambda: reports.monthly_summary(rows)),
+        ("summary_from_totals", lambda: reports.summary_from_totals(store.totals_between(start, end))),
+        ("store.totals_between[cold]", cold_totals),
+        ("to_calendar", lambda: reports.to_calendar(rows)),
+        ("df_to_csv_bytes", lambda: reports.df_to_csv_bytes(reports.month_table(rows))),
+    ], len(rows)
+
+
+def pdf_cases():
+    from pdf_utils import build_invoice_pdf
+
+    def datos(n):
+        return {
+            "cliente": {"name": "Ana Gómez", "phone": "3000000000", "payment_method": "Nequi", "account": "3000000000"},
+            "year": 2024,
+            "month": 5,
+            "clases": [{"fecha_str": f"{1 + i % 28:02d}/05/2024", "hora_str": "18:00", "valor_int": 30000} for i in range(n)],
+            "total_int": 30000 * n,
+            "hoy_str": "2024-06-01",
+        }
+
+    return [
+        (f"build_invoice_pdf[{n}]", lambda d=datos(n): build_invoice_pdf(d))
+        for n in (8, 30)
+    ]
+
+
+def run_scale(label, n_clients, n_sessions, repeat, tmpdir, args):
+    import synthetic
+    from db import SQLiteBackend
+
+    path = os.path.join(tmpdir, f"bench_{label}.db")
+    t0 = time.perf_counter()
+    info = synthetic.build_sqlite(path, n_clients, n_sessions)
+    gen_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    if args.backend == "fake":
+        from db import SupabaseBackend
+        from fake_postgrest import FakePostgREST
+
+        srv = FakePostgREST(latency_ms=args.latency, jitter_ms=args.jitter, seed=0).start()
+        srv.import_sqlite(path)
+        try:
+            backend = SupabaseBackend(srv.url, "bench")
+            return _run_cases(label, n_clients, n_sessions, gen_ms, info, backend, RoundTrips(backend, srv), repeat)
+        finally:
+            srv.stop()
+
+    backend = SQLiteBackend(path)
+    return _run_cases(label, n_clients, n_sessions, gen_ms, info, backend, RoundTrips(backend), repeat)
+
+
+def _run_cases(label, n_clients, n_sessions, gen_ms, info, backend, trips, repeat):
+    results = []
+
+    cases, month_range = backend_cases(backend, info)
+    for name, fn, *setup in cases:
+        results.append(dict(group="backend", name=name, **measure(fn, repeat, trips, *setup)))
+
+    cases, n_rows = transform_cases(backend, month_range)
+    for name, fn in cases:
+        results.append(dict(group="transform", name=name, rows=n_rows, **measure(fn, repeat)))
+
+    return dict(scale=label, clients=n_clients, sessions=n_sessions, generate_ms=gen_ms, results=results)
+
+
+# ---------------------------
+# Tiempos de importación
+# ---------------------------
+def app_imports():
+    """Las sentencias import de primer nivel de app.py, como código ejecutable."""
+    with open(os.path.join(HERE, "app.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return "\n".join(
+        ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def import_time(code, repeat):
+    """Mediana del tiempo total de importación y los paquetes raíz más pesados."""
+    runs = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, cwd=HERE,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        total, roots, n = 0, {}, 0
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cum_us, name = line[len("import time:"):].split("|")
+            total += int(self_us)
+            n += 1
+            if not name[1:].startswith(" "):  # sin sangría: importado directamente
+                roots[name.strip()] = int(cum_us) / 1000
+        runs.append((total / 1000, roots, n))
+    runs.sort(key=lambda r: r[0])
+    total_ms, roots, n = runs[len(runs) // 2]
+    return dict(
+        median_ms=round(total_ms, 2),
+        min_ms=round(runs[0][0], 2),
+        modules=n,
+        heaviest=[
+            dict(module=k, ms=round(v, 2))
+            for k, v in sorted(roots.items(), key=lambda kv: kv[1], reverse=True)[:8]
+        ],
+    )
+
+
+def import_cases(repeat):
+    out = []
+    for name, code in IMPORT_TARGETS.items():
+        out.append(dict(group="imports", name=name, **import_time(code or app_imports(), repeat)))
+        print(f"importación {name} lista", file=sys.stderr)
+    return out
+
+
+def git_rev():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, cwd=HERE,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(old_path, new_path):
+    """Tabla de cambios de mediana entre dos corridas."""
+    def index(doc):
+        out = {
+            (s["scale"], r["group"], r["name"]): r
+            for s in doc["scales"] for r in s["results"]
+        }
+        for r in doc.get("imports", []) + doc.get("pdf", []):
+            out[("-", r["group"], r["name"])] = r
+        return out
+    with open(old_path) as f:
+        old = index(json.load(f))
+    with open(new_path) as f:
+        new = index(json.load(f))
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key]["median_ms"], new[key]["median_ms"]
+        ratio = (b / a) if a else float("inf")
+        print(f"{key[0]:>2} {key[1]:<9} {key[2]:<34} {a:>10.3f} → {b:>10.3f} ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks de backend, transformaciones y PDF.")
+    ap.add_argument("--scales", default="s,m,l", help="lista de escalas (s,m,l) o CLIENTESxSESIONES")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--backend", choices=("sqlite", "fake"), default="sqlite")
+    ap.add_argument("--latency", type=float, default=0.0, help="ms por request (solo --backend fake)")
+    ap.add_argument("--jitter", type=float, default=0.0, help="± ms (solo --backend fake)")
+    ap.add_argument("--out", help="archivo JSON de salida (por defecto stdout)")
+    ap.add_argument("--imports", action="store_true", help="medir solo los tiempos de importación")
+    ap.add_argument("--compare", nargs=2, metavar=("VIEJO", "NUEVO"))
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    doc = dict(
+        rev=git_rev(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        created_at=dt.datetime.now().isoformat(timespec="seconds"),
+        repeat=args.repeat,
+        backend=args.backend,
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        scales=[],
+    )
+    doc["imports"] = import_cases(args.repeat)
+    if args.imports:
+        _emit(doc, args.out)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for label in args.scales.split(","):
+            if label in SCALES:
+                n_clients, n_sessions = SCALES[label]
+            else:
+                n_clients, n_sessions = (int(x) for x in label.lower().split("x"))
+            doc["scales"].append(run_scale(label, n_clients, n_sessions, args.repeat, tmpdir, args))
+            print(f"escala {label} lista", file=sys.stderr)
+
+    doc["pdf"] = [dict(group="pdf", name=name, **measure(fn, args.repeat)) for name, fn in pdf_cases()]
+    _emit(doc, args.out)
+
+
+def _emit(doc, path):
+    out = json.dumps(doc, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
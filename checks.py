@@ -0,0 +1,300 @@
+# checks.py — Comprobaciones automáticas sobre una base sintética (synthetic.py).
+#
+#   python checks.py                   # SQLite y SupabaseBackend contra fake_postgrest.py
+#   python checks.py --backend sqlite
+#   python checks.py -k respaldo       # solo las que contienen "respaldo"
+#
+# Cada check_* recibe un backend recién armado con datos sintéticos (una base
+# chica, igual para todas) y una carpeta temporal, hace sus operaciones y
+# compara con assert: lo que más fácil se rompe sin que la app lo muestre.
+# Sale con código 1 si alguna falla.
+import argparse
+import contextlib
+import datetime as dt
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import synthetic
+from utils import name_norm_key, new_uid
+
+# Tamaño de la base sintética de cada check
+N_CLIENTS = 40
+N_SESSIONS = 3_000
+LEDGER_OK = {"months": 0, "clients": 0}
+
+
+@contextlib.contextmanager
+def open_backend(kind, tmpdir, empty=False):
+    """SQLiteBackend o SupabaseBackend (servidor falso) con la base sintética, o vacío."""
+    from db import SQLiteBackend, SupabaseBackend
+
+    path = os.path.join(tmpdir, f"{kind}_{new_uid()}.db")
+    if not empty:
+        synthetic.build_sqlite(path, N_CLIENTS, N_SESSIONS, years=2)
+    if kind == "sqlite":
+        yield SQLiteBackend(path)
+        return
+    from fake_postgrest import FakePostgREST
+
+    with FakePostgREST(seed=0) as srv:
+        if not empty:
+            srv.import_sqlite(path)
+        yield SupabaseBackend(srv.url, "checks")
+
+
+def _this_month():
+    return dt.date.today().replace(day=1)
+
+
+def _snapshot(b):
+    """Contenido comparable entre bases (por nombre de cliente, no por id)."""
+    clients = {c["id"]: c for c in b.iter_rows("clients")}
+    name = {cid: name_norm_key(c["name"]) for cid, c in clients.items()}
+    return {
+        "clients": sorted(
+            (name[cid], c["phone"], c["payment_method"], c["account"], c["note"]) for cid, c in clients.items()
+        ),
+        "sessions": sorted(
+            (name[r["client_id"]], r["ts_iso"], r["amount_int"], r["uid"] or "") for r in b.iter_rows("sessions")
+        ),
+        "payments": sorted(
+            (name[r["client_id"]], r["year"], r["month"], r["paid"], r["paid_on_iso"] or "")
+            for r in b.iter_rows("monthly_payments")
+        ),
+        "invoices": sorted(
+            (name[r["client_id"]], r["year"], r["month"], r["total_int"], r["created_at"])
+            for r in b.iter_rows("invoices")
+        ),
+    }
+
+
+def _unpaid_by_client(b, start_iso=None, end_iso=None):
+    """Suma de las sesiones de meses sin pagar por cliente (por defecto, toda la base)."""
+    month = _this_month()
+    start_iso = start_iso or month.replace(year=month.year - 3).isoformat()
+    end_iso = end_iso or month.replace(year=month.year + 2).isoformat()
+    owed = {}
+    for s in b.query_sessions(start_iso, end_iso, paid=False):
+        owed[s["client_id"]] = owed.get(s["client_id"], 0) + s["amount_int"]
+    return owed
+
+
+# ---------------------------
+# Checks
+# ---------------------------
+def check_upsert_idempotente(b, tmpdir):
+    n = len(b.list_clients())
+    first = b.upsert_client("Prueba Idempotente", "3000000001", "Nequi", "@prueba", None)
+    again = b.upsert_client("  prueba   IDEMPOTENTE ", "3000000002", "Nequi", "@prueba", "nota")
+    assert again["id"] == first["id"], (first, again)
+    assert again["phone"] == "3000000002" and again["note"] == "nota", again
+    assert len(b.list_clients()) == n + 1
+
+
+def check_reintento_uid(b, tmpdir):
+    first = b.upsert_client("Prueba Reintento", None, None, None, None)
+    n = len(b.list_clients())
+    # el mismo uid (un reintento) no duplica la clase ni crea otro cliente
+    ts = dt.datetime.combine(_this_month(), dt.time(18)).isoformat()
+    uid = new_uid()
+    c1, s1 = b.record_class("Prueba Reintento", ts, 30000, uid=uid)
+    c2, s2 = b.record_class("Otro Nombre", ts, 30000, uid=uid)
+    assert s2["id"] == s1["id"] and c2["id"] == first["id"], (c2, s2)
+    assert b.get_client_by_name_ci("Otro Nombre") is None
+    assert b.log_session(first["id"], ts, 30000, uid=uid)["id"] == s1["id"]
+    assert len(b.query_sessions(client_id=first["id"])) == 1
+    assert len(b.list_clients()) == n
+
+
+def check_libro_de_cuentas(b, tmpdir):
+    assert b.rebuild_ledger(dry_run=True) == LEDGER_OK, "el libro no coincide tras la carga"
+
+    month = _this_month()
+    prev = (month - dt.timedelta(days=1)).replace(day=1)
+    clients = b.list_clients()
+    a, c, d = clients[0], clients[1], clients[2]
+    # clases nuevas en un mes pagado y en uno sin pagar, y una borrada
+    b.set_month_payment(a["id"], prev.year, prev.month, True, prev.isoformat())
+    for day in (2, 3, 4):
+        b.log_session(a["id"], dt.datetime(prev.year, prev.month, day, 7).isoformat(), 30000)
+        b.log_session(c["id"], dt.datetime(month.year, month.month, day, 18).isoformat(), 35000)
+    gone = b.log_session(c["id"], dt.datetime(month.year, month.month, 5, 18).isoformat(), 35000)
+    b.delete_session(gone["id"])
+    # pagos que se marcan, se desmarcan y en lote
+    b.set_month_payment(c["id"], month.year, month.month, True, month.isoformat())
+    b.set_month_payment(c["id"], month.year, month.month, False, None)
+    b.set_month_payments([
+        dict(client_id=cl["id"], year=prev.year, month=prev.month, paid=True, paid_on_iso=prev.isoformat())
+        for cl in clients[3:13]
+    ])
+    b.update_client(a["id"], {"name": a["name"] + " Renombrada"})
+    b.delete_client(d["id"])
+
+    assert b.rebuild_ledger(dry_run=True) == LEDGER_OK, "los triggers no llevaron bien el libro"
+    # el saldo de cada cliente es lo de sus meses sin pagar
+    owed = {cid: v for cid, v in _unpaid_by_client(b).items() if v > 0}
+    balances = {r["client_id"]: r["balance_int"] for r in b.outstanding_balances()}
+    assert balances == owed, (balances, owed)
+    assert d["id"] not in balances
+
+
+def check_respaldo(b, tmpdir):
+    import backup
+
+    cli = b.list_clients()[0]
+    ts = dt.datetime.combine(_this_month(), dt.time(6)).isoformat()
+    for i in range(3):
+        b.log_session(cli["id"], ts, 30000 + i, uid=new_uid())
+    month = _this_month()
+    b.insert_rows("invoices", [dict(
+        client_id=cli["id"], year=month.year, month=month.month, total_int=90000,
+        method=cli["payment_method"], account=cli["account"], classes_json="[]", created_at=ts,
+    )])
+    out = os.path.join(tmpdir, "respaldo.ndjson.gz")
+    counts = backup.dump(b, out)
+    assert counts["sessions"] == N_SESSIONS + 3, counts
+
+    kind = "sqlite" if hasattr(b, "_conn") else "fake"
+    with open_backend(kind, tmpdir, empty=True) as dst:
+        res = backup.restore(dst, out)
+        assert res == dict(counts, skipped=0, archived=0), (res, counts)
+        src = _snapshot(b)
+        assert _snapshot(dst) == src
+        assert dst.rebuild_ledger(dry_run=True) == LEDGER_OK
+        # restaurarlo otra vez no duplica las sesiones con uid ni las cuentas
+        res = backup.restore(dst, out)
+        no_uid = sum(1 for s in src["sessions"] if not s[3])
+        assert res == dict(clients=0, sessions=no_uid, monthly_payments=counts["monthly_payments"],
+                           invoices=0, skipped=0, archived=0), res
+        again = _snapshot(dst)
+        with_uid = [s for s in again["sessions"] if s[3]]
+        assert with_uid == [s for s in src["sessions"] if s[3]], len(with_uid)
+        assert again["invoices"] == src["invoices"] and len(src["invoices"]) == 1, again["invoices"]
+
+
+def check_respaldo_archivado(b, tmpdir):
+    import backup
+
+    if not hasattr(b, "archive_year"):  # solo SQLite archiva años
+        return
+    out = os.path.join(tmpdir, "respaldo.ndjson.gz")
+    counts = backup.dump(b, out)
+    old = _this_month().year - 1
+    n_old = b.session_years()[old]
+    b.archive_year(old, vacuum=False)
+    before = _snapshot(b)
+    # en la misma base: lo del año archivado se omite en vez de abortar el lote
+    res = backup.restore(b, out)
+    assert res["archived"] == n_old and res["skipped"] == 0, res
+    assert res["sessions"] == counts["sessions"] - n_old, res
+    after = _snapshot(b)
+    assert after["clients"] == before["clients"] and after["payments"] == before["payments"]
+    assert b.rebuild_ledger(dry_run=True) == LEDGER_OK
+
+    # en una base vacía que ya archivó ese año (sin sesiones en el archivo)
+    with open_backend("sqlite", tmpdir, empty=True) as dst:
+        dst.archive_year(old, vacuum=False)
+        res = backup.restore(dst, out)
+        assert res["archived"] == n_old and res["sessions"] == counts["sessions"] - n_old, res
+        assert old not in dst.session_years()
+
+
+def check_conciliacion(b, tmpdir):
+    import reconcile as rc
+
+    month = _this_month().replace(year=_this_month().year + 1)  # un mes sin datos
+    y, m = month.year, month.month
+    a, bb, c, d = b.list_clients()[:4]
+    # a: 90.000, d: 100.000, b y c deben lo mismo (70.000)
+    for cli, n, amount in ((a, 3, 30000), (bb, 2, 35000), (c, 2, 35000), (d, 4, 25000)):
+        for day in range(1, n + 1):
+            b.log_session(cli["id"], dt.datetime(y, m, day, 18).isoformat(), amount)
+    d_name = d["name"].upper()
+
+    def day(n):
+        return (month + dt.timedelta(days=n)).strftime("%d/%m/%Y")
+
+    with open(os.path.join(tmpdir, "bancolombia_checks.csv"), "w", encoding="utf-8") as f:
+        f.write("Fecha;Descripción;Valor\n")
+        f.write(f"{day(9)};Transferencia de {a['account']};$ 90.000\n")  # alias -> confirmado
+        f.write(f"{day(10)};Compra tienda;-90.000\n")  # débito: se descarta
+    with open(os.path.join(tmpdir, "nequi_checks.csv"), "w", encoding="utf-8") as f:
+        f.write("Fecha,Descripción,Valor\n")
+        f.write(f"{day(11)},PAGO DE {d_name},100000\n")  # nombre en el mes
+        f.write(f"{day(12)},Transferencia recibida,70000\n")  # b o c: empate
+        f.write(f"{day(13)},Abono,55555\n")  # ningún cliente debe eso
+        f.write(f"{day(70)},Transferencia de {a['account']},90000\n")  # fuera de la ventana
+    tx = rc.read_statements(sorted(
+        os.path.join(tmpdir, n) for n in os.listdir(tmpdir) if n.endswith("_checks.csv")
+    ))
+    assert len(tx) == 5, tx
+    assert set(tx["channel"]) == {"Bancolombia", "Nequi"}
+
+    start, end = month.isoformat(), (month + dt.timedelta(days=32)).replace(day=1).isoformat()
+    charges = rc.charges_frame(b.list_clients(), b.query_sessions(start, end, paid=False))
+    res = rc.reconcile(tx, charges, y, m)
+    matches = res["matches"]
+    state = {(int(r.client_id), r.estado) for r in matches.itertuples()}
+    assert (a["id"], "confirmado") in state and (d["id"], "confirmado") in state, matches
+    assert {(bb["id"], "revisar"), (c["id"], "revisar")} <= state, matches
+    score = dict(zip(matches["client_id"], matches["score"]))
+    assert score[a["id"]] >= rc.SCORE_ALIAS + rc.SCORE_DATE
+    assert score[d["id"]] >= rc.CONFIRM_AT  # nombre + en el mes alcanzan para confirmar
+    assert list(res["sin_cliente"]["amount"]) == [55555], res["sin_cliente"]
+    assert set(res["pendientes"]["client_id"]) == {bb["id"], c["id"]}
+
+    rows = rc.payment_rows(matches, y, m)
+    assert {r["client_id"] for r in rows} == {a["id"], d["id"]}, rows
+    b.set_month_payments(rows)
+    assert b.get_month_payment(a["id"], y, m)["paid"]
+    assert set(_unpaid_by_client(b, start_iso=start, end_iso=end)) == {bb["id"], c["id"]}
+    assert b.rebuild_ledger(dry_run=True) == LEDGER_OK
+
+
+CHECKS = [
+    check_upsert_idempotente, check_reintento_uid, check_libro_de_cuentas, check_respaldo,
+    check_respaldo_archivado, check_conciliacion,
+]
+
+
+# ---------------------------
+# Ejecución
+# ---------------------------
+def run(kinds, pattern=None, out=sys.stdout):
+    """Corre los checks en cada backend; devuelve cuántos fallaron."""
+    failed = 0
+    for kind in kinds:
+        for check in CHECKS:
+            name = check.__name__[len("check_"):]
+            if pattern and pattern not in name:
+                continue
+            t0 = time.perf_counter()
+            with tempfile.TemporaryDirectory() as tmpdir:
+                try:
+                    with open_backend(kind, tmpdir) as b:
+                        check(b, tmpdir)
+                except Exception:
+                    failed += 1
+                    print(f"FALLA {kind:6} {name}", file=out)
+                    traceback.print_exc(file=out)
+                    continue
+            print(f"ok    {kind:6} {name} ({time.perf_counter() - t0:.1f} s)", file=out)
+    return failed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Comprobaciones automáticas sobre datos sintéticos.")
+    ap.add_argument("--backend", choices=["sqlite", "fake", "both"], default="both")
+    ap.add_argument("-k", dest="pattern", help="solo los checks cuyo nombre contenga esto")
+    args = ap.parse_args(argv)
+    kinds = ["sqlite", "fake"] if args.backend == "both" else [args.backend]
+    failed = run(kinds, args.pattern)
+    if failed:
+        sys.exit(f"{failed} check(s) fallaron")
+
+
+if __name__ == "__main__":
+    main()
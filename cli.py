@@ -0,0 +1,337 @@
+# cli.py — Tareas por lotes sin Streamlit (cierre de mes, importaciones).
+#
+#   python cli.py export sessions 2025-01 2025-03 -o clases.csv
+#   python cli.py export summary 2025-03                    # CSV a stdout
+#   python cli.py import clients clientes.csv
+#   python cli.py import sessions clases.csv                # client,ts_iso,amount_int
+#   python cli.py invoices 2025-03 -o cuentas/              # un PDF por cliente
+#   python cli.py pay 2025-03 "Ana Gómez" "Luis Pérez"      # --all: todos los del mes
+#   python cli.py export balances -o saldos.csv             # saldo pendiente por cliente
+#   python cli.py reconcile 2025-03 extractos/*.csv         # propuesta de conciliación (CSV a stdout)
+#   python cli.py reconcile 2025-03 extractos/*.csv --apply # y marca pagados los confirmados
+#   python cli.py rebuild                                   # índice de búsqueda, libro de cuentas + ANALYZE
+#   python cli.py ledger --check                            # ¿el libro de cuentas cuadra?
+#   python cli.py bench -- --scales s --repeat 3            # bench.py con esos argumentos
+#
+# Backend: Supabase si SUPABASE_URL y SUPABASE_ANON_KEY están en el entorno
+# (OWNER_EMAIL opcional), si no SQLite (--sqlite, por defecto entrenos.db).
+# En Supabase, `ledger` necesita la clave service_role en SUPABASE_ANON_KEY
+# (rebuild_ledger no se concede a anon: migrations/011_rebuild_ledger_grants.sql).
+# Para el PDF: APP_LOGO_URL, EMISOR_NOMBRE y EMISOR_NOTA, también del entorno.
+#
+# Solo se importa lo que usa cada comando (nada de Streamlit ni pandas): el
+# arranque es el de db.py. Las sesiones se recorren de a páginas
+# (iter_sessions_between) y los CSV se leen y escriben fila por fila, así que
+# la memoria no crece con el tamaño del mes.
+import argparse
+import csv
+import datetime as dt
+import os
+import sys
+import time
+
+from analytics import month_range
+from db import BALANCE_FIELDS, CLIENT_COLS, backend_from_env
+from utils import file_key, name_norm_key, new_uid
+
+SESSION_FIELDS = ["id", "client_id", "client", "ts_iso", "amount_int"]
+CLIENT_FIELDS = ["name", "phone", "payment_method", "account", "note"]
+
+
+def parse_month(s):
+    """'2025-03' -> (2025, 3)"""
+    try:
+        d = dt.datetime.strptime(s, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Mes inválido (AAAA-MM): {s}")
+    return d.year, d.month
+
+
+def months_between(first, last):
+    """(inicio, fin exclusivo) de cada mes de first a last, ambos incluidos."""
+    n = (last[0] * 12 + last[1]) - (first[0] * 12 + first[1]) + 1
+    if n < 1:
+        raise SystemExit("El mes final es anterior al inicial.")
+    y, m = first
+    for _ in range(n):
+        yield month_range(y, m, 1)
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def iter_sessions(backend, first, last, page_size=5000):
+    # mes por mes: cada consulta es corta y usa el índice por fecha
+    for start, end in months_between(first, last):
+        yield from backend.iter_sessions_between(start.isoformat(), end.isoformat(), page_size)
+
+
+def _open_out(path):
+    if not path or path == "-":
+        return sys.stdout
+    return open(path, "w", newline="", encoding="utf-8")
+
+
+def _progress(t0, what, n):
+    print(f"{what}: {n} ({time.perf_counter() - t0:.1f} s)", file=sys.stderr)
+
+
+# ---------------------------
+# Comandos
+# ---------------------------
+def cmd_export(backend, args):
+    last = args.last or args.first
+    out = _open_out(args.out)
+    w = csv.writer(out)
+    n = 0
+    if args.what == "sessions":
+        w.writerow(SESSION_FIELDS)
+        for r in iter_sessions(backend, args.first, last, args.chunk):
+            w.writerow([r["id"], r["client_id"], r["client"], r["ts_iso"], r["amount_int"]])
+            n += 1
+    elif args.what == "balances":
+        w.writerow(BALANCE_FIELDS)
+        for r in backend.outstanding_balances():
+            w.writerow([r[c] for c in BALANCE_FIELDS])
+            n += 1
+    elif args.what == "clients":
+        cols = CLIENT_COLS.split(",")
+        w.writerow(cols)
+        for r in backend.iter_rows("clients", args.chunk):
+            w.writerow([r.get(c) for c in cols])
+            n += 1
+    else:
+        # summary: clases y monto por cliente en el rango
+        tot = {}
+        for r in iter_sessions(backend, args.first, last, args.chunk):
+            t = tot.setdefault(r["client_id"], [r["client"], 0, 0])
+            t[1] += 1
+            t[2] += int(r["amount_int"] or 0)
+        w.writerow(["client_id", "client", "clases", "monto"])
+        for cid, (name, clases, monto) in sorted(tot.items(), key=lambda kv: kv[1][0] or ""):
+            w.writerow([cid, name, clases, monto])
+        n = len(tot)
+    if out is not sys.stdout:
+        out.close()
+    return n
+
+
+def cmd_import(backend, args):
+    t0 = time.perf_counter()
+    n, chunk = 0, []
+    ids = None  # name_norm -> id, solo para sesiones
+
+    def flush():
+        nonlocal ids
+        if not chunk:
+            return 0
+        if args.what == "clients":
+            backend.insert_rows("clients", chunk)
+        else:
+            if ids is None:
+                ids = {name_norm_key(c["name"]): c["id"] for c in backend.list_clients()}
+            # los clientes que no existen se crean juntos, en un lote
+            nuevos = {name_norm_key(r["client"]): r["client"] for r in chunk if r.get("client") and
+                      name_norm_key(r["client"]) not in ids}
+            if nuevos:
+                backend.insert_rows("clients", [{"name": nm} for nm in nuevos.values()])
+                ids = {name_norm_key(c["name"]): c["id"] for c in backend.list_clients()}
+            rows = []
+            for r in chunk:
+                cid = r.get("client_id") or ids.get(name_norm_key(r.get("client") or ""))
+                if not cid:
+                    raise SystemExit(f"Fila sin cliente: {r}")
+                # el uid del CSV si lo trae (reimportarlo no duplica), si no uno nuevo
+                rows.append({"client_id": int(cid), "ts_iso": r["ts_iso"], "amount_int": int(r["amount_int"]),
+                             "uid": r.get("uid") or new_uid()})
+            backend.insert_rows("sessions", rows)
+        k = len(chunk)
+        chunk.clear()
+        return k
+
+    with open(args.path, newline="", encoding="utf-8-sig") as f:
+        for r in csv.DictReader(f):
+            if args.what == "clients":
+                if not (r.get("name") or "").strip():
+                    continue
+                r = {k: r.get(k) or None for k in CLIENT_FIELDS}
+            chunk.append(r)
+            if len(chunk) >= args.chunk:
+                n += flush()
+                _progress(t0, args.what, n)
+        n += flush()
+    if hasattr(backend, "rebuild"):
+        backend.rebuild()
+    return n
+
+
+def cmd_invoices(backend, args):
+    from pdf_utils import build_invoice_pdf  # reportlab solo para este comando
+    from reports import invoice_data
+
+    year, month = args.month
+    start, end = month_range(year, month, 1)
+    clientes = {c["id"]: c for c in backend.list_clients()}
+    if args.client:
+        # solo las filas de esos clientes, filtradas en el backend
+        by_name = {name_norm_key(c["name"]): cid for cid, c in clientes.items()}
+        ids = [by_name[k] for k in map(name_norm_key, args.client) if k in by_name]
+        rows = backend.query_sessions(start.isoformat(), end.isoformat(), client_id=ids)
+    else:
+        rows = backend.iter_sessions_between(start.isoformat(), end.isoformat(), args.chunk)
+    por_cliente = {}
+    for r in rows:
+        por_cliente.setdefault(r["client_id"], []).append(r)
+    extra = {
+        "logo_url": os.getenv("APP_LOGO_URL", ""),
+        "emisor": os.getenv("EMISOR_NOMBRE", ""),
+        "nota": os.getenv("EMISOR_NOTA", ""),
+    }
+    os.makedirs(args.out, exist_ok=True)
+    t0 = time.perf_counter()
+    n = 0
+    for cid, rows in por_cliente.items():
+        cli = clientes.get(cid)
+        if cli is None:
+            continue
+        datos = invoice_data(cli, year, month, rows, **extra)
+        path = os.path.join(args.out, f"cuenta_{file_key(cli['name'])}_{year}_{month:02d}.pdf")
+        with open(path, "wb") as f:
+            f.write(build_invoice_pdf(datos))
+        n += 1
+        if n % 50 == 0:
+            _progress(t0, "cuentas", n)
+    return n
+
+
+def cmd_pay(backend, args):
+    year, month = args.month
+    if args.all:
+        start, end = month_range(year, month, 1)
+        ids = {r["client_id"] for r in backend.iter_sessions_between(start.isoformat(), end.isoformat(), args.chunk)}
+    else:
+        by_name = {name_norm_key(c["name"]): c["id"] for c in backend.list_clients()}
+        missing = [c for c in args.clients if name_norm_key(c) not in by_name]
+        if missing:
+            raise SystemExit("No existen: " + ", ".join(missing))
+        ids = {by_name[name_norm_key(c)] for c in args.clients}
+    paid = not args.unpaid
+    when = (args.date or dt.date.today().isoformat()) if paid else None
+    # una sola escritura (en Supabase, un solo request) para todo el mes
+    payments = [dict(client_id=cid, year=year, month=month, paid=paid, paid_on_iso=when) for cid in sorted(ids)]
+    return len(backend.set_month_payments(payments))
+
+
+def cmd_reconcile(backend, args):
+    import reconcile  # pandas solo para este comando
+
+    year, month = args.month
+    start, end = month_range(year, month, 1)
+    tx = reconcile.read_statements(args.statements)
+    # lo que se debe del mes: solo las sesiones de meses sin pagar
+    unpaid = backend.query_sessions(start.isoformat(), end.isoformat(), paid=False)
+    charges = reconcile.charges_frame(backend.list_clients(), unpaid)
+    res = reconcile.reconcile(tx, charges, year, month, args.grace)
+    m = res["matches"]
+    out = _open_out(args.out)
+    m.assign(date=m["date"].dt.date).to_csv(out, index=False)
+    if out is not sys.stdout:
+        out.close()
+    conf = int((m["estado"] == "confirmado").sum())
+    print(
+        f"abonos: {len(tx)}, confirmados: {conf}, por revisar: {len(m) - conf}, "
+        f"sin cliente: {len(res['sin_cliente'])}, clientes sin abono: {len(res['pendientes'])}",
+        file=sys.stderr,
+    )
+    if not args.apply:
+        return 0
+    return len(backend.set_month_payments(reconcile.payment_rows(m, year, month)))
+
+
+def cmd_rebuild(backend, args):
+    if not hasattr(backend, "rebuild"):
+        raise SystemExit("Solo aplica a SQLite (en Supabase los índices los mantiene Postgres).")
+    backend.rebuild()
+    return 0
+
+
+def cmd_ledger(backend, args):
+    diff = backend.rebuild_ledger(dry_run=args.check)
+    verb = "distintos" if args.check else "corregidos"
+    print(f"meses {verb}: {diff['months']}, saldos {verb}: {diff['clients']}", file=sys.stderr)
+    if args.check and (diff["months"] or diff["clients"]):
+        raise SystemExit(1)
+    return diff["months"]
+
+
+COMMANDS = {
+    "export": cmd_export,
+    "import": cmd_import,
+    "invoices": cmd_invoices,
+    "pay": cmd_pay,
+    "rebuild": cmd_rebuild,
+    "ledger": cmd_ledger,
+    "reconcile": cmd_reconcile,
+}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Tareas por lotes sobre la base de entrenamientos (sin Streamlit).")
+    ap.add_argument("--sqlite", default="entrenos.db", help="base SQLite si no hay Supabase en el entorno")
+    ap.add_argument("--chunk", type=int, default=5000, help="filas por página / lote")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("export", help="CSV de sesiones, clientes o resumen por cliente")
+    p.add_argument("what", choices=("sessions", "clients", "summary", "balances"))
+    p.add_argument("first", type=parse_month, nargs="?", default=None, help="mes inicial AAAA-MM")
+    p.add_argument("last", type=parse_month, nargs="?", default=None, help="mes final (por defecto el inicial)")
+    p.add_argument("-o", "--out", help="archivo de salida (por defecto stdout)")
+
+    p = sub.add_parser("import", help="carga masiva desde CSV")
+    p.add_argument("what", choices=("clients", "sessions"))
+    p.add_argument("path", help="CSV con encabezado (clients: name,phone,...; sessions: client,ts_iso,amount_int)")
+
+    p = sub.add_parser("invoices", help="cuentas de cobro en PDF de un mes")
+    p.add_argument("month", type=parse_month, help="AAAA-MM")
+    p.add_argument("-o", "--out", default=".", help="carpeta de salida")
+    p.add_argument("--client", action="append", default=[], help="solo este cliente (se puede repetir)")
+
+    p = sub.add_parser("pay", help="marcar el pago de un mes")
+    p.add_argument("month", type=parse_month, help="AAAA-MM")
+    p.add_argument("clients", nargs="*", help="nombres de clientes")
+    p.add_argument("--all", action="store_true", help="todos los clientes con clases en el mes")
+    p.add_argument("--unpaid", action="store_true", help="marcar como pendiente")
+    p.add_argument("--date", help="fecha de pago AAAA-MM-DD (por defecto hoy)")
+
+    sub.add_parser("rebuild", help="reconstruir el índice de búsqueda, el libro de cuentas y las estadísticas (SQLite)")
+
+    p = sub.add_parser("reconcile", help="cruzar extractos (CSV) con lo que se debe del mes")
+    p.add_argument("month", type=parse_month, help="AAAA-MM")
+    p.add_argument("statements", nargs="+", help="extractos CSV (el canal sale del nombre: nequi_*.csv, ...)")
+    p.add_argument("-o", "--out", help="propuesta en CSV (por defecto stdout)")
+    p.add_argument("--grace", type=int, default=10, help="días del mes siguiente que aún cuentan")
+    p.add_argument("--apply", action="store_true", help="marcar pagados los cruces confirmados")
+
+    p = sub.add_parser("ledger", help="recalcular el libro de cuentas (saldos por cliente)")
+    p.add_argument("--check", action="store_true", help="solo comparar; sale con 1 si no cuadra")
+
+    p = sub.add_parser("bench", help="bench.py con los argumentos que siguen")
+    p.add_argument("rest", nargs=argparse.REMAINDER)
+
+    args = ap.parse_args(argv)
+    if args.cmd == "bench":
+        import bench
+
+        rest = args.rest[1:] if args.rest[:1] == ["--"] else args.rest
+        return bench.main(rest)
+    if args.cmd == "export" and args.what in ("sessions", "summary") and args.first is None:
+        ap.error("export sessions/summary necesita el mes inicial (AAAA-MM)")
+    if args.cmd == "pay" and not (args.all or args.clients):
+        ap.error("pay necesita nombres de clientes o --all")
+
+    backend = backend_from_env(args.sqlite)
+    t0 = time.perf_counter()
+    n = COMMANDS[args.cmd](backend, args)
+    print(f"{args.cmd}: {n} ({time.perf_counter() - t0:.1f} s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
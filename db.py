@@ -1,10 +1,15 @@
 import os
 import json
+import re
 import sqlite3
+import sys
+import time
 from datetime import datetime
-import requests
+from urllib.parse import quote
 
-from utils import name_norm_key, normalize_name, DEFAULT_CLASE_COP
+from records import Client, Session, interner
+from sqlite_writer import writer_for
+from utils import name_norm_key, new_uid, normalize_name, search_key, DEFAULT_CLASE_COP
 
 # ======================================================
 # Interfaz común
@@ -25,27 +30,80 @@ class Backend:
         raise NotImplementedError
 
     def delete_client(self, client_id):
+        """
+        Borra el cliente con sus sesiones, pagos y cuentas de cobro. En SQLite,
+        si tiene clases en años archivados (archive_year) no se borra nada y
+        se lanza sqlite3.IntegrityError.
+        """
         raise NotImplementedError
 
-    def log_session(self, client_id, ts_iso, amount_int):
+    def log_session(self, client_id, ts_iso, amount_int, uid=None):
         raise NotImplementedError
 
     def list_sessions_between(self, start_iso, end_iso):
         raise NotImplementedError
 
+    def iter_sessions_between(self, start_iso, end_iso, page_size=5000):
+        """Como list_sessions_between, pero de a poco (exportaciones grandes, cli.py)."""
+        yield from self.list_sessions_between(start_iso, end_iso)
+
+    def query_sessions(self, start_iso=None, end_iso=None, client_id=None, min_amount=None, max_amount=None,
+                       paid=None, order="ts_iso", desc=False, limit=None, offset=0):
+        """
+        Sesiones filtradas en el backend (SQL / filtros de PostgREST), no en
+        Python:
+        - start_iso <= ts_iso < end_iso (cualquiera puede faltar)
+        - client_id: un id o una lista de ids
+        - min_amount <= amount_int <= max_amount
+        - paid: True/False según el pago del mes (monthly_payments) de cada
+          sesión; None no filtra
+        - order: "ts_iso" o "amount_int" (desc=True invierte); luego por id
+        - limit / offset para paginar
+        """
+        raise NotImplementedError
+
     def delete_session(self, session_id):
         raise NotImplementedError
 
+    def outstanding_balances(self):
+        """
+        Clientes con saldo pendiente, del mayor al menor: {client_id, client,
+        classes, charged_int, paid_int, balance_int, unpaid_months}. Sale de
+        client_balances, que los triggers mantienen al día con cada sesión y
+        cada pago: cobrado es el monto de todas sus clases, pagado el de los
+        meses marcados como pagados y saldo el de los meses sin pagar.
+        """
+        raise NotImplementedError
+
+    def rebuild_ledger(self, dry_run=False):
+        """
+        Recalcula el libro de cuentas desde sesiones y pagos; devuelve
+        {"months": n, "clients": n} con las filas que no coincidían.
+        """
+        raise NotImplementedError
+
     def get_month_payment(self, client_id, year, month):
         raise NotImplementedError
 
     def set_month_payment(self, client_id, year, month, paid: bool, paid_on_iso: str | None):
         raise NotImplementedError
 
+    def set_month_payments(self, payments):
+        """
+        Varios set_month_payment en una sola escritura (conciliación de
+        extractos): payments = [{client_id, year, month, paid, paid_on_iso}].
+        Devuelve los pagos tal como quedaron guardados.
+        """
+        raise NotImplementedError
+
     def upsert_client(self, name, phone, payment_method, account, note):
         """Crear o actualizar un cliente por nombre (case-insensitive)."""
         raise NotImplementedError
 
+    def search_clients(self, query, limit=20):
+        """Clientes cuyo nombre contiene cada palabra de `query` (las primeras `limit`)."""
+        raise NotImplementedError
+
     def add_session(self, client, ts_iso, amount_int):
         """
         Compatibilidad con app.py:
@@ -53,6 +111,80 @@ class Backend:
         """
         raise NotImplementedError
 
+    def record_class(self, client, ts_iso, amount_int, uid=None):
+        """
+        Registra una clase en una sola operación: resuelve el cliente (id, o
+        nombre que se crea si no existe) e inserta la sesión. Devuelve
+        (cliente, sesión) tal como quedaron guardados. Si el id no existe,
+        LookupError y no se inserta nada.
+        uid (utils.new_uid) identifica la clase: si ya hay una sesión con ese
+        uid se devuelve esa y no se inserta otra, así un reintento (timeout,
+        doble clic) no cobra la clase dos veces. Sin uid se genera uno.
+        """
+        raise NotImplementedError
+
+    # ---- respaldo / restauración (backup.py) ----
+    def iter_rows(self, table, page_size=1000):
+        """Recorre una tabla completa por páginas; filas con las columnas de TABLE_COLS."""
+        raise NotImplementedError
+
+    def insert_rows(self, table, rows):
+        """
+        Inserción masiva para restaurar. Los ids de origen se ignoran (cada
+        backend asigna los suyos); clientes con un nombre ya existente y
+        sesiones con un uid ya existente se omiten, y los pagos del mismo mes
+        se sobrescriben. Devuelve cuántas filas se escribieron de verdad (sin
+        las omitidas).
+        """
+        raise NotImplementedError
+
+    # Las escrituras (salvo add_client, que devuelve el id) devuelven la fila
+    # tal como quedó guardada, para que la app la aplique a su caché sin releer:
+    # - clientes: {id,name,phone,payment_method,account,note,created_at}
+    # - sesiones: {id,client_id,client,ts_iso,amount_int}
+    #   (insertadas con un uid único: ver record_class)
+    # - pagos:    {client_id,year,month,paid,paid_on_iso}
+
+
+CLIENT_COLS = "id,name,phone,payment_method,account,note,created_at"
+SESSION_COLS = "id,client_id,ts_iso,amount_int,uid"
+PAYMENT_COLS = "client_id,year,month,paid,paid_on_iso"
+INVOICE_COLS = "id,client_id,year,month,total_int,method,account,classes_json,created_at"
+BALANCE_COLS = "client_id,classes,charged_int,paid_int,balance_int,unpaid_months"
+# filas de outstanding_balances
+BALANCE_FIELDS = ["client_id", "client", "classes", "charged_int", "paid_int", "balance_int", "unpaid_months"]
+
+# Tablas que entran en un respaldo, en orden de restauración
+TABLE_COLS = {
+    "clients": CLIENT_COLS,
+    "sessions": SESSION_COLS,
+    "monthly_payments": PAYMENT_COLS,
+    "invoices": INVOICE_COLS,
+}
+
+
+def _table_row(table, cols, values):
+    row = dict(zip(cols, values))
+    if table == "monthly_payments":
+        row["paid"] = bool(row.get("paid"))
+    return row
+
+
+def _client_row(r):
+    return Client(*r[:7])
+
+
+def _session_row(r):
+    return Session(*r[:5])
+
+
+def _payment_row(r):
+    return dict(client_id=r[0], year=r[1], month=r[2], paid=bool(r[3]), paid_on_iso=r[4])
+
+
+def _balance_row(r):
+    return dict(zip(BALANCE_FIELDS, r))
+
 
 # ======================================================
 # Backend SQLite (fallback local)
@@ -64,16 +196,27 @@ class SQLiteBackend(Backend):
         self._init()
 
     def _conn(self):
-        return sqlite3.connect(self.path, check_same_thread=False)
+        # uri=True para poder adjuntar los años archivados en solo lectura
+        return sqlite3.connect(self.path, check_same_thread=False, uri=True)
+
+    def _write(self, fn, transaction=True):
+        """
+        Ejecuta fn(con) en el hilo escritor de este archivo (sqlite_writer.py):
+        se confirma junto con las escrituras de otras sesiones que lleguen a la
+        vez. Las lecturas siguen usando _conn().
+        """
+        return writer_for(self.path).run(fn, transaction)
 
     def _init(self):
         with self._conn() as con:
             cur = con.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
             cur.execute("""
             CREATE TABLE IF NOT EXISTS clients(
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               name TEXT NOT NULL,
               name_norm TEXT NOT NULL UNIQUE,
+              search_key TEXT,
               phone TEXT,
               payment_method TEXT,
               account TEXT,
@@ -82,15 +225,33 @@ class SQLiteBackend(Backend):
             )
             """)
             cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_name_norm ON clients(name_norm)")
+            # search_key (utils.search_key: sin tildes) para buscar con LIKE
+            # cuando no hay FTS5; las bases anteriores la llenan aquí
+            if "search_key" not in {r[1] for r in cur.execute("PRAGMA table_info(clients)")}:
+                cur.execute("ALTER TABLE clients ADD COLUMN search_key TEXT")
+            cur.executemany(
+                "UPDATE clients SET search_key=? WHERE id=?",
+                [(search_key(nm), cid) for cid, nm in
+                 cur.execute("SELECT id, name FROM clients WHERE search_key IS NULL").fetchall()],
+            )
+            self.fts = self._init_fts(cur)
             cur.execute("""
             CREATE TABLE IF NOT EXISTS sessions(
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               client_id INTEGER NOT NULL,
               ts_iso TEXT NOT NULL,
               amount_int INTEGER NOT NULL,
+              uid TEXT,
               FOREIGN KEY(client_id) REFERENCES clients(id)
             )
             """)
+            # bases anteriores a uid: la columna se agrega (queda NULL en las viejas)
+            if "uid" not in {r[1] for r in cur.execute("PRAGMA table_info(sessions)")}:
+                cur.execute("ALTER TABLE sessions ADD COLUMN uid TEXT")
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_uid ON sessions(uid)")
+            # rangos de fechas (el mes) y un cliente dentro de un rango (query_sessions)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_ts ON sessions(ts_iso)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_client_ts ON sessions(client_id, ts_iso)")
             cur.execute("""
             CREATE TABLE IF NOT EXISTS monthly_payments(
               id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -117,27 +278,206 @@ class SQLiteBackend(Backend):
               FOREIGN KEY(client_id) REFERENCES clients(id)
             )
             """)
+            # Clave natural de una cuenta: restaurar dos veces el mismo respaldo
+            # no la duplica (insert_rows). Las bases anteriores pudieron quedar
+            # con copias de una restauración repetida: se deja la primera.
+            if not cur.execute("SELECT 1 FROM sqlite_master WHERE name='idx_invoices_natural'").fetchone():
+                cur.execute("""
+                DELETE FROM invoices WHERE id NOT IN (
+                  SELECT MIN(id) FROM invoices GROUP BY client_id, year, month, created_at
+                )
+                """)
+                cur.execute(
+                    "CREATE UNIQUE INDEX idx_invoices_natural ON invoices(client_id, year, month, created_at)"
+                )
+            # Años cerrados cuyas sesiones se movieron a su propio archivo
+            # (archive_year); en la base principal ya no se escriben.
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS archives(
+              year INTEGER PRIMARY KEY,
+              file TEXT NOT NULL,
+              rows INTEGER NOT NULL,
+              archived_at TEXT NOT NULL
+            )
+            """)
+            cur.executescript("""
+            CREATE TRIGGER IF NOT EXISTS sessions_archived_ins BEFORE INSERT ON sessions
+            WHEN EXISTS (SELECT 1 FROM archives WHERE year = CAST(substr(new.ts_iso, 1, 4) AS INTEGER))
+            BEGIN SELECT RAISE(ABORT, 'Ese año está archivado (solo lectura).'); END;
+            CREATE TRIGGER IF NOT EXISTS sessions_archived_upd BEFORE UPDATE OF ts_iso ON sessions
+            WHEN EXISTS (SELECT 1 FROM archives WHERE year = CAST(substr(new.ts_iso, 1, 4) AS INTEGER))
+            BEGIN SELECT RAISE(ABORT, 'Ese año está archivado (solo lectura).'); END;
+            """)
+            new_ledger = self._init_ledger(cur)
+            # Un cliente con clases en años archivados no se borra: esas
+            # sesiones están en archivos de solo lectura y quedarían sin
+            # cliente. El libro de cuentas guarda sus meses (archive_year no
+            # los descuenta), así que basta mirar ledger_months.
+            cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS clients_archived_del BEFORE DELETE ON clients
+            WHEN EXISTS (SELECT 1 FROM ledger_months l JOIN archives a ON a.year = l.year
+                         WHERE l.client_id = old.id AND l.classes > 0)
+            BEGIN SELECT RAISE(ABORT, 'El cliente tiene clases en años archivados (solo lectura); no se puede borrar.'); END
+            """)
             con.commit()
+        if new_ledger:  # base anterior al libro de cuentas: se llena con lo que haya
+            self.rebuild_ledger()
+
+    def _init_fts(self, cur):
+        """
+        Índice FTS5 de nombres para search_clients: sin tildes ni mayúsculas,
+        mantenido por triggers. Si el SQLite no trae FTS5, se busca con LIKE.
+        """
+        existed = cur.execute("SELECT 1 FROM sqlite_master WHERE name='clients_fts'").fetchone()
+        try:
+            cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+              name, content='clients', content_rowid='id',
+              tokenize='unicode61 remove_diacritics 2'
+            )
+            """)
+        except sqlite3.OperationalError:
+            return False
+        cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_ai AFTER INSERT ON clients BEGIN
+          INSERT INTO clients_fts(rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS clients_fts_ad AFTER DELETE ON clients BEGIN
+          INSERT INTO clients_fts(clients_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS clients_fts_au AFTER UPDATE OF name ON clients BEGIN
+          INSERT INTO clients_fts(clients_fts, rowid, name) VALUES ('delete', old.id, old.name);
+          INSERT INTO clients_fts(rowid, name) VALUES (new.id, new.name);
+        END;
+        """)
+        if not existed:  # base creada antes del índice: se llena con lo que haya
+            cur.execute("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')")
+        return True
+
+    # Mes (año, mes) de una sesión, igual que el filtro paid de query_sessions
+    _YEAR = "CAST(substr({0}.ts_iso, 1, 4) AS INTEGER)"
+    _MONTH = "CAST(substr({0}.ts_iso, 6, 2) AS INTEGER)"
+
+    def _init_ledger(self, cur):
+        """
+        Libro de cuentas mantenido por triggers:
+        - ledger_months: por cliente y mes, clases, monto cobrado y si el mes
+          está pagado (monthly_payments).
+        - client_balances: por cliente, la suma de sus meses: clases, cobrado,
+          pagado (meses pagados), saldo (meses sin pagar) y meses pendientes.
+        Cada escritura de sesiones o pagos ajusta solo su mes y su cliente, así
+        outstanding_balances es una lectura de client_balances sin importar
+        cuántos años de historia haya. Las sesiones que se mueven a un archivo
+        (archive_year) siguen contando. Devuelve True si las tablas son nuevas.
+        """
+        existed = cur.execute("SELECT 1 FROM sqlite_master WHERE name='ledger_months'").fetchone()
+        y, m = self._YEAR, self._MONTH
+        cur.executescript(f"""
+        CREATE TABLE IF NOT EXISTS ledger_months(
+          client_id INTEGER NOT NULL,
+          year INTEGER NOT NULL,
+          month INTEGER NOT NULL,
+          classes INTEGER NOT NULL DEFAULT 0,
+          charged_int INTEGER NOT NULL DEFAULT 0,
+          paid INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(client_id, year, month)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS client_balances(
+          client_id INTEGER PRIMARY KEY,
+          classes INTEGER NOT NULL DEFAULT 0,
+          charged_int INTEGER NOT NULL DEFAULT 0,
+          paid_int INTEGER NOT NULL DEFAULT 0,
+          balance_int INTEGER NOT NULL DEFAULT 0,
+          unpaid_months INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_client_balances_owed ON client_balances(balance_int) WHERE balance_int > 0;
+
+        -- sesiones -> su mes
+        CREATE TRIGGER IF NOT EXISTS ledger_sessions_ai AFTER INSERT ON sessions BEGIN
+          INSERT INTO ledger_months(client_id, year, month, classes, charged_int)
+          VALUES (new.client_id, {y.format("new")}, {m.format("new")}, 1, new.amount_int)
+          ON CONFLICT(client_id, year, month) DO UPDATE SET
+            classes = classes + 1, charged_int = charged_int + excluded.charged_int;
+        END;
+        -- al archivar un año sus sesiones salen de la base pero siguen en el libro
+        CREATE TRIGGER IF NOT EXISTS ledger_sessions_ad AFTER DELETE ON sessions
+        WHEN NOT EXISTS (SELECT 1 FROM archives WHERE year = {y.format("old")})
+        BEGIN
+          UPDATE ledger_months SET classes = classes - 1, charged_int = charged_int - old.amount_int
+          WHERE client_id = old.client_id AND year = {y.format("old")} AND month = {m.format("old")};
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_sessions_au AFTER UPDATE OF client_id, ts_iso, amount_int ON sessions
+        BEGIN
+          UPDATE ledger_months SET classes = classes - 1, charged_int = charged_int - old.amount_int
+          WHERE client_id = old.client_id AND year = {y.format("old")} AND month = {m.format("old")};
+          INSERT INTO ledger_months(client_id, year, month, classes, charged_int)
+          VALUES (new.client_id, {y.format("new")}, {m.format("new")}, 1, new.amount_int)
+          ON CONFLICT(client_id, year, month) DO UPDATE SET
+            classes = classes + 1, charged_int = charged_int + excluded.charged_int;
+        END;
+
+        -- pagos -> el estado de su mes
+        CREATE TRIGGER IF NOT EXISTS ledger_payments_ai AFTER INSERT ON monthly_payments BEGIN
+          INSERT INTO ledger_months(client_id, year, month, paid)
+          VALUES (new.client_id, new.year, new.month, new.paid <> 0)
+          ON CONFLICT(client_id, year, month) DO UPDATE SET paid = excluded.paid;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_payments_au AFTER UPDATE OF paid ON monthly_payments BEGIN
+          UPDATE ledger_months SET paid = new.paid <> 0
+          WHERE client_id = new.client_id AND year = new.year AND month = new.month;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_payments_ad AFTER DELETE ON monthly_payments BEGIN
+          UPDATE ledger_months SET paid = 0
+          WHERE client_id = old.client_id AND year = old.year AND month = old.month;
+        END;
+
+        -- mes -> saldo del cliente (se suma lo nuevo y se resta lo viejo)
+        CREATE TRIGGER IF NOT EXISTS ledger_months_ai AFTER INSERT ON ledger_months BEGIN
+          INSERT INTO client_balances(client_id, classes, charged_int, paid_int, balance_int, unpaid_months)
+          VALUES (new.client_id, new.classes, new.charged_int,
+                  CASE WHEN new.paid THEN new.charged_int ELSE 0 END,
+                  CASE WHEN new.paid THEN 0 ELSE new.charged_int END,
+                  NOT new.paid AND new.classes > 0)
+          ON CONFLICT(client_id) DO UPDATE SET
+            classes = classes + excluded.classes, charged_int = charged_int + excluded.charged_int,
+            paid_int = paid_int + excluded.paid_int, balance_int = balance_int + excluded.balance_int,
+            unpaid_months = unpaid_months + excluded.unpaid_months;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_months_au AFTER UPDATE ON ledger_months BEGIN
+          UPDATE client_balances SET
+            classes = classes + new.classes - old.classes,
+            charged_int = charged_int + new.charged_int - old.charged_int,
+            paid_int = paid_int + CASE WHEN new.paid THEN new.charged_int ELSE 0 END
+                                - CASE WHEN old.paid THEN old.charged_int ELSE 0 END,
+            balance_int = balance_int + CASE WHEN new.paid THEN 0 ELSE new.charged_int END
+                                      - CASE WHEN old.paid THEN 0 ELSE old.charged_int END,
+            unpaid_months = unpaid_months + (NOT new.paid AND new.classes > 0) - (NOT old.paid AND old.classes > 0)
+          WHERE client_id = new.client_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_months_ad AFTER DELETE ON ledger_months BEGIN
+          UPDATE client_balances SET
+            classes = classes - old.classes, charged_int = charged_int - old.charged_int,
+            paid_int = paid_int - CASE WHEN old.paid THEN old.charged_int ELSE 0 END,
+            balance_int = balance_int - CASE WHEN old.paid THEN 0 ELSE old.charged_int END,
+            unpaid_months = unpaid_months - (NOT old.paid AND old.classes > 0)
+          WHERE client_id = old.client_id;
+        END;
+
+        -- cliente borrado: fuera del libro (también lo que tenga en años archivados)
+        CREATE TRIGGER IF NOT EXISTS ledger_clients_ad AFTER DELETE ON clients BEGIN
+          DELETE FROM ledger_months WHERE client_id = old.id;
+          DELETE FROM client_balances WHERE client_id = old.id;
+        END;
+        """)
+        return not existed
 
     # ---- clients ----
     def list_clients(self):
         with self._conn() as con:
             rows = con.execute(
-                "SELECT id,name,phone,payment_method,account,note,created_at "
-                "FROM clients ORDER BY name"
+                f"SELECT {CLIENT_COLS} FROM clients ORDER BY name"
             ).fetchall()
-        return [
-            dict(
-                id=r[0],
-                name=r[1],
-                phone=r[2],
-                payment_method=r[3],
-                account=r[4],
-                note=r[5],
-                created_at=r[6],
-            )
-            for r in rows
-        ]
+        return [_client_row(r) for r in rows]
 
     def get_client_by_name_ci(self, name):
         key = name_norm_key(name)
@@ -149,29 +489,24 @@ class SQLiteBackend(Backend):
             ).fetchone()
         if not r:
             return None
-        return dict(
-            id=r[0],
-            name=r[1],
-            phone=r[2],
-            payment_method=r[3],
-            account=r[4],
-            note=r[5],
-        )
+        return Client(*r)
 
     def add_client(self, data):
         name = normalize_name(data["name"])
         key = name_norm_key(name)
         now = datetime.utcnow().isoformat()
-        with self._conn() as con:
+
+        def write(con):
             try:
                 cur = con.execute(
                     """
-                    INSERT INTO clients(name,name_norm,phone,payment_method,account,note,created_at)
-                    VALUES (?,?,?,?,?,?,?)
+                    INSERT INTO clients(name,name_norm,search_key,phone,payment_method,account,note,created_at)
+                    VALUES (?,?,?,?,?,?,?,?)
                     """,
                     (
                         name,
                         key,
+                        search_key(name),
                         data.get("phone"),
                         data.get("payment_method"),
                         data.get("account"),
@@ -179,7 +514,6 @@ class SQLiteBackend(Backend):
                         now,
                     ),
                 )
-                con.commit()
                 return cur.lastrowid
             except sqlite3.IntegrityError:
                 r = con.execute(
@@ -188,63 +522,111 @@ class SQLiteBackend(Backend):
                 ).fetchone()
                 return r[0] if r else None
 
+        return self._write(write)
+
     def update_client(self, client_id, data):
         sets, vals = [], []
         if "name" in data and data["name"]:
             nm = normalize_name(data["name"])
-            sets += ["name=?", "name_norm=?"]
-            vals += [nm, name_norm_key(nm)]
+            sets += ["name=?", "name_norm=?", "search_key=?"]
+            vals += [nm, name_norm_key(nm), search_key(nm)]
         for k in ["phone", "payment_method", "account", "note"]:
             if k in data:
                 sets.append(f"{k}=?")
                 vals.append(data.get(k))
-        if not sets:
-            return
         vals.append(client_id)
-        with self._conn() as con:
-            con.execute(
-                f"UPDATE clients SET {','.join(sets)} WHERE id=?",
-                tuple(vals),
-            )
-            con.commit()
+        if not sets:
+            with self._conn() as con:
+                r = con.execute(f"SELECT {CLIENT_COLS} FROM clients WHERE id=?", (client_id,)).fetchone()
+            return _client_row(r) if r else None
+        rows = self._write(lambda con: con.execute(
+            f"UPDATE clients SET {','.join(sets)} WHERE id=? RETURNING {CLIENT_COLS}",
+            tuple(vals),
+        ).fetchall())
+        return _client_row(rows[0]) if rows else None
 
     def upsert_client(self, name, phone, payment_method, account, note):
         """
         Si el cliente existe (por name_norm), lo actualiza.
         Si no existe, lo crea.
-        Devuelve el id del cliente.
+        Devuelve la fila del cliente. Es una sola sentencia: no hay ventana
+        entre leer y escribir en la que otro guardado cree el mismo cliente.
         """
-        existing = self.get_client_by_name_ci(name)
-        data = {
-            "name": name,
-            "phone": phone,
-            "payment_method": payment_method,
-            "account": account,
-            "note": note,
-        }
-        if existing:
-            self.update_client(existing["id"], data)
-            return existing["id"]
-        else:
-            return self.add_client(data)
+        nm = normalize_name(name)
+        rows = self._write(lambda con: con.execute(
+            f"""
+            INSERT INTO clients(name,name_norm,search_key,phone,payment_method,account,note,created_at)
+            VALUES (?,?,?,?,?,?,?,?)
+            ON CONFLICT(name_norm) DO UPDATE SET
+              name=excluded.name, search_key=excluded.search_key, phone=excluded.phone,
+              payment_method=excluded.payment_method, account=excluded.account, note=excluded.note
+            RETURNING {CLIENT_COLS}
+            """,
+            (nm, name_norm_key(nm), search_key(nm), phone, payment_method, account, note,
+             datetime.utcnow().isoformat()),
+        ).fetchall())
+        return _client_row(rows[0])
 
-    def delete_client(self, client_id):
+    def search_clients(self, query, limit=20):
+        words = re.findall(r"\w+", query or "")
+        cols = ",".join("c." + c for c in CLIENT_COLS.split(","))
         with self._conn() as con:
+            if not words:
+                rows = con.execute(f"SELECT {CLIENT_COLS} FROM clients ORDER BY name LIMIT ?", (limit,)).fetchall()
+            elif self.fts:
+                # "ana" "gom"* -> nombres con palabras que empiezan así, sin tildes
+                match = " ".join(f'"{w}"*' for w in words)
+                rows = con.execute(
+                    f"SELECT {cols} FROM clients_fts f JOIN clients c ON c.id=f.rowid "
+                    "WHERE clients_fts MATCH ? ORDER BY f.rank, c.name LIMIT ?",
+                    (match, limit),
+                ).fetchall()
+            else:
+                where = " AND ".join("search_key LIKE ?" for _ in words)
+                rows = con.execute(
+                    f"SELECT {CLIENT_COLS} FROM clients WHERE {where} ORDER BY name LIMIT ?",
+                    (*(f"%{search_key(w)}%" for w in words), limit),
+                ).fetchall()
+        return [_client_row(r) for r in rows]
+
+    def delete_client(self, client_id):
+        def write(con):
             con.execute("DELETE FROM sessions WHERE client_id=?", (client_id,))
             con.execute("DELETE FROM monthly_payments WHERE client_id=?", (client_id,))
             con.execute("DELETE FROM invoices WHERE client_id=?", (client_id,))
-            con.execute("DELETE FROM clients WHERE id=?", (client_id,))
-            con.commit()
+            return con.execute(
+                f"DELETE FROM clients WHERE id=? RETURNING {CLIENT_COLS}", (client_id,)
+            ).fetchall()
+
+        rows = self._write(write)
+        return _client_row(rows[0]) if rows else None
 
     # ---- sessions ----
-    def log_session(self, client_id, ts_iso, amount_int):
-        with self._conn() as con:
-            cur = con.execute(
-                "INSERT INTO sessions(client_id,ts_iso,amount_int) VALUES(?,?,?)",
-                (client_id, ts_iso, int(amount_int or DEFAULT_CLASE_COP)),
-            )
-            con.commit()
-            return cur.lastrowid
+    # El nombre del cliente sale en el mismo RETURNING (subconsulta por PK)
+    _SESSION_RETURNING = (
+        "RETURNING id, client_id, (SELECT name FROM clients c WHERE c.id=client_id), ts_iso, amount_int"
+    )
+
+    def _insert_session(self, con, uid, client_id, ts_iso, amount_int):
+        """INSERT idempotente por uid: si ya existe, la sesión guardada (id,client_id,ts_iso,amount_int)."""
+        rows = con.execute(
+            "INSERT INTO sessions(uid,client_id,ts_iso,amount_int) VALUES(?,?,?,?) "
+            "ON CONFLICT(uid) DO NOTHING RETURNING " + SESSION_COLS,
+            (uid, client_id, ts_iso, int(amount_int or DEFAULT_CLASE_COP)),
+        ).fetchall()
+        return rows[0] if rows else con.execute(
+            f"SELECT {SESSION_COLS} FROM sessions WHERE uid=?", (uid,)
+        ).fetchone()
+
+    def log_session(self, client_id, ts_iso, amount_int, uid=None):
+        uid = uid or new_uid()
+
+        def write(con):
+            r = self._insert_session(con, uid, client_id, ts_iso, amount_int)
+            name = con.execute("SELECT name FROM clients WHERE id=?", (r[1],)).fetchone()
+            return Session(r[0], r[1], name[0] if name else None, r[2], r[3])
+
+        return self._write(write)
 
     def add_session(self, client, ts_iso, amount_int):
         """
@@ -252,46 +634,121 @@ class SQLiteBackend(Backend):
         - int: id del cliente
         - str: nombre del cliente (se crea si no existe)
         """
-        if isinstance(client, int):
-            client_id = client
-        else:
-            # Buscar por nombre; si no existe, crear
-            existing = self.get_client_by_name_ci(client)
-            if existing:
-                client_id = existing["id"]
+        return self.record_class(client, ts_iso, amount_int)[1]
+
+    def record_class(self, client, ts_iso, amount_int, uid=None):
+        uid = uid or new_uid()
+
+        # Un solo trabajo del escritor (su SAVEPOINT): o quedan cliente y sesión, o nada
+        def write(con):
+            # reintento: la sesión ya está, con su cliente real (no se crea otro)
+            r = con.execute(f"SELECT {SESSION_COLS} FROM sessions WHERE uid=?", (uid,)).fetchone()
+            if r is not None:
+                c = con.execute(f"SELECT {CLIENT_COLS} FROM clients WHERE id=?", (r[1],)).fetchone()
+                return _client_row(c), Session(r[0], r[1], c[1], r[2], r[3])
+            if isinstance(client, int):
+                c = con.execute(f"SELECT {CLIENT_COLS} FROM clients WHERE id=?", (client,)).fetchone()
+                if c is None:
+                    raise LookupError(f"No existe el cliente {client}")
             else:
-                client_id = self.add_client({"name": client})
+                name = normalize_name(client)
+                key = name_norm_key(name)
+                con.execute(
+                    "INSERT INTO clients(name,name_norm,search_key,created_at) VALUES (?,?,?,?) "
+                    "ON CONFLICT(name_norm) DO NOTHING",
+                    (name, key, search_key(name), datetime.utcnow().isoformat()),
+                )
+                c = con.execute(f"SELECT {CLIENT_COLS} FROM clients WHERE name_norm=?", (key,)).fetchone()
+            r = self._insert_session(con, uid, c[0], ts_iso, amount_int)
+            return _client_row(c), Session(r[0], r[1], c[1], r[2], r[3])
 
-        return self.log_session(client_id, ts_iso, amount_int)
+        return self._write(write)
+
+    def _sessions_cursor(self, con, start_iso, end_iso, where=(), params=(), order="4 ASC, 1 ASC",
+                         limit=None, offset=0):
+        conds, args = list(where), list(params)
+        if end_iso:
+            conds.insert(0, "s.ts_iso < ?")
+            args.insert(0, end_iso)
+        if start_iso:
+            conds.insert(0, "s.ts_iso >= ?")
+            args.insert(0, start_iso)
+        where_sql = " WHERE " + " AND ".join(conds) if conds else ""
+        # la base principal y, si el rango toca años archivados, sus archivos
+        first, last = int((start_iso or "0")[:4]), int((end_iso or "9999")[:4])
+        parts = ["main"] + self._attach_archives(con, first, last)
+        sql = " UNION ALL ".join(
+            f"""
+            SELECT s.id, s.client_id, c.name, s.ts_iso, s.amount_int
+            FROM {p}.sessions s JOIN main.clients c ON c.id=s.client_id{where_sql}
+            """
+            for p in parts
+        ) + f" ORDER BY {order}"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            return con.execute(sql, args * len(parts) + [-1 if limit is None else int(limit), int(offset)])
+        return con.execute(sql, args * len(parts))
 
     def list_sessions_between(self, start_iso, end_iso):
+        # Directo del cursor a Session, compartiendo nombres y montos repetidos
+        cid, name, amount = interner(), interner(), interner()
         with self._conn() as con:
-            rows = con.execute(
-                """
-                SELECT s.id, s.client_id, c.name, s.ts_iso, s.amount_int
-                FROM sessions s JOIN clients c ON c.id=s.client_id
-                WHERE s.ts_iso >= ? AND s.ts_iso < ?
-                ORDER BY s.ts_iso ASC
-                """,
-                (start_iso, end_iso),
-            ).fetchall()
-        out = []
-        for r in rows:
-            out.append(
-                dict(
-                    id=r[0],
-                    client_id=r[1],
-                    client=r[2],
-                    ts_iso=r[3],
-                    amount_int=r[4],
-                )
+            cur = self._sessions_cursor(con, start_iso, end_iso)
+            return [Session(r[0], cid(r[1]), name(r[2]), r[3], amount(r[4])) for r in cur]
+
+    def iter_sessions_between(self, start_iso, end_iso, page_size=5000):
+        cid, name, amount = interner(), interner(), interner()
+        with self._conn() as con:
+            cur = self._sessions_cursor(con, start_iso, end_iso)
+            while True:
+                page = cur.fetchmany(page_size)
+                if not page:
+                    return
+                for r in page:
+                    yield Session(r[0], cid(r[1]), name(r[2]), r[3], amount(r[4]))
+
+    # order de query_sessions -> columna del SELECT de _sessions_cursor
+    _SESSION_ORDER = {"ts_iso": 4, "amount_int": 5}
+
+    def query_sessions(self, start_iso=None, end_iso=None, client_id=None, min_amount=None, max_amount=None,
+                       paid=None, order="ts_iso", desc=False, limit=None, offset=0):
+        where, params = [], []
+        if client_id is not None:
+            ids = [client_id] if isinstance(client_id, int) else list(client_id)
+            if not ids:
+                return []
+            # con un rango de fechas, idx_sessions_client_ts resuelve cliente + fechas
+            where.append(f"s.client_id IN ({','.join('?' * len(ids))})")
+            params += ids
+        if min_amount is not None:
+            where.append("s.amount_int >= ?")
+            params.append(int(min_amount))
+        if max_amount is not None:
+            where.append("s.amount_int <= ?")
+            params.append(int(max_amount))
+        if paid is not None:
+            # el pago es por cliente y mes: búsqueda por la clave única de monthly_payments
+            where.append(("" if paid else "NOT ") + """EXISTS (
+                SELECT 1 FROM main.monthly_payments p
+                WHERE p.client_id=s.client_id AND p.year=CAST(substr(s.ts_iso, 1, 4) AS INTEGER)
+                  AND p.month=CAST(substr(s.ts_iso, 6, 2) AS INTEGER) AND p.paid=1)""")
+        if order not in self._SESSION_ORDER:
+            raise ValueError(f"Orden no soportado: {order}")
+        direction = "DESC" if desc else "ASC"
+        cid, name, amount = interner(), interner(), interner()
+        with self._conn() as con:
+            cur = self._sessions_cursor(
+                con, start_iso, end_iso, where, params,
+                f"{self._SESSION_ORDER[order]} {direction}, 1 {direction}", limit, offset,
             )
-        return out
+            return [Session(r[0], cid(r[1]), name(r[2]), r[3], amount(r[4])) for r in cur]
 
     def delete_session(self, session_id):
-        with self._conn() as con:
-            con.execute("DELETE FROM sessions WHERE id=?", (session_id,))
-            con.commit()
+        rows = self._write(lambda con: con.execute(
+            "DELETE FROM sessions WHERE id=? " + self._SESSION_RETURNING,
+            (session_id,),
+        ).fetchall())
+        return _session_row(rows[0]) if rows else None
 
     # ---- monthly payments ----
     def get_month_payment(self, client_id, year, month):
@@ -308,17 +765,312 @@ class SQLiteBackend(Backend):
         return dict(paid=bool(r[0]), paid_on_iso=r[1])
 
     def set_month_payment(self, client_id, year, month, paid: bool, paid_on_iso: str | None):
+        rows = self._write(lambda con: con.execute(
+            f"""
+            INSERT INTO monthly_payments(client_id,year,month,paid,paid_on_iso)
+            VALUES(?,?,?,?,?)
+            ON CONFLICT(client_id,year,month) DO UPDATE SET
+              paid=excluded.paid, paid_on_iso=excluded.paid_on_iso
+            RETURNING {PAYMENT_COLS}
+            """,
+            (client_id, year, month, int(bool(paid)), paid_on_iso),
+        ).fetchall())
+        return _payment_row(rows[0])
+
+    def set_month_payments(self, payments):
+        sql = f"""
+            INSERT INTO monthly_payments(client_id,year,month,paid,paid_on_iso)
+            VALUES(?,?,?,?,?)
+            ON CONFLICT(client_id,year,month) DO UPDATE SET
+              paid=excluded.paid, paid_on_iso=excluded.paid_on_iso
+            RETURNING {PAYMENT_COLS}
+            """
+        params = [
+            (p["client_id"], p["year"], p["month"], int(bool(p.get("paid"))), p.get("paid_on_iso"))
+            for p in payments
+        ]
+        # un solo trabajo del escritor: todos los pagos en la misma transacción
+        rows = self._write(lambda con: [con.execute(sql, args).fetchone() for args in params])
+        return [_payment_row(r) for r in rows]
+
+    # ---- archivo por año ----
+    # Solo el mes actual y el anterior se consultan a diario; las sesiones de
+    # años cerrados pasan a entrenos.<año>.db y la base principal queda chica
+    # (respaldos, VACUUM y recorridos más rápidos). Esos archivos se adjuntan
+    # en solo lectura cuando un rango los toca.
+    def archive_path(self, year):
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{int(year)}{ext or '.db'}"
+
+    def archived_years(self):
+        """{año: sesiones} de los años ya archivados."""
         with self._conn() as con:
-            con.execute(
-                """
-                INSERT INTO monthly_payments(client_id,year,month,paid,paid_on_iso)
-                VALUES(?,?,?,?,?)
-                ON CONFLICT(client_id,year,month) DO UPDATE SET
-                  paid=excluded.paid, paid_on_iso=excluded.paid_on_iso
-                """,
-                (client_id, year, month, int(bool(paid)), paid_on_iso),
+            return dict(con.execute("SELECT year, rows FROM archives ORDER BY year").fetchall())
+
+    def session_years(self):
+        """{año: sesiones} que siguen en la base principal."""
+        with self._conn() as con:
+            rows = con.execute(
+                "SELECT CAST(substr(ts_iso, 1, 4) AS INTEGER), COUNT(*) FROM sessions GROUP BY 1 ORDER BY 1"
+            ).fetchall()
+        return dict(rows)
+
+    def archive_year(self, year, vacuum=True):
+        """
+        Mueve las sesiones de `year` (un año ya cerrado) a su archivo y deja el
+        año en solo lectura. Se puede repetir sin duplicar: primero se copian
+        (y confirman) al archivo y después se borran de la base principal; si
+        algo se corta entre medio, volver a llamarla termina el trabajo.
+        Desde entonces los clientes con clases en ese año no se pueden borrar
+        (delete_client). Devuelve las sesiones que quedaron en el archivo.
+        """
+        year = int(year)
+        if year >= datetime.now().year:
+            raise ValueError("Solo se pueden archivar años cerrados.")
+        path = self.archive_path(year)
+        rng = (f"{year:04d}-", f"{year + 1:04d}-")
+
+        def job(con):
+            con.execute("ATTACH DATABASE ? AS arch", (path,))
+            try:
+                con.execute("PRAGMA arch.journal_mode=DELETE")
+                con.execute("PRAGMA arch.synchronous=FULL")
+                # 1) copiar al archivo (solo se escribe arch)
+                con.execute("BEGIN IMMEDIATE")
+                con.execute("""
+                CREATE TABLE IF NOT EXISTS arch.sessions(
+                  id INTEGER PRIMARY KEY,
+                  client_id INTEGER NOT NULL,
+                  ts_iso TEXT NOT NULL,
+                  amount_int INTEGER NOT NULL,
+                  uid TEXT
+                )
+                """)
+                if "uid" not in {r[1] for r in con.execute("PRAGMA arch.table_info(sessions)")}:
+                    con.execute("ALTER TABLE arch.sessions ADD COLUMN uid TEXT")
+                con.execute("CREATE INDEX IF NOT EXISTS arch.idx_sessions_ts ON sessions(ts_iso)")
+                con.execute("CREATE INDEX IF NOT EXISTS arch.idx_sessions_client_ts ON sessions(client_id, ts_iso)")
+                con.execute(
+                    "INSERT OR IGNORE INTO arch.sessions(id,client_id,ts_iso,amount_int,uid) "
+                    "SELECT id,client_id,ts_iso,amount_int,uid FROM main.sessions WHERE ts_iso >= ? AND ts_iso < ?",
+                    rng,
+                )
+                con.execute("COMMIT")
+                # 2) registrar el año y borrar de la principal (en ese orden: con
+                # el año ya archivado, el libro de cuentas no descuenta las sesiones)
+                con.execute("BEGIN IMMEDIATE")
+                n = con.execute("SELECT COUNT(*) FROM arch.sessions").fetchone()[0]
+                con.execute(
+                    "INSERT INTO archives(year,file,rows,archived_at) VALUES (?,?,?,?) "
+                    "ON CONFLICT(year) DO UPDATE SET rows=excluded.rows, archived_at=excluded.archived_at",
+                    (year, os.path.basename(path), n, datetime.utcnow().isoformat()),
+                )
+                con.execute("DELETE FROM main.sessions WHERE ts_iso >= ? AND ts_iso < ?", rng)
+                con.execute("COMMIT")
+            finally:
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                con.execute("DETACH DATABASE arch")
+            if vacuum:
+                con.execute("VACUUM")
+                con.execute("PRAGMA wal_checkpoint(TRUNCATE)")  # que el archivo se achique ya
+            return n
+
+        return self._write(job, transaction=False)
+
+    def _attach_archives(self, con, first_year, last_year):
+        """Adjunta (solo lectura) los años archivados del rango; devuelve sus esquemas."""
+        rows = con.execute(
+            "SELECT year, file FROM archives WHERE year BETWEEN ? AND ? ORDER BY year",
+            (first_year, last_year),
+        ).fetchall()
+        folder = os.path.dirname(os.path.abspath(self.path))
+        out = []
+        for year, file in rows:
+            uri = "file:" + quote(os.path.join(folder, file)) + "?mode=ro"
+            con.execute(f"ATTACH DATABASE ? AS y{int(year)}", (uri,))
+            out.append(f"y{int(year)}")
+        return out
+
+    def rebuild(self):
+        """
+        Reconstruye lo que se deriva de las tablas (el índice de búsqueda
+        clients_fts y el libro de cuentas) y actualiza las estadísticas del
+        planificador. Para después de importar o restaurar mucho de una vez.
+        """
+        def job(con):
+            if self.fts:
+                con.execute("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')")
+            con.execute("ANALYZE")
+            con.execute("PRAGMA optimize")
+
+        self._write(job)
+        self.rebuild_ledger()
+
+    # ---- libro de cuentas ----
+    def rebuild_ledger(self, dry_run=False):
+        """
+        Recalcula ledger_months y client_balances desde las sesiones (también
+        las archivadas) y los pagos, y devuelve cuántas filas no coincidían:
+        {"months": meses distintos, "clients": saldos distintos}. Con
+        dry_run=True solo compara y no cambia nada.
+        """
+        y, m = self._YEAR, self._MONTH
+
+        def job(con):
+            parts = ["main"] + self._attach_archives(con, 0, 9999)
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                sessions = " UNION ALL ".join(
+                    f"SELECT s.client_id, {y.format('s')} AS year, {m.format('s')} AS month, s.amount_int "
+                    f"FROM {p}.sessions s JOIN main.clients c ON c.id = s.client_id"
+                    for p in parts
+                )
+                con.execute("DROP TABLE IF EXISTS temp.ledger_expected")
+                con.execute(f"""
+                CREATE TEMP TABLE ledger_expected AS
+                SELECT client_id, year, month, SUM(classes) AS classes, SUM(charged_int) AS charged_int,
+                       MAX(paid) AS paid
+                FROM (
+                  SELECT client_id, year, month, COUNT(*) AS classes, SUM(amount_int) AS charged_int, 0 AS paid
+                  FROM ({sessions}) GROUP BY 1, 2, 3
+                  UNION ALL
+                  SELECT client_id, year, month, 0, 0, paid <> 0 FROM main.monthly_payments
+                )
+                GROUP BY 1, 2, 3
+                """)
+                # los meses vacíos (se borraron sus clases) no cuentan como diferencia
+                live = "SELECT client_id, year, month, classes, charged_int, paid FROM {} WHERE classes <> 0 OR paid <> 0"
+                months = con.execute(f"""
+                SELECT COUNT(*) FROM (
+                  SELECT * FROM ({live.format("main.ledger_months")} EXCEPT {live.format("temp.ledger_expected")})
+                  UNION ALL
+                  SELECT * FROM ({live.format("temp.ledger_expected")} EXCEPT {live.format("main.ledger_months")})
+                )
+                """).fetchone()[0]
+                # saldos esperados: la suma de los meses esperados, contra client_balances
+                bal = ("SELECT client_id, classes, charged_int, paid_int, balance_int, unpaid_months FROM {} "
+                       "WHERE classes <> 0 OR charged_int <> 0 OR paid_int <> 0 OR balance_int <> 0 "
+                       "OR unpaid_months <> 0")
+                con.execute("DROP TABLE IF EXISTS temp.balances_expected")
+                con.execute("""
+                CREATE TEMP TABLE balances_expected AS
+                SELECT client_id, SUM(classes) AS classes, SUM(charged_int) AS charged_int,
+                       SUM(CASE WHEN paid THEN charged_int ELSE 0 END) AS paid_int,
+                       SUM(CASE WHEN paid THEN 0 ELSE charged_int END) AS balance_int,
+                       SUM(NOT paid AND classes > 0) AS unpaid_months
+                FROM temp.ledger_expected GROUP BY client_id
+                """)
+                clients = con.execute(f"""
+                SELECT COUNT(DISTINCT client_id) FROM (
+                  SELECT * FROM ({bal.format("main.client_balances")} EXCEPT {bal.format("temp.balances_expected")})
+                  UNION ALL
+                  SELECT * FROM ({bal.format("temp.balances_expected")} EXCEPT {bal.format("main.client_balances")})
+                )
+                """).fetchone()[0]
+                if not dry_run:
+                    # ledger_months primero (sus triggers tocan client_balances), y al
+                    # volver a insertar los triggers arman los saldos
+                    con.execute("DELETE FROM main.ledger_months")
+                    con.execute("DELETE FROM main.client_balances")
+                    con.execute(
+                        "INSERT INTO main.ledger_months(client_id, year, month, classes, charged_int, paid) "
+                        "SELECT * FROM temp.ledger_expected"
+                    )
+                con.execute("DROP TABLE temp.ledger_expected")
+                con.execute("DROP TABLE temp.balances_expected")
+                con.execute("COMMIT")
+            finally:
+                if con.in_transaction:
+                    con.execute("ROLLBACK")
+                for p in parts[1:]:
+                    con.execute(f"DETACH DATABASE {p}")
+            return {"months": months, "clients": clients}
+
+        return self._write(job, transaction=False)
+
+    def outstanding_balances(self):
+        with self._conn() as con:
+            rows = con.execute(f"""
+            SELECT b.client_id, c.name, {self._BALANCE_SELECT}
+            FROM client_balances b JOIN clients c ON c.id = b.client_id
+            WHERE b.balance_int > 0
+            ORDER BY b.balance_int DESC, c.name
+            """).fetchall()
+        return [_balance_row(r) for r in rows]
+
+    _BALANCE_SELECT = "b.classes, b.charged_int, b.paid_int, b.balance_int, b.unpaid_months"
+
+    # ---- respaldo ----
+    def iter_rows(self, table, page_size=1000):
+        # Paginación por id (keyset): cada página es una consulta corta y la
+        # memoria no crece con el tamaño de la tabla.
+        cols = TABLE_COLS[table].split(",")
+        # la tabla local de pagos sí tiene id, aunque no salga en el respaldo
+        has_id = cols[0] == "id"
+        sel = TABLE_COLS[table] if has_id else "id," + TABLE_COLS[table]
+        # las sesiones incluyen las de los años archivados
+        years = list(self.archived_years()) if table == "sessions" else []
+        for part in ["main"] + [f"y{y}" for y in years]:
+            last = 0
+            while True:
+                with self._conn() as con:
+                    part_sel = sel
+                    if part != "main":
+                        self._attach_archives(con, int(part[1:]), int(part[1:]))
+                        # archivos de antes de uid: la columna sale vacía
+                        if "uid" not in {r[1] for r in con.execute(f"PRAGMA {part}.table_info(sessions)")}:
+                            part_sel = sel.replace(",uid", ",NULL")
+                    page = con.execute(
+                        f"SELECT {part_sel} FROM {part}.{table} WHERE id>? ORDER BY id LIMIT ?",
+                        (last, page_size),
+                    ).fetchall()
+                for r in page:
+                    yield _table_row(table, cols, r if has_id else r[1:])
+                if len(page) < page_size:
+                    break
+                last = page[-1][0]
+
+    def insert_rows(self, table, rows):
+        if table == "clients":
+            sql = (
+                "INSERT INTO clients(name,name_norm,search_key,phone,payment_method,account,note,created_at) "
+                "VALUES (?,?,?,?,?,?,?,?) ON CONFLICT(name_norm) DO NOTHING"
             )
-            con.commit()
+            now = datetime.utcnow().isoformat()
+            params = [
+                (normalize_name(r["name"]), name_norm_key(r["name"]), search_key(r["name"]),
+                 r.get("phone"), r.get("payment_method"),
+                 r.get("account"), r.get("note"), r.get("created_at") or now)
+                for r in rows
+            ]
+        elif table == "sessions":
+            # con el uid de origen: restaurar dos veces el mismo respaldo no duplica clases
+            sql = (
+                "INSERT INTO sessions(client_id,ts_iso,amount_int,uid) VALUES (?,?,?,?) "
+                "ON CONFLICT(uid) DO NOTHING"
+            )
+            params = [(r["client_id"], r["ts_iso"], int(r["amount_int"]), r.get("uid")) for r in rows]
+        elif table == "monthly_payments":
+            sql = (
+                "INSERT INTO monthly_payments(client_id,year,month,paid,paid_on_iso) VALUES (?,?,?,?,?) "
+                "ON CONFLICT(client_id,year,month) DO UPDATE SET paid=excluded.paid, paid_on_iso=excluded.paid_on_iso"
+            )
+            params = [(r["client_id"], r["year"], r["month"], int(bool(r.get("paid"))), r.get("paid_on_iso")) for r in rows]
+        elif table == "invoices":
+            sql = (
+                "INSERT INTO invoices(client_id,year,month,total_int,method,account,classes_json,created_at) "
+                "VALUES (?,?,?,?,?,?,?,?) ON CONFLICT(client_id,year,month,created_at) DO NOTHING"
+            )
+            params = [
+                (r["client_id"], r["year"], r["month"], int(r["total_int"]), r.get("method"), r.get("account"),
+                 r.get("classes_json"), r.get("created_at") or datetime.utcnow().isoformat())
+                for r in rows
+            ]
+        else:
+            raise ValueError(f"Tabla desconocida: {table}")
+        # rowcount de executemany suma las filas escritas: las omitidas por ON CONFLICT no cuentan
+        return self._write(lambda con: con.executemany(sql, params).rowcount)
 
 
 # ======================================================
@@ -338,11 +1090,14 @@ class SupabaseBackend(Backend):
 
         # --- dueño actual para segmentar datos ---
         self.owner_email = None
-        try:
-            import streamlit as st
-            self.owner_email = st.secrets.get("OWNER_EMAIL", None)
-        except Exception:
-            pass
+        # st.secrets solo si Streamlit ya está cargado (la app); cli.py y los
+        # scripts usan el entorno sin pagar su importación
+        if "streamlit" in sys.modules:
+            try:
+                import streamlit as st
+                self.owner_email = st.secrets.get("OWNER_EMAIL", None)
+            except Exception:
+                pass
         if not self.owner_email:
             self.owner_email = os.getenv("OWNER_EMAIL")
 
@@ -350,64 +1105,109 @@ class SupabaseBackend(Backend):
         _ = self.list_clients()
 
     # --------------- HTTP helpers ---------------
-    def _get(self, path, params=None):
-        r = requests.get(self.base + path, headers=self.headers, params=params, timeout=20)
-        r.raise_for_status()
-        return r.json()
+    # observer (opcional): objeto con .http(method, path, ms, status, rows,
+    # bytes_out, bytes_in), p. ej. metrics.Metrics, para medir cada request.
+    observer = None
+
+    # Reintentos ante cortes de red, timeouts y 429/502/503/504, con espera
+    # creciente (backoff, 2*backoff, ...). Solo para requests que se pueden
+    # repetir sin efecto doble: GET/PATCH/DELETE, POST con resolution= (upsert
+    # por clave única) y las llamadas marcadas idempotent=True (uid).
+    retries = 2
+    backoff = 0.25
+    RETRY_STATUS = {429, 502, 503, 504}
+
+    _http = None
+
+    def _session(self):
+        # Una sesión de requests por backend: las conexiones (keep-alive, TLS)
+        # se reutilizan entre requests y entre hilos (sesiones de la app,
+        # api.py) en vez de abrir una por request
+        if self._http is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            http = requests.Session()
+            http.mount("http://", HTTPAdapter(pool_maxsize=32))
+            http.mount("https://", HTTPAdapter(pool_maxsize=32))
+            self._http = http
+        return self._http
+
+    def _request(self, method, path, params=None, data=None, prefer=None, idempotent=None):
+        import requests  # solo se carga si se usa Supabase
 
-    def _post(self, path, data, prefer=None):
         headers = dict(self.headers)
         if prefer:
             headers["Prefer"] = prefer
-        r = requests.post(self.base + path, headers=headers, data=json.dumps(data), timeout=20)
+        body = json.dumps(data) if data is not None else None
+        if idempotent is None:
+            idempotent = method != "POST" or "resolution=" in (prefer or "")
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            t0 = time.perf_counter()
+            try:
+                r = self._session().request(
+                    method, self.base + path, headers=headers, params=params, data=body, timeout=20,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            try:
+                out = r.json() if r.text else None
+            except ValueError:
+                out = None  # p. ej. una página de error HTML del proxy
+            if self.observer is not None:
+                self.observer.http(
+                    method, path.split("?")[0], (time.perf_counter() - t0) * 1000, r.status_code,
+                    len(out) if isinstance(out, list) else 0,
+                    len(body or ""), len(r.content),
+                )
+            if r.status_code not in self.RETRY_STATUS:
+                break
         r.raise_for_status()
-        return r.json() if r.text else None
+        return out
+
+    def _get(self, path, params=None):
+        return self._request("GET", path, params=params)
+
+    def _post(self, path, data, prefer=None, idempotent=None):
+        return self._request("POST", path, data=data, prefer=prefer, idempotent=idempotent)
 
     def _patch(self, path, data, params=None, prefer=None):
-        headers = dict(self.headers)
-        if prefer:
-            headers["Prefer"] = prefer
-        r = requests.patch(
-            self.base + path,
-            headers=headers,
-            params=params,
-            data=json.dumps(data),
-            timeout=20,
-        )
-        r.raise_for_status()
-        return r.json() if r.text else None
+        return self._request("PATCH", path, params=params, data=data, prefer=prefer)
 
-    def _delete(self, path, params=None):
-        headers = dict(self.headers)
-        headers["Prefer"] = "return=minimal"
-        r = requests.delete(self.base + path, headers=headers, params=params, timeout=20)
-        r.raise_for_status()
-        return True
+    def _delete(self, path, params=None, prefer="return=minimal"):
+        out = self._request("DELETE", path, params=params, prefer=prefer)
+        return True if out is None else out
 
     # --------------- clients ---------------
     def list_clients(self):
         params = {
-            "select": "id,name,phone,payment_method,account,note,created_at",
+            "select": CLIENT_COLS,
             "order": "name.asc",
         }
         if self.owner_email:
             params["owner_email"] = f"eq.{self.owner_email}"
-        return self._get("/clients", params=params)
+        return [Client.from_dict(d) for d in self._get("/clients", params=params)]
+
+    # name_norm + índice único (owner_email, name_norm): migrations/002_clients_name_norm.sql
+    CLIENT_CONFLICT = "on_conflict=owner_email,name_norm"
 
     def get_client_by_name_ci(self, name):
-        allc = self.list_clients()
-        key = name_norm_key(name)
-        for c in allc:
-            if name_norm_key(c["name"]) == key:
-                return c
-        return None
+        params = {"select": CLIENT_COLS, "name_norm": f"eq.{name_norm_key(name)}", "limit": 1}
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        res = self._get("/clients", params=params)
+        return Client.from_dict(res[0]) if res else None
 
     def add_client(self, data):
-        ex = self.get_client_by_name_ci(data["name"])
-        if ex:
-            return ex["id"]
+        name = normalize_name(data["name"])
         payload = [{
-            "name": normalize_name(data["name"]),
+            "name": name,
+            "name_norm": name_norm_key(name),
             "phone": data.get("phone"),
             "payment_method": data.get("payment_method"),
             "account": data.get("account"),
@@ -415,66 +1215,136 @@ class SupabaseBackend(Backend):
             "created_at": datetime.utcnow().isoformat(),
             "owner_email": self.owner_email,
         }]
-        resp = self._post("/clients", payload, prefer="return=representation")
-        return resp[0]["id"]
+        resp = self._post(
+            f"/clients?{self.CLIENT_CONFLICT}&select=id",
+            payload,
+            prefer="resolution=ignore-duplicates,return=representation",
+        )
+        if resp:
+            return resp[0]["id"]
+        # ya existía: ignore-duplicates no devuelve la fila
+        return self.get_client_by_name_ci(name)["id"]
 
     def update_client(self, client_id, data):
         payload = {}
         if "name" in data and data["name"]:
             payload["name"] = normalize_name(data["name"])
+            payload["name_norm"] = name_norm_key(payload["name"])
         for k in ["phone", "payment_method", "account", "note"]:
             if k in data:
                 payload[k] = data.get(k)
+        params = {"id": f"eq.{client_id}", "select": CLIENT_COLS}
         if not payload:
-            return
-        self._patch(
+            res = self._get("/clients", params=params)
+            return Client.from_dict(res[0]) if res else None
+        res = self._patch(
             "/clients",
             payload,
-            params={"id": f"eq.{client_id}"},
-            prefer="return=minimal",
+            params=params,
+            prefer="return=representation",
         )
+        return Client.from_dict(res[0]) if res else None
 
     def upsert_client(self, name, phone, payment_method, account, note):
         """
         Crear o actualizar cliente en Supabase por nombre (case-insensitive).
-        Devuelve el id.
+        Devuelve la fila del cliente, en un solo POST con on_conflict.
         """
-        existing = self.get_client_by_name_ci(name)
-        data = {
-            "name": name,
+        nm = normalize_name(name)
+        # sin created_at: al actualizar se conserva el original y al crear lo
+        # pone el default de la tabla (migrations/003_clients_created_at_default.sql)
+        payload = [{
+            "name": nm,
+            "name_norm": name_norm_key(nm),
             "phone": phone,
             "payment_method": payment_method,
             "account": account,
             "note": note,
-        }
-        if existing:
-            self.update_client(existing["id"], data)
-            return existing["id"]
-        else:
-            return self.add_client(data)
+            "owner_email": self.owner_email,
+        }]
+        res = self._post(
+            f"/clients?{self.CLIENT_CONFLICT}&select={CLIENT_COLS}",
+            payload,
+            prefer="resolution=merge-duplicates,return=representation",
+        )
+        return Client.from_dict(res[0])
+
+    def search_clients(self, query, limit=20):
+        # ilike sobre search_key, el nombre sin tildes (columna generada e
+        # índice trigram en migrations/008_clients_search_key.sql): "jose"
+        # encuentra a "José"
+        params = {"select": CLIENT_COLS, "order": "name.asc", "limit": limit}
+        words = re.findall(r"\w+", query or "")
+        if words:
+            params["and"] = "(" + ",".join(f"search_key.ilike.*{search_key(w)}*" for w in words) + ")"
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        return [Client.from_dict(d) for d in self._get("/clients", params=params)]
 
     def delete_client(self, client_id):
         # borrar cascada manual (por si no hay ON DELETE CASCADE)
         self._delete("/sessions", params={"client_id": f"eq.{client_id}"})
         self._delete("/monthly_payments", params={"client_id": f"eq.{client_id}"})
         self._delete("/invoices", params={"client_id": f"eq.{client_id}"})
-        self._delete("/clients", params={"id": f"eq.{client_id}"})
+        res = self._delete(
+            "/clients",
+            params={"id": f"eq.{client_id}", "select": CLIENT_COLS},
+            prefer="return=representation",
+        )
+        return Client.from_dict(res[0]) if res else None
 
     # --------------- sessions ---------------
-    def log_session(self, client_id, ts_iso, amount_int):
+    def log_session(self, client_id, ts_iso, amount_int, uid=None, client_name=None):
+        # uid con índice único (migrations/005_sessions_uid.sql): repetir el
+        # POST no duplica la clase
+        uid = uid or new_uid()
         payload = [{
+            "uid": uid,
             "client_id": client_id,
             "ts_iso": ts_iso,
             "amount_int": int(amount_int or DEFAULT_CLASE_COP),
             "owner_email": self.owner_email,
         }]
-        resp = self._post("/sessions", payload, prefer="return=representation")
-        return resp[0]["id"]
+        resp = self._post(
+            "/sessions?on_conflict=uid&select=" + SESSION_COLS,
+            payload,
+            prefer="resolution=ignore-duplicates,return=representation",
+        )
+        if not resp:
+            # ya estaba (un intento anterior sí llegó): ignore-duplicates no la devuelve
+            resp = self._get("/sessions", params={"select": SESSION_COLS, "uid": f"eq.{uid}"})
+        # PostgREST no trae el nombre; si quien llama lo conoce, lo completa
+        return Session.from_dict(dict(resp[0], client=client_name))
+
+    def add_session(self, client, ts_iso, amount_int):
+        """
+        client puede ser:
+        - int: id del cliente
+        - str: nombre del cliente (se crea si no existe)
+        """
+        return self.record_class(client, ts_iso, amount_int)[1]
+
+    def record_class(self, client, ts_iso, amount_int, uid=None):
+        # Función en el servidor (migrations/004_record_class.sql, con uid
+        # desde 005_sessions_uid.sql): un solo request y una sola transacción
+        args = {
+            "p_uid": uid or new_uid(),
+            "p_client_id": client if isinstance(client, int) else None,
+            "p_name": None if isinstance(client, int) else normalize_name(client),
+            "p_ts_iso": ts_iso,
+            "p_amount_int": int(amount_int or DEFAULT_CLASE_COP),
+            "p_owner_email": self.owner_email,
+        }
+        res = self._post("/rpc/record_class", args, idempotent=True)
+        if not res or not res.get("client"):
+            raise LookupError(f"No existe el cliente {client}")
+        cli = Client.from_dict(res["client"])
+        return cli, Session.from_dict(dict(res["session"], client=cli.name))
 
     def list_sessions_between(self, start_iso, end_iso):
         # Rango con AND; filtra por owner si aplica
         params = {
-            "select": "id,client_id,ts_iso,amount_int",
+            "select": SESSION_COLS,
             "and": f"(ts_iso.gte.{start_iso},ts_iso.lt.{end_iso})",
             "order": "ts_iso.asc",
         }
@@ -483,14 +1353,148 @@ class SupabaseBackend(Backend):
 
         data = self._get("/sessions", params=params)
 
-        # Mapear nombre de cliente
-        cmap = {c["id"]: c for c in self.list_clients()}
-        for d in data:
-            d["client"] = cmap.get(d["client_id"], {}).get("name", "—")  # 👈 client
-        return data
+        # Mapear nombre de cliente (el mismo str para todas sus sesiones)
+        names = {c["id"]: c["name"] for c in self.list_clients()}
+        amount = interner()
+        return [
+            Session(d["id"], d["client_id"], names.get(d["client_id"], "—"), d["ts_iso"], amount(d["amount_int"]))
+            for d in data
+        ]
+
+    def query_sessions(self, start_iso=None, end_iso=None, client_id=None, min_amount=None, max_amount=None,
+                       paid=None, order="ts_iso", desc=False, limit=None, offset=0):
+        # Todo va en el and=(...) de un GET; índices en migrations/006_sessions_indexes.sql
+        conds = []
+        if start_iso:
+            conds.append(f"ts_iso.gte.{start_iso}")
+        if end_iso:
+            conds.append(f"ts_iso.lt.{end_iso}")
+        if client_id is not None:
+            ids = [client_id] if isinstance(client_id, int) else list(client_id)
+            if not ids:
+                return []
+            conds.append(f"client_id.in.({','.join(str(int(i)) for i in ids)})")
+        if min_amount is not None:
+            conds.append(f"amount_int.gte.{int(min_amount)}")
+        if max_amount is not None:
+            conds.append(f"amount_int.lte.{int(max_amount)}")
+        if paid is not None:
+            cond = self._paid_filter(start_iso, end_iso, paid)
+            if cond is None:
+                return []
+            conds.append(cond)
+        if order not in ("ts_iso", "amount_int"):
+            raise ValueError(f"Orden no soportado: {order}")
+        direction = "desc" if desc else "asc"
+        params = {"select": SESSION_COLS, "order": f"{order}.{direction},id.{direction}"}
+        if conds:
+            params["and"] = "(" + ",".join(conds) + ")"
+        if limit is not None:
+            params["limit"] = int(limit)
+        if offset:
+            params["offset"] = int(offset)
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        data = self._get("/sessions", params=params) or []
+
+        # solo los nombres de los clientes que aparecen (no la lista completa)
+        ids = sorted({d["client_id"] for d in data})
+        names = {}
+        if ids:
+            res = self._get("/clients", params={"select": "id,name", "id": f"in.({','.join(map(str, ids))})"})
+            names = {c["id"]: c["name"] for c in res or []}
+        amount = interner()
+        return [
+            Session(d["id"], d["client_id"], names.get(d["client_id"], "—"), d["ts_iso"], amount(d["amount_int"]))
+            for d in data
+        ]
+
+    def _paid_filter(self, start_iso, end_iso, paid):
+        """
+        Filtro de PostgREST para las sesiones pagadas (o no) de start..end: el
+        pago es por (cliente, mes), así que va un and(mes, client_id in ...)
+        por mes. None si con paid=True no hay nada pagado en el rango.
+        """
+        if not (start_iso and end_iso):
+            raise ValueError("paid necesita start_iso y end_iso")
+        y1, m1 = int(start_iso[:4]), int(start_iso[5:7])
+        y2, m2 = int(end_iso[:4]), int(end_iso[5:7])
+        params = {
+            "select": "client_id,year,month",
+            "paid": "is.true",
+            "and": f"(year.gte.{y1},year.lte.{y2})",
+        }
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        pagados = {}
+        for r in self._get("/monthly_payments", params=params) or []:
+            pagados.setdefault((r["year"], r["month"]), []).append(str(r["client_id"]))
+        terms = []
+        y, m = y1, m1
+        while (y, m) <= (y2, m2):
+            nxt = (y + 1, 1) if m == 12 else (y, m + 1)
+            rng = f'ts_iso.gte."{y:04d}-{m:02d}-01",ts_iso.lt."{nxt[0]:04d}-{nxt[1]:02d}-01"'
+            ids = ",".join(pagados.get((y, m), []))
+            if paid and ids:
+                terms.append(f"and({rng},client_id.in.({ids}))")
+            elif not paid:
+                terms.append(f"and({rng},client_id.not.in.({ids}))" if ids else f"and({rng})")
+            y, m = nxt
+        return f"or({','.join(terms)})" if terms else None
+
+    def iter_sessions_between(self, start_iso, end_iso, page_size=5000):
+        # Keyset sobre (ts_iso, id): cada página sigue donde terminó la
+        # anterior, sin offset que crezca
+        names = {c["id"]: c["name"] for c in self.list_clients()}
+        amount = interner()
+        params = {"select": SESSION_COLS, "order": "ts_iso.asc,id.asc", "limit": page_size}
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        after = None
+        while True:
+            rng = f"ts_iso.gte.{start_iso},ts_iso.lt.{end_iso}"
+            if after:
+                rng += f',or(ts_iso.gt."{after[0]}",and(ts_iso.eq."{after[0]}",id.gt.{after[1]}))'
+            page = self._get("/sessions", params=dict(params, **{"and": f"({rng})"})) or []
+            for d in page:
+                yield Session(d["id"], d["client_id"], names.get(d["client_id"], "—"), d["ts_iso"],
+                              amount(d["amount_int"]))
+            if len(page) < page_size:
+                return
+            after = (page[-1]["ts_iso"], page[-1]["id"])
 
     def delete_session(self, session_id):
-        self._delete("/sessions", params={"id": f"eq.{session_id}"})
+        res = self._delete(
+            "/sessions",
+            params={"id": f"eq.{session_id}", "select": SESSION_COLS},
+            prefer="return=representation",
+        )
+        if not res:
+            return None
+        return Session.from_dict(res[0])
+
+    # --------------- libro de cuentas ---------------
+    # Tablas y triggers de migrations/007_ledger.sql
+    def outstanding_balances(self):
+        params = {
+            "select": BALANCE_COLS,
+            "balance_int": "gt.0",
+            "order": "balance_int.desc,client_id.asc",
+        }
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        data = self._get("/client_balances", params=params) or []
+        ids = [d["client_id"] for d in data]
+        names = {}
+        if ids:
+            res = self._get("/clients", params={"select": "id,name", "id": f"in.({','.join(map(str, ids))})"})
+            names = {c["id"]: c["name"] for c in res or []}
+        return [dict(d, client=names.get(d["client_id"], "—")) for d in data]
+
+    def rebuild_ledger(self, dry_run=False):
+        # solo con la clave service_role: migrations/011_rebuild_ledger_grants.sql
+        args = {"p_owner_email": self.owner_email, "p_dry_run": bool(dry_run)}
+        return self._post("/rpc/rebuild_ledger", args, idempotent=True)
 
     # --------------- monthly payments ---------------
     def get_month_payment(self, client_id, year, month):
@@ -518,17 +1522,113 @@ class SupabaseBackend(Backend):
             "paid_on_iso": paid_on_iso,
             "owner_email": self.owner_email,
         }]
-        self._post(
-            "/monthly_payments",
+        res = self._post(
+            "/monthly_payments?select=" + PAYMENT_COLS,
             payload,
-            prefer="resolution=merge-duplicates,return=minimal",
+            prefer="resolution=merge-duplicates,return=representation",
         )
+        r = res[0]
+        return dict(r, paid=bool(r.get("paid", False)))
+
+    def set_month_payments(self, payments):
+        if not payments:
+            return []
+        payload = [
+            {"client_id": p["client_id"], "year": p["year"], "month": p["month"], "paid": bool(p.get("paid")),
+             "paid_on_iso": p.get("paid_on_iso"), "owner_email": self.owner_email}
+            for p in payments
+        ]
+        # un solo upsert con todas las filas
+        res = self._post(
+            "/monthly_payments?select=" + PAYMENT_COLS,
+            payload,
+            prefer="resolution=merge-duplicates,return=representation",
+        )
+        return [dict(r, paid=bool(r.get("paid", False))) for r in res or []]
+
+    # --------------- respaldo ---------------
+    def iter_rows(self, table, page_size=1000):
+        cols = TABLE_COLS[table].split(",")
+        params = {"select": TABLE_COLS[table], "limit": page_size}
+        if self.owner_email:
+            params["owner_email"] = f"eq.{self.owner_email}"
+        # Con id: keyset (id=gt.último). Los pagos no tienen id: offset
+        # sobre su llave primaria.
+        keyset = "id" in cols
+        params["order"] = "id.asc" if keyset else "client_id.asc,year.asc,month.asc"
+        last, offset = None, 0
+        while True:
+            p = dict(params)
+            if keyset and last is not None:
+                p["id"] = f"gt.{last}"
+            elif not keyset:
+                p["offset"] = offset
+            page = self._get(f"/{table}", params=p) or []
+            for r in page:
+                yield _table_row(table, cols, [r.get(c) for c in cols])
+            if len(page) < page_size:
+                return
+            if keyset:
+                last = page[-1]["id"]
+            offset += len(page)
+
+    def insert_rows(self, table, rows):
+        if table not in TABLE_COLS:
+            raise ValueError(f"Tabla desconocida: {table}")
+        if not rows:
+            return 0
+        # return=representation (solo client_id) para contar las filas que de
+        # verdad se escribieron: ignore-duplicates no devuelve las omitidas
+        path, prefer = f"/{table}?select=client_id", "return=representation"
+        if table == "clients":
+            # los nombres que ya existen se omiten (índice único de name_norm)
+            rows = [
+                dict(r, name=normalize_name(r["name"]), name_norm=name_norm_key(r["name"]),
+                     created_at=r.get("created_at") or datetime.utcnow().isoformat())
+                for r in rows
+            ]
+            path = f"/clients?{self.CLIENT_CONFLICT}&select=id"
+            prefer = "resolution=ignore-duplicates,return=representation"
+        elif table == "sessions":
+            # las que ya están (mismo uid) se omiten
+            path += "&on_conflict=uid"
+            prefer = "resolution=ignore-duplicates,return=representation"
+            rows = [dict(r, uid=r.get("uid")) for r in rows]
+        elif table == "monthly_payments":
+            prefer = "resolution=merge-duplicates,return=representation"
+        elif table == "invoices":
+            # clave natural (migrations/010_invoices_natural_key.sql): las que ya están se omiten
+            path += "&on_conflict=client_id,year,month,created_at"
+            prefer = "resolution=ignore-duplicates,return=representation"
+            rows = [dict(r, created_at=r.get("created_at") or datetime.utcnow().isoformat()) for r in rows]
+        payload = [
+            dict({k: v for k, v in r.items() if k != "id"}, owner_email=self.owner_email)
+            for r in rows
+        ]
+        return len(self._post(path, payload, prefer=prefer) or [])
 
 
 # ======================================================
 # Selector de backend (Supabase o SQLite)
 # ======================================================
 
+def backend_from_env(sqlite_path="entrenos.db"):
+    """
+    Backend sin Streamlit (cli.py, scripts): Supabase si SUPABASE_URL y
+    SUPABASE_ANON_KEY están en el entorno, si no SQLite en `sqlite_path`. A
+    diferencia de get_backend, si Supabase falla el error sale y no se cae a
+    SQLite: un proceso por lotes no debe escribir en otra base sin avisar.
+    """
+    url, key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY")
+    if url and key:
+        b = SupabaseBackend(url, key)
+        b.label = "Supabase"
+        return b
+    b = SQLiteBackend(sqlite_path)
+    b.label = "SQLite"
+    return b
+
+
 def get_backend():
     # 1) intentar leer de st.secrets (Cloud/local con secrets.toml)
     url = None
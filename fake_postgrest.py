@@ -0,0 +1,803 @@
+# fake_postgrest.py — Servidor local que imita el subconjunto de PostgREST que usa db.py.
+#
+# Sirve para medir y probar SupabaseBackend sin el servicio real:
+#
+#   with FakePostgREST(latency_ms=40, jitter_ms=10) as srv:
+#       b = SupabaseBackend(srv.url, "anon")
+#       b.list_clients()
+#       print(srv.request_count, srv.stats)
+#
+# O como proceso aparte:
+#
+#   python fake_postgrest.py --port 54321 --latency 40 --jitter 10
+#   SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_ANON_KEY=x streamlit run app.py
+#
+# Soporta: select, order, filtros col=op.valor (eq, neq, gt, gte, lt, lte,
+# like, ilike, in, is, con not.), and=(...)/or=(...) anidados, limit/offset,
+# paginación con Range / Content-Range, Prefer return=representation|minimal,
+# count=exact y upserts con resolution=merge-duplicates|ignore-duplicates
+# (+ on_conflict). Funciones en /rpc/<nombre> (las de migrations/, ver RPCS).
+# Todo guardado en SQLite.
+import argparse
+import collections
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+from utils import search_key
+
+# tabla -> (DDL, clave primaria, columnas booleanas)
+TABLES = {
+    "clients": ("""
+        CREATE TABLE IF NOT EXISTS clients(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL,
+          name_norm TEXT,
+          search_key TEXT,
+          phone TEXT,
+          payment_method TEXT,
+          account TEXT,
+          note TEXT,
+          created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+          owner_email TEXT
+        )""", ["id"], set()),
+    "sessions": ("""
+        CREATE TABLE IF NOT EXISTS sessions(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          client_id INTEGER NOT NULL,
+          ts_iso TEXT NOT NULL,
+          amount_int INTEGER NOT NULL,
+          owner_email TEXT,
+          uid TEXT
+        )""", ["id"], set()),
+    "monthly_payments": ("""
+        CREATE TABLE IF NOT EXISTS monthly_payments(
+          client_id INTEGER NOT NULL,
+          year INTEGER NOT NULL,
+          month INTEGER NOT NULL,
+          paid INTEGER NOT NULL DEFAULT 0,
+          paid_on_iso TEXT,
+          owner_email TEXT,
+          PRIMARY KEY(client_id, year, month)
+        )""", ["client_id", "year", "month"], {"paid"}),
+    "invoices": ("""
+        CREATE TABLE IF NOT EXISTS invoices(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          client_id INTEGER NOT NULL,
+          year INTEGER NOT NULL,
+          month INTEGER NOT NULL,
+          total_int INTEGER NOT NULL,
+          method TEXT,
+          account TEXT,
+          classes_json TEXT,
+          created_at TEXT,
+          owner_email TEXT
+        )""", ["id"], set()),
+    # migrations/007_ledger.sql (las mantienen los triggers de LEDGER)
+    "ledger_months": ("""
+        CREATE TABLE IF NOT EXISTS ledger_months(
+          client_id INTEGER NOT NULL,
+          year INTEGER NOT NULL,
+          month INTEGER NOT NULL,
+          owner_email TEXT,
+          classes INTEGER NOT NULL DEFAULT 0,
+          charged_int INTEGER NOT NULL DEFAULT 0,
+          paid INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(client_id, year, month)
+        )""", ["client_id", "year", "month"], {"paid"}),
+    "client_balances": ("""
+        CREATE TABLE IF NOT EXISTS client_balances(
+          client_id INTEGER PRIMARY KEY,
+          owner_email TEXT,
+          classes INTEGER NOT NULL DEFAULT 0,
+          charged_int INTEGER NOT NULL DEFAULT 0,
+          paid_int INTEGER NOT NULL DEFAULT 0,
+          balance_int INTEGER NOT NULL DEFAULT 0,
+          unpaid_months INTEGER NOT NULL DEFAULT 0
+        )""", ["client_id"], set()),
+}
+LEDGER_TABLES = ("ledger_months", "client_balances")
+
+# Triggers de migrations/007_ledger.sql, en SQLite (los de SQLiteBackend con
+# owner_email y sin años archivados)
+_Y, _M = "CAST(substr({0}.ts_iso, 1, 4) AS INTEGER)", "CAST(substr({0}.ts_iso, 6, 2) AS INTEGER)"
+_CONTRIB = """{0}.classes, {0}.charged_int, CASE WHEN {0}.paid THEN {0}.charged_int ELSE 0 END,
+  CASE WHEN {0}.paid THEN 0 ELSE {0}.charged_int END, NOT {0}.paid AND {0}.classes > 0"""
+LEDGER = f"""
+CREATE TRIGGER IF NOT EXISTS ledger_sessions_ai AFTER INSERT ON sessions BEGIN
+  INSERT INTO ledger_months(client_id, year, month, owner_email, classes, charged_int)
+  VALUES (new.client_id, {_Y.format("new")}, {_M.format("new")}, new.owner_email, 1, new.amount_int)
+  ON CONFLICT(client_id, year, month) DO UPDATE SET
+    classes = classes + 1, charged_int = charged_int + excluded.charged_int;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_sessions_ad AFTER DELETE ON sessions BEGIN
+  UPDATE ledger_months SET classes = classes - 1, charged_int = charged_int - old.amount_int
+  WHERE client_id = old.client_id AND year = {_Y.format("old")} AND month = {_M.format("old")};
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_sessions_au AFTER UPDATE OF client_id, ts_iso, amount_int ON sessions BEGIN
+  UPDATE ledger_months SET classes = classes - 1, charged_int = charged_int - old.amount_int
+  WHERE client_id = old.client_id AND year = {_Y.format("old")} AND month = {_M.format("old")};
+  INSERT INTO ledger_months(client_id, year, month, owner_email, classes, charged_int)
+  VALUES (new.client_id, {_Y.format("new")}, {_M.format("new")}, new.owner_email, 1, new.amount_int)
+  ON CONFLICT(client_id, year, month) DO UPDATE SET
+    classes = classes + 1, charged_int = charged_int + excluded.charged_int;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_payments_ai AFTER INSERT ON monthly_payments BEGIN
+  INSERT INTO ledger_months(client_id, year, month, owner_email, paid)
+  VALUES (new.client_id, new.year, new.month, new.owner_email, new.paid <> 0)
+  ON CONFLICT(client_id, year, month) DO UPDATE SET paid = excluded.paid;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_payments_au AFTER UPDATE OF paid ON monthly_payments BEGIN
+  UPDATE ledger_months SET paid = new.paid <> 0
+  WHERE client_id = new.client_id AND year = new.year AND month = new.month;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_payments_ad AFTER DELETE ON monthly_payments BEGIN
+  UPDATE ledger_months SET paid = 0
+  WHERE client_id = old.client_id AND year = old.year AND month = old.month;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_months_ai AFTER INSERT ON ledger_months BEGIN
+  INSERT INTO client_balances(client_id, owner_email, classes, charged_int, paid_int, balance_int, unpaid_months)
+  VALUES (new.client_id, new.owner_email, {_CONTRIB.format("new")})
+  ON CONFLICT(client_id) DO UPDATE SET
+    classes = classes + excluded.classes, charged_int = charged_int + excluded.charged_int,
+    paid_int = paid_int + excluded.paid_int, balance_int = balance_int + excluded.balance_int,
+    unpaid_months = unpaid_months + excluded.unpaid_months;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_months_au AFTER UPDATE ON ledger_months BEGIN
+  UPDATE client_balances SET
+    classes = classes + new.classes - old.classes,
+    charged_int = charged_int + new.charged_int - old.charged_int,
+    paid_int = paid_int + CASE WHEN new.paid THEN new.charged_int ELSE 0 END
+                        - CASE WHEN old.paid THEN old.charged_int ELSE 0 END,
+    balance_int = balance_int + CASE WHEN new.paid THEN 0 ELSE new.charged_int END
+                              - CASE WHEN old.paid THEN 0 ELSE old.charged_int END,
+    unpaid_months = unpaid_months + (NOT new.paid AND new.classes > 0) - (NOT old.paid AND old.classes > 0)
+  WHERE client_id = new.client_id;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_months_ad AFTER DELETE ON ledger_months BEGIN
+  UPDATE client_balances SET
+    classes = classes - old.classes, charged_int = charged_int - old.charged_int,
+    paid_int = paid_int - CASE WHEN old.paid THEN old.charged_int ELSE 0 END,
+    balance_int = balance_int - CASE WHEN old.paid THEN 0 ELSE old.charged_int END,
+    unpaid_months = unpaid_months - (NOT old.paid AND old.classes > 0)
+  WHERE client_id = old.client_id;
+END;
+CREATE TRIGGER IF NOT EXISTS ledger_clients_ad AFTER DELETE ON clients BEGIN
+  DELETE FROM ledger_months WHERE client_id = old.id;
+  DELETE FROM client_balances WHERE client_id = old.id;
+END;
+"""
+
+# clients.search_key de migrations/008_clients_search_key.sql: en Postgres es
+# una columna generada con unaccent; aquí la llena un trigger con
+# utils.search_key (registrada como función en la conexión)
+SEARCH_KEY = """
+CREATE TRIGGER IF NOT EXISTS clients_search_key_ai AFTER INSERT ON clients BEGIN
+  UPDATE clients SET search_key = search_key(new.name) WHERE id = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS clients_search_key_au AFTER UPDATE OF name ON clients BEGIN
+  UPDATE clients SET search_key = search_key(new.name) WHERE id = new.id;
+END;
+"""
+
+# Índices únicos extra (migrations/002_clients_name_norm.sql,
+# 005_sessions_uid.sql y 010_invoices_natural_key.sql). En Postgres
+# son "nulls not distinct"; aquí se imita con ifnull(...) en el índice y en
+# el destino de ON CONFLICT.
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS clients_owner_name_norm "
+    "ON clients(ifnull(owner_email, ''), name_norm)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS sessions_uid ON sessions(uid)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS invoices_natural ON invoices(client_id, year, month, created_at)",
+]
+NULLS_NOT_DISTINCT = {"owner_email"}
+
+OPS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "ilike": "LIKE"}
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class PostgRESTError(Exception):
+    def __init__(self, status, message, code="PGRST000"):
+        super().__init__(message)
+        self.status = status
+        self.body = {"code": code, "message": message, "details": None, "hint": None}
+
+
+# ---------------------------
+# Parsing de filtros
+# ---------------------------
+def _split_top(s):
+    """Parte por comas que no estén dentro de paréntesis o comillas."""
+    out, depth, cur, quoted = [], 0, [], False
+    for ch in s:
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            out.append("".join(cur))
+            cur = []
+        else:
+            cur.append(ch)
+    if cur:
+        out.append("".join(cur))
+    return out
+
+
+def _col(name, columns):
+    if not _IDENT.match(name) or name not in columns:
+        raise PostgRESTError(400, f"column {name} does not exist", "42703")
+    return f'"{name}"'
+
+
+def _conflict_col(name, columns):
+    col = _col(name, columns)
+    return f"ifnull({col}, '')" if name in NULLS_NOT_DISTINCT else col
+
+
+def _value(v):
+    v = v.strip()
+    if len(v) >= 2 and v[0] == v[-1] == '"':
+        return v[1:-1]
+    return {"true": 1, "false": 0}.get(v, v)
+
+
+def _condition(col, expr, columns):
+    """col + 'op.valor' (o 'not.op.valor') -> (sql, params)."""
+    neg = False
+    if expr.startswith("not."):
+        neg, expr = True, expr[4:]
+    op, _, val = expr.partition(".")
+    c = _col(col, columns)
+    if op == "like":
+        # LIKE de SQLite ignora mayúsculas; GLOB respeta (y ya usa *)
+        sql, params = f"{c} GLOB ?", [_value(val)]
+    elif op in OPS:
+        if op == "ilike":
+            val = val.replace("*", "%")
+        sql, params = f"{c} {OPS[op]} ?", [_value(val)]
+    elif op == "in":
+        items = [_value(x) for x in _split_top(val.strip()[1:-1])] if val.strip() else []
+        sql = f"{c} IN ({','.join('?' * len(items))})" if items else "0"
+        params = items
+    elif op == "is":
+        lit = {"null": "NULL", "true": "1", "false": "0"}.get(val.lower())
+        if lit is None:
+            raise PostgRESTError(400, f"invalid is value: {val}")
+        sql = f"{c} IS {lit}"
+        params = []
+    else:
+        raise PostgRESTError(400, f"unsupported operator: {op}", "PGRST100")
+    return (f"NOT ({sql})" if neg else sql), params
+
+
+def _logic(kind, body, columns):
+    """and=(a.gte.1,b.lt.2,or(c.eq.3,d.eq.4)) -> (sql, params)."""
+    body = body.strip()
+    if not (body.startswith("(") and body.endswith(")")):
+        raise PostgRESTError(400, f"bad logic tree: {body}", "PGRST100")
+    parts, params = [], []
+    for item in _split_top(body[1:-1]):
+        item = item.strip()
+        m = re.match(r"^(not\.)?(and|or)(\(.*\))$", item)
+        if m:
+            sql, p = _logic(m.group(2), m.group(3), columns)
+            if m.group(1):
+                sql = f"NOT {sql}"
+        else:
+            col, _, expr = item.partition(".")
+            sql, p = _condition(col, expr, columns)
+        parts.append(sql)
+        params += p
+    joiner = " AND " if kind == "and" else " OR "
+    return "(" + joiner.join(parts or ["1"]) + ")", params
+
+
+RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def build_where(query, columns):
+    parts, params = [], []
+    for k, v in query:
+        if k in RESERVED:
+            continue
+        m = re.match(r"^(not\.)?(and|or)$", k)
+        if m:
+            sql, p = _logic(m.group(2), v, columns)
+            if m.group(1):
+                sql = f"NOT {sql}"
+        else:
+            sql, p = _condition(k, v, columns)
+        parts.append(sql)
+        params += p
+    return (" WHERE " + " AND ".join(parts)) if parts else "", params
+
+
+def build_order(value, columns):
+    terms = []
+    for t in value.split(","):
+        bits = t.strip().split(".")
+        c = _col(bits[0], columns)
+        d = "DESC" if "desc" in bits[1:] else "ASC"
+        nulls = " NULLS FIRST" if "nullsfirst" in bits[1:] else (" NULLS LAST" if "nullslast" in bits[1:] else "")
+        terms.append(f"{c} {d}{nulls}")
+    return " ORDER BY " + ", ".join(terms)
+
+
+def build_select(value, columns):
+    if not value or value.strip() == "*":
+        return list(columns)
+    cols = [c.strip() for c in value.split(",") if c.strip()]
+    for c in cols:
+        if "(" in c or ":" in c:
+            raise PostgRESTError(400, f"embedding/aliases not supported: {c}", "PGRST100")
+        _col(c, columns)
+    return cols
+
+
+def parse_prefer(header):
+    out = {}
+    for part in (header or "").split(","):
+        k, _, v = part.strip().partition("=")
+        if k:
+            out[k] = v
+    return out
+
+
+# ---------------------------
+# Servidor
+# ---------------------------
+class FakePostgREST:
+    def __init__(self, db_path=":memory:", host="127.0.0.1", port=0,
+                 latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.fail_next = 0  # fuerza los próximos N requests a fallar (503)
+        # los próximos N requests se procesan pero la respuesta se pierde
+        # (504), como un timeout después del commit
+        self.lose_next = 0
+        self._rng = random.Random(seed)
+
+        self.stats = collections.Counter()  # (método, tabla) -> n
+        self.request_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self._lock = threading.Lock()
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.create_function("search_key", 1, search_key, deterministic=True)
+        self.columns = {}
+        for name, (ddl, _, _) in TABLES.items():
+            self.con.execute(ddl)
+            self.columns[name] = [r[1] for r in self.con.execute(f"PRAGMA table_info({name})")]
+        for ddl in INDEXES:
+            self.con.execute(ddl)
+        self.con.executescript(SEARCH_KEY)
+        self.con.executescript(LEDGER)
+        self.con.commit()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # ---- ciclo de vida ----
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self.con.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.stats.clear()
+            self.request_count = self.bytes_in = self.bytes_out = 0
+
+    def import_sqlite(self, path, owner_email=None):
+        """Copia los datos de una base de SQLiteBackend (p. ej. synthetic.py)."""
+        with self._lock:
+            self.con.execute("ATTACH DATABASE ? AS src", (path,))
+            try:
+                for name in TABLES:
+                    if name in LEDGER_TABLES:
+                        continue  # lo arman los triggers al copiar sesiones y pagos
+                    src_cols = {r[1] for r in self.con.execute(f"PRAGMA src.table_info({name})")}
+                    cols = [c for c in self.columns[name] if c in src_cols]
+                    if not cols:
+                        continue
+                    col_sql = ",".join(f'"{c}"' for c in cols)
+                    self.con.execute(
+                        f"INSERT OR REPLACE INTO main.{name}({col_sql},owner_email) "
+                        f"SELECT {col_sql}, ? FROM src.{name}",
+                        (owner_email,),
+                    )
+                self.con.commit()
+            finally:
+                self.con.execute("DETACH DATABASE src")
+
+    # ---- inyección de latencia / fallos ----
+    def _delay_and_maybe_fail(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+        return self.failure_rate > 0 and self._rng.random() < self.failure_rate
+
+    # ---- operaciones ----
+    def _table(self, name):
+        if name not in TABLES:
+            raise PostgRESTError(404, f'relation "public.{name}" does not exist', "42P01")
+        return self.columns[name]
+
+    def _rows(self, cur, cols, table):
+        bools = TABLES[table][2]
+        out = []
+        for r in cur.fetchall():
+            d = dict(zip(cols, r))
+            for b in bools & d.keys():
+                d[b] = None if d[b] is None else bool(d[b])
+            out.append(d)
+        return out
+
+    def do_get(self, table, query, headers):
+        columns = self._table(table)
+        q = dict(query)
+        cols = build_select(q.get("select"), columns)
+        where, params = build_where(query, columns)
+        order = build_order(q["order"], columns) if "order" in q else ""
+        limit = int(q["limit"]) if "limit" in q else None
+        offset = int(q.get("offset", 0))
+        rng = headers.get("Range")
+        if rng:
+            m = re.match(r"^\s*(\d+)-(\d*)\s*$", rng)
+            if not m:
+                raise PostgRESTError(416, "invalid range", "PGRST103")
+            offset = int(m.group(1))
+            if m.group(2):
+                limit = int(m.group(2)) - offset + 1
+        sql = f"SELECT {','.join(_col(c, columns) for c in cols)} FROM {table}{where}{order}"
+        page = ""
+        if limit is not None:
+            page = f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        elif offset:
+            page = f" LIMIT -1 OFFSET {int(offset)}"
+        with self._lock:
+            rows = self._rows(self.con.execute(sql + page, params), cols, table)
+            total = "*"
+            if "count" in parse_prefer(headers.get("Prefer")):
+                total = self.con.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+        last = offset + len(rows) - 1
+        content_range = f"{offset}-{last}/{total}" if rows else f"*/{total}"
+        status = 206 if (rng and total != "*" and len(rows) < total) else 200
+        return status, rows, {"Content-Range": content_range}
+
+    def do_post(self, table, query, headers, body):
+        columns = self._table(table)
+        q = dict(query)
+        prefer = parse_prefer(headers.get("Prefer"))
+        items = body if isinstance(body, list) else [body]
+        cols_out = build_select(q.get("select"), columns)
+        resolution = prefer.get("resolution")
+        conflict = q["on_conflict"].split(",") if "on_conflict" in q else TABLES[table][1]
+        for c in conflict:
+            _col(c, columns)
+
+        out = []
+        with self._lock:
+            try:
+                for item in items:
+                    keys = [k for k in item if k in columns]
+                    for k in item:
+                        _col(k, columns)
+                    vals = [item[k] for k in keys]
+                    ins = f"INSERT INTO {table}({','.join(_col(k, columns) for k in keys)}) VALUES ({','.join('?' * len(keys))})"
+                    tgt = ",".join(_conflict_col(c, columns) for c in conflict)
+                    if resolution == "merge-duplicates":
+                        upd = [k for k in keys if k not in conflict]
+                        if upd:
+                            ins += f" ON CONFLICT({tgt}) DO UPDATE SET " + ",".join(
+                                f"{_col(k, columns)}=excluded.{_col(k, columns)}" for k in upd)
+                        else:
+                            ins += f" ON CONFLICT({tgt}) DO NOTHING"
+                    elif resolution == "ignore-duplicates":
+                        ins += f" ON CONFLICT({tgt}) DO NOTHING"
+                    ins += f" RETURNING {','.join(_col(c, columns) for c in cols_out)}"
+                    out += self._rows(self.con.execute(ins, vals), cols_out, table)
+                self.con.commit()
+            except sqlite3.IntegrityError as e:
+                self.con.rollback()
+                raise PostgRESTError(409, str(e), "23505")
+            except sqlite3.OperationalError as e:
+                self.con.rollback()
+                raise PostgRESTError(400, str(e), "42P10")
+        return 201, out, {}
+
+    def do_patch(self, table, query, headers, body):
+        columns = self._table(table)
+        q = dict(query)
+        cols_out = build_select(q.get("select"), columns)
+        sets = [k for k in body]
+        if not sets:
+            return 200, [], {}
+        where, params = build_where(query, columns)
+        sql = (f"UPDATE {table} SET {','.join(_col(k, columns) + '=?' for k in sets)}{where} "
+               f"RETURNING {','.join(_col(c, columns) for c in cols_out)}")
+        with self._lock:
+            try:
+                rows = self._rows(self.con.execute(sql, [body[k] for k in sets] + params), cols_out, table)
+                self.con.commit()
+            except sqlite3.IntegrityError as e:
+                self.con.rollback()
+                raise PostgRESTError(409, str(e), "23505")
+        return 200, rows, {}
+
+    def do_rpc(self, name, args):
+        fn = RPCS.get(name)
+        if fn is None:
+            raise PostgRESTError(404, f"Could not find the function public.{name}", "PGRST202")
+        with self._lock:
+            try:
+                out = fn(self.con, **args)
+                self.con.commit()
+            except TypeError as e:
+                self.con.rollback()
+                raise PostgRESTError(400, str(e), "PGRST202")
+            except sqlite3.IntegrityError as e:
+                self.con.rollback()
+                raise PostgRESTError(409, str(e), "23505")
+        return 200, out, {}
+
+    def do_delete(self, table, query, headers):
+        columns = self._table(table)
+        q = dict(query)
+        cols_out = build_select(q.get("select"), columns)
+        where, params = build_where(query, columns)
+        sql = f"DELETE FROM {table}{where} RETURNING {','.join(_col(c, columns) for c in cols_out)}"
+        with self._lock:
+            rows = self._rows(self.con.execute(sql, params), cols_out, table)
+            self.con.commit()
+        return 200, rows, {}
+
+    # ---- HTTP ----
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # encabezados y cuerpo van en dos escrituras: sin esto, con
+            # keep-alive cada respuesta espera el ACK retardado (~40 ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, extra=None):
+                data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                if payload is not None:
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (extra or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+                with server._lock:
+                    server.bytes_out += len(data)
+
+            def _handle(self, method):
+                parts = urlsplit(self.path)
+                query = parse_qsl(parts.query, keep_blank_values=True)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                segs = [s for s in parts.path.split("/") if s]
+                table = segs[2] if len(segs) >= 3 and segs[:2] == ["rest", "v1"] else None
+                with server._lock:
+                    server.request_count += 1
+                    server.bytes_in += len(raw)
+                    server.stats[(method, table)] += 1
+
+                if server._delay_and_maybe_fail():
+                    return self._send(503, {"code": "PGRST000", "message": "injected failure"})
+                if not self.headers.get("apikey"):
+                    return self._send(401, {"code": "PGRST301", "message": "No API key found in request"})
+                rpc = table == "rpc" and len(segs) == 4 and method == "POST"
+                if table is None or (len(segs) != 3 and not rpc):
+                    return self._send(404, {"code": "PGRST125", "message": "Invalid path"})
+                try:
+                    body = json.loads(raw) if raw else None
+                    if rpc:
+                        status, rows, extra = server.do_rpc(segs[3], body or {})
+                    elif method == "GET":
+                        status, rows, extra = server.do_get(table, query, self.headers)
+                    elif method == "POST":
+                        status, rows, extra = server.do_post(table, query, self.headers, body or [])
+                    elif method == "PATCH":
+                        status, rows, extra = server.do_patch(table, query, self.headers, body or {})
+                    else:
+                        status, rows, extra = server.do_delete(table, query, self.headers)
+                except PostgRESTError as e:
+                    return self._send(e.status, e.body)
+                except (ValueError, sqlite3.Error) as e:
+                    return self._send(400, {"code": "PGRST100", "message": str(e)})
+
+                with server._lock:
+                    lost = server.lose_next > 0
+                    server.lose_next -= lost
+                if lost:
+                    return self._send(504, {"code": "PGRST000", "message": "injected lost response"})
+                if rpc:
+                    # las funciones devuelven su valor tal cual, sin Prefer
+                    return self._send(status, rows)
+                if method != "GET" and parse_prefer(self.headers.get("Prefer")).get("return") != "representation":
+                    return self._send(204 if method != "POST" else 201, None, extra)
+                self._send(status, rows, extra)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
+
+
+# ---------------------------
+# Funciones (/rpc), equivalentes a las de migrations/
+# ---------------------------
+def _rpc_record_class(con, p_ts_iso, p_amount_int, p_client_id=None, p_name=None, p_owner_email=None,
+                      p_uid=None):
+    """migrations/004_record_class.sql, 005_sessions_uid.sql y 009_record_class_uid_first.sql"""
+    cols = ["id", "name", "phone", "payment_method", "account", "note", "created_at"]
+    s_cols = ["id", "client_id", "ts_iso", "amount_int"]
+    sel = f"SELECT {','.join(cols)} FROM clients WHERE ifnull(owner_email, '') = ifnull(?, '') AND "
+    s = p_uid and con.execute(
+        f"SELECT {','.join(s_cols)} FROM sessions WHERE uid = ? AND ifnull(owner_email, '') = ifnull(?, '')",
+        (p_uid, p_owner_email),
+    ).fetchone()
+    if s:
+        c = con.execute(sel + "id = ?", (p_owner_email, s[1])).fetchone()
+        return {"client": dict(zip(cols, c)), "session": dict(zip(s_cols, s))}
+    if p_client_id is not None:
+        c = con.execute(sel + "id = ?", (p_owner_email, p_client_id)).fetchone()
+    else:
+        key = re.sub(r"\s+", " ", p_name or "").strip().lower()
+        created = con.execute(
+            "INSERT INTO clients(name, name_norm, owner_email) VALUES (?, ?, ?) "
+            "ON CONFLICT(ifnull(owner_email, ''), name_norm) DO NOTHING RETURNING id",
+            (p_name, key, p_owner_email),
+        ).fetchone()
+        c = con.execute(sel + "name_norm = ?", (p_owner_email, key)).fetchone()
+    if c is None:
+        return {"client": None, "session": None}
+    s = con.execute(
+        "INSERT INTO sessions(client_id, ts_iso, amount_int, owner_email, uid) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(uid) DO NOTHING RETURNING id, client_id, ts_iso, amount_int",
+        (c[0], p_ts_iso, p_amount_int, p_owner_email, p_uid),
+    ).fetchone()
+    if s is None:  # el uid ya estaba (de otro dueño): su sesión y su cliente
+        s = con.execute(f"SELECT {','.join(s_cols)} FROM sessions WHERE uid = ?", (p_uid,)).fetchone()
+        if created and created[0] != s[1]:
+            con.execute("DELETE FROM clients WHERE id = ?", (created[0],))
+        c = con.execute(f"SELECT {','.join(cols)} FROM clients WHERE id = ?", (s[1],)).fetchone()
+    return {"client": dict(zip(cols, c)), "session": dict(zip(s_cols, s))}
+
+
+def _rpc_rebuild_ledger(con, p_owner_email=None, p_dry_run=False):
+    """migrations/007_ledger.sql"""
+    own = "ifnull(owner_email, '') = ifnull(?, '')"
+    expected = {}
+    for cid, y, m, n, total in con.execute(
+        f"SELECT client_id, {_Y.format('sessions')}, {_M.format('sessions')}, COUNT(*), SUM(amount_int) "
+        f"FROM sessions WHERE {own} GROUP BY 1, 2, 3", (p_owner_email,),
+    ):
+        expected[(cid, y, m)] = [n, total, 0]
+    for cid, y, m, paid in con.execute(
+        f"SELECT client_id, year, month, paid FROM monthly_payments WHERE {own}", (p_owner_email,),
+    ):
+        expected.setdefault((cid, y, m), [0, 0, 0])[2] = int(bool(paid))
+    current = {
+        (r[0], r[1], r[2]): list(r[3:])
+        for r in con.execute(
+            f"SELECT client_id, year, month, classes, charged_int, paid FROM ledger_months WHERE {own}",
+            (p_owner_email,),
+        )
+    }
+
+    def live(d):
+        return {k: v for k, v in d.items() if v[0] or v[2]}
+
+    def balances(d):
+        out = {}
+        for (cid, _, _), (n, total, paid) in d.items():
+            b = out.setdefault(cid, [0, 0, 0, 0, 0])
+            b[0] += n
+            b[1] += total
+            b[2 if paid else 3] += total
+            b[4] += int(not paid and n > 0)
+        return {k: v for k, v in out.items() if any(v)}
+
+    exp, cur = live(expected), live(current)
+    months = sum(1 for k in set(exp) | set(cur) if exp.get(k) != cur.get(k))
+    now_bal = {
+        r[0]: list(r[1:])
+        for r in con.execute(
+            f"SELECT client_id, classes, charged_int, paid_int, balance_int, unpaid_months FROM client_balances "
+            f"WHERE {own}", (p_owner_email,),
+        )
+        if any(r[1:])
+    }
+    exp_bal = balances(expected)
+    clients = sum(1 for k in set(exp_bal) | set(now_bal) if exp_bal.get(k) != now_bal.get(k))
+    if not p_dry_run:
+        con.execute(f"DELETE FROM ledger_months WHERE {own}", (p_owner_email,))
+        con.execute(f"DELETE FROM client_balances WHERE {own}", (p_owner_email,))
+        con.executemany(
+            "INSERT INTO ledger_months(client_id, year, month, owner_email, classes, charged_int, paid) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(*k, p_owner_email, *v) for k, v in expected.items()],
+        )
+    return {"months": months, "clients": clients}
+
+
+RPCS = {"record_class": _rpc_record_class, "rebuild_ledger": _rpc_rebuild_ledger}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servidor PostgREST de mentira sobre SQLite.")
+    ap.add_argument("--db", default=":memory:")
+    ap.add_argument("--port", type=int, default=54321)
+    ap.add_argument("--latency", type=float, default=0.0, help="ms por request")
+    ap.add_argument("--jitter", type=float, default=0.0, help="± ms aleatorios")
+    ap.add_argument("--failure-rate", type=float, default=0.0, help="fracción de requests que responden 503")
+    ap.add_argument("--seed", type=int)
+    ap.add_argument("--import-sqlite", help="base de SQLiteBackend para precargar")
+    args = ap.parse_args(argv)
+
+    srv = FakePostgREST(args.db, port=args.port, latency_ms=args.latency,
+                        jitter_ms=args.jitter, failure_rate=args.failure_rate, seed=args.seed)
+    if args.import_sqlite:
+        srv.import_sqlite(args.import_sqlite)
+    print(f"PostgREST falso en {srv.url}/rest/v1 (Ctrl+C para salir)")
+    try:
+        srv._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# jobs.py — Trabajos en segundo plano (p. ej. PDFs) compartidos por todas las sesiones.
+#
+#   reg = shared()
+#   jid = reg.submit(("pdf", datos), build_invoice_pdf, datos)   # vuelve enseguida
+#   reg.state(jid)     # "running" | "done" | "failed" | "missing"
+#   reg.result(jid)    # bytes (o relanza la excepción del trabajo)
+#
+# El id sale del contenido de `key`: pedir dos veces lo mismo (doble clic, otra
+# pestaña, un rerun a mitad de camino) devuelve el mismo id y no repite el
+# trabajo. Los terminados se guardan (los últimos `keep`) para servirlos sin
+# volver a generarlos. Son hilos y no procesos: reportlab y la descarga del
+# logo no necesitan más, y así no hay que serializar los datos.
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def job_id(key):
+    raw = json.dumps(key, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class JobRegistry:
+    def __init__(self, max_workers=2, keep=32):
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="jobs")
+        self._jobs = OrderedDict()  # id -> Future, del más viejo al más nuevo
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Encola fn(*args, **kwargs) si no hay ya un trabajo con la misma key; devuelve su id."""
+        jid = job_id(key)
+        with self._lock:
+            fut = self._jobs.get(jid)
+            if fut is not None and not (fut.done() and fut.exception() is not None):
+                self._jobs.move_to_end(jid)
+                return jid
+            self._jobs[jid] = self._pool.submit(fn, *args, **kwargs)
+            self._trim()
+        return jid
+
+    def state(self, jid):
+        fut = self._jobs.get(jid)
+        if fut is None:
+            return "missing"
+        if not fut.done():
+            return "running"
+        return "failed" if fut.exception() is not None else "done"
+
+    def result(self, jid, timeout=None):
+        fut = self._jobs.get(jid)
+        if fut is None:
+            raise KeyError(jid)
+        return fut.result(timeout)
+
+    def _trim(self):
+        # se descartan los terminados más viejos; los que siguen en curso no
+        done = [j for j, f in self._jobs.items() if f.done()]
+        for j in done[: max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[j]
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """El registro del proceso (vive entre reruns y sesiones de Streamlit)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = JobRegistry()
+        return _shared
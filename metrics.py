@@ -0,0 +1,152 @@
+# metrics.py — Tiempos, filas, bytes y aciertos de caché por rerun y por sesión.
+#
+# Uso en la app:
+#   m = Metrics(path="metrics.jsonl")
+#   instrument(backend, m)      # envuelve cada método de Backend (+ HTTP en Supabase)
+#   store.metrics = m           # aciertos/fallos de la caché de DataStore
+#   m.begin_rerun("registro"); ...; m.end_rerun()   # escribe una línea JSON
+import functools
+import json
+import threading
+import time
+import uuid
+
+
+def _new_bucket():
+    # backend_ms suma solo llamadas de primer nivel (add_client llama a
+    # get_client_by_name_ci por dentro cuando el cliente ya existía: esa no se
+    # cuenta dos veces)
+    return {"backend_ms": 0.0, "calls": {}, "http": {}, "cache": {}}
+
+
+def _acc(table, key, ms=0.0, rows=0, bytes_out=0, bytes_in=0, errors=0):
+    d = table.get(key)
+    if d is None:
+        d = table[key] = {"n": 0, "ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes_out": 0, "bytes_in": 0, "errors": 0}
+    d["n"] += 1
+    d["ms"] += ms
+    d["max_ms"] = max(d["max_ms"], ms)
+    d["rows"] += rows
+    d["bytes_out"] += bytes_out
+    d["bytes_in"] += bytes_in
+    d["errors"] += errors
+
+
+class Metrics:
+    def __init__(self, path=None, session_id=None):
+        self.path = path
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.session = _new_bucket()
+        self.rerun = _new_bucket()
+        self.reruns = 0
+        self.label = None
+        self.last = None  # resumen del último rerun cerrado
+        self._t0 = None
+        self._lock = threading.Lock()
+
+    # ---- registro ----
+    def call(self, name, ms, rows=0, error=False, top=True):
+        with self._lock:
+            for b in (self.rerun, self.session):
+                _acc(b["calls"], name, ms, rows, errors=int(error))
+                if top:
+                    b["backend_ms"] += ms
+
+    def http(self, method, path, ms, status, rows, bytes_out, bytes_in):
+        key = f"{method} {path}"
+        with self._lock:
+            for b in (self.rerun, self.session):
+                _acc(b["http"], key, ms, rows, bytes_out, bytes_in, errors=int(status >= 400))
+
+    def cache(self, name, hit):
+        with self._lock:
+            for b in (self.rerun, self.session):
+                d = b["cache"].setdefault(name, {"hit": 0, "miss": 0})
+                d["hit" if hit else "miss"] += 1
+
+    # ---- ciclo de rerun ----
+    def begin_rerun(self, label=None):
+        # Lo que se midió entre dos reruns completos viene de fragments
+        # re-ejecutados solos: se guarda como su propio registro.
+        if _has_data(self.rerun):
+            self._write(self._record("fragment", None))
+        with self._lock:
+            self.rerun = _new_bucket()
+            self.label = label
+            self._t0 = time.perf_counter()
+
+    def end_rerun(self, **extra):
+        """Cierra el rerun: guarda el resumen en .last y lo agrega al archivo JSONL."""
+        if self._t0 is None:
+            return None
+        with self._lock:
+            self.reruns += 1
+            rec = self._record(self.label, round((time.perf_counter() - self._t0) * 1000, 2), **extra)
+            self.rerun = _new_bucket()
+            self._t0 = None
+            self.last = rec
+        self._write(rec)
+        return rec
+
+    def _record(self, label, wall_ms, **extra):
+        return dict(
+            ts=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            session=self.session_id,
+            rerun=self.reruns,
+            label=label,
+            wall_ms=wall_ms,
+            **extra,
+            **self.rerun,
+        )
+
+    def _write(self, rec):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            pass
+
+
+def _has_data(bucket):
+    return bool(bucket["calls"] or bucket["http"] or bucket["cache"])
+
+
+def instrument(backend, metrics):
+    """Envuelve los métodos públicos de Backend de esta instancia para medirlos."""
+    from db import Backend
+
+    names = [n for n, v in vars(Backend).items() if callable(v) and not n.startswith("_")]
+    for name in names:
+        fn = getattr(backend, name, None)
+        if fn is None or getattr(fn, "_instrumented", False):
+            continue
+        setattr(backend, name, _wrap(name, fn, metrics))
+    if hasattr(type(backend), "observer"):
+        backend.observer = metrics
+    return backend
+
+
+_depth = threading.local()
+
+
+def _wrap(name, fn, metrics):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        level = getattr(_depth, "n", 0)
+        _depth.n = level + 1
+        t0 = time.perf_counter()
+        try:
+            out = fn(*args, **kwargs)
+        except Exception:
+            metrics.call(name, (time.perf_counter() - t0) * 1000, error=True, top=level == 0)
+            raise
+        finally:
+            _depth.n = level
+        rows = len(out) if isinstance(out, list) else (1 if out else 0)
+        metrics.call(name, (time.perf_counter() - t0) * 1000, rows, top=level == 0)
+        return out
+
+    wrapper._instrumented = True
+    return wrapper
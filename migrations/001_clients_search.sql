@@ -0,0 +1,7 @@
+-- Búsqueda de clientes en Supabase (SupabaseBackend.search_clients).
+-- Las consultas son name ilike '%texto%': un índice trigram las resuelve sin
+-- recorrer toda la tabla.
+create extension if not exists pg_trgm;
+
+create index if not exists clients_name_trgm
+  on public.clients using gin (name gin_trgm_ops);
@@ -0,0 +1,37 @@
+-- name_norm en Supabase: la misma clave única que usa SQLite
+-- (utils.name_norm_key: espacios colapsados, sin bordes, en minúsculas).
+-- Con ella get_client_by_name_ci es un solo eq. y add_client un upsert con
+-- on_conflict=owner_email,name_norm, sin duplicados por guardados simultáneos.
+
+alter table public.clients add column if not exists name_norm text;
+
+-- Se calcula también en el servidor, por si alguien escribe sin la app
+create or replace function public.clients_set_name_norm() returns trigger
+language plpgsql as $$
+begin
+  new.name_norm := lower(regexp_replace(btrim(new.name), '\s+', ' ', 'g'));
+  return new;
+end $$;
+
+drop trigger if exists clients_name_norm on public.clients;
+create trigger clients_name_norm
+  before insert or update of name on public.clients
+  for each row execute function public.clients_set_name_norm();
+
+-- Relleno de las filas existentes
+update public.clients
+   set name_norm = lower(regexp_replace(btrim(name), '\s+', ' ', 'g'))
+ where name_norm is null
+    or name_norm <> lower(regexp_replace(btrim(name), '\s+', ' ', 'g'));
+
+-- Si esto devuelve filas hay clientes repetidos: unirlos (mover sus
+-- sessions/monthly_payments/invoices a un solo id) antes de crear el índice.
+--   select owner_email, name_norm, array_agg(id order by id)
+--     from public.clients group by 1, 2 having count(*) > 1;
+
+alter table public.clients alter column name_norm set not null;
+
+-- owner_email puede ser null (un solo dueño): nulls not distinct (Postgres 15+)
+alter table public.clients drop constraint if exists clients_owner_name_norm_key;
+alter table public.clients
+  add constraint clients_owner_name_norm_key unique nulls not distinct (owner_email, name_norm);
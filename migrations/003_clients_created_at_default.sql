@@ -0,0 +1,3 @@
+-- upsert_client no envía created_at (así no lo pisa al actualizar):
+-- al crear, lo pone la tabla.
+alter table public.clients alter column created_at set default now();
@@ -0,0 +1,52 @@
+-- record_class: registrar una clase en un solo request (SupabaseBackend.record_class).
+-- Resuelve el cliente (por id, o por nombre creándolo si no existe) e inserta
+-- la sesión en la misma transacción. Devuelve
+--   {"client": {id,name,phone,...}, "session": {id,client_id,ts_iso,amount_int}}
+-- o {"client": null, "session": null} si p_client_id no existe.
+-- Requiere 002_clients_name_norm.sql (índice único owner_email, name_norm).
+
+create or replace function public.record_class(
+  p_ts_iso text,
+  p_amount_int integer,
+  p_client_id bigint default null,
+  p_name text default null,
+  p_owner_email text default null
+) returns json
+language plpgsql as $$
+declare
+  c public.clients;
+  s public.sessions;
+  k text := lower(regexp_replace(btrim(p_name), '\s+', ' ', 'g'));
+begin
+  if p_client_id is not null then
+    select * into c from public.clients
+     where id = p_client_id and owner_email is not distinct from p_owner_email;
+  else
+    insert into public.clients(name, name_norm, created_at, owner_email)
+    values (p_name, k, now(), p_owner_email)
+    on conflict (owner_email, name_norm) do nothing
+    returning * into c;
+    if c.id is null then
+      select * into c from public.clients
+       where name_norm = k and owner_email is not distinct from p_owner_email;
+    end if;
+  end if;
+
+  if c.id is null then
+    return json_build_object('client', null, 'session', null);
+  end if;
+
+  insert into public.sessions(client_id, ts_iso, amount_int, owner_email)
+  values (c.id, p_ts_iso, p_amount_int, p_owner_email)
+  returning * into s;
+
+  return json_build_object(
+    'client', json_build_object(
+      'id', c.id, 'name', c.name, 'phone', c.phone, 'payment_method', c.payment_method,
+      'account', c.account, 'note', c.note, 'created_at', c.created_at),
+    'session', json_build_object(
+      'id', s.id, 'client_id', s.client_id, 'ts_iso', s.ts_iso, 'amount_int', s.amount_int)
+  );
+end $$;
+
+grant execute on function public.record_class(text, integer, bigint, text, text) to anon, authenticated;
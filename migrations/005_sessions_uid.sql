@@ -0,0 +1,74 @@
+-- uid de sesiones: clave generada por la app (utils.new_uid, un ULID) para que
+-- reintentar un guardado no duplique la clase (SupabaseBackend.log_session /
+-- record_class reintentan ante timeouts y 502/503/504).
+-- Las sesiones anteriores quedan con uid null (el índice único admite varios).
+-- Requiere 004_record_class.sql.
+
+alter table public.sessions add column if not exists uid text;
+
+create unique index if not exists sessions_uid on public.sessions(uid);
+
+-- record_class con p_uid: si ya hay una sesión con ese uid, la devuelve
+-- (con su cliente) en vez de insertar otra.
+drop function if exists public.record_class(text, integer, bigint, text, text);
+
+create or replace function public.record_class(
+  p_ts_iso text,
+  p_amount_int integer,
+  p_client_id bigint default null,
+  p_name text default null,
+  p_owner_email text default null,
+  p_uid text default null
+) returns json
+language plpgsql as $$
+declare
+  c public.clients;
+  s public.sessions;
+  k text := lower(regexp_replace(btrim(p_name), '\s+', ' ', 'g'));
+begin
+  if p_uid is not null then
+    select * into s from public.sessions
+     where uid = p_uid and owner_email is not distinct from p_owner_email;
+  end if;
+
+  if s.id is not null then
+    select * into c from public.clients where id = s.client_id;
+  elsif p_client_id is not null then
+    select * into c from public.clients
+     where id = p_client_id and owner_email is not distinct from p_owner_email;
+  else
+    insert into public.clients(name, name_norm, created_at, owner_email)
+    values (p_name, k, now(), p_owner_email)
+    on conflict (owner_email, name_norm) do nothing
+    returning * into c;
+    if c.id is null then
+      select * into c from public.clients
+       where name_norm = k and owner_email is not distinct from p_owner_email;
+    end if;
+  end if;
+
+  if c.id is null then
+    return json_build_object('client', null, 'session', null);
+  end if;
+
+  if s.id is null then
+    insert into public.sessions(client_id, ts_iso, amount_int, owner_email, uid)
+    values (c.id, p_ts_iso, p_amount_int, p_owner_email, p_uid)
+    on conflict (uid) do nothing
+    returning * into s;
+    -- otro request con el mismo uid ganó la carrera
+    if s.id is null then
+      select * into s from public.sessions where uid = p_uid;
+    end if;
+  end if;
+
+  return json_build_object(
+    'client', json_build_object(
+      'id', c.id, 'name', c.name, 'phone', c.phone, 'payment_method', c.payment_method,
+      'account', c.account, 'note', c.note, 'created_at', c.created_at),
+    'session', json_build_object(
+      'id', s.id, 'client_id', s.client_id, 'ts_iso', s.ts_iso, 'amount_int', s.amount_int)
+  );
+end $$;
+
+grant execute on function public.record_class(text, integer, bigint, text, text, text) to anon, authenticated;
@@ -0,0 +1,10 @@
+-- Índices de sesiones para SupabaseBackend.query_sessions / list_sessions_between.
+-- Toda consulta filtra por owner_email y un rango de ts_iso; la cuenta de
+-- cobro de un cliente filtra además por client_id. Sin estos índices cada
+-- mes o cada cliente recorre la tabla completa.
+
+create index if not exists sessions_owner_ts
+  on public.sessions(owner_email, ts_iso);
+
+create index if not exists sessions_client_ts
+  on public.sessions(client_id, ts_iso);
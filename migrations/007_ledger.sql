@@ -0,0 +1,207 @@
+-- Libro de cuentas (SupabaseBackend.outstanding_balances): lo que debe cada
+-- cliente sin recalcular todos sus meses en cada consulta.
+--   ledger_months:   por cliente y mes, clases, monto cobrado y si el mes está
+--                    pagado (monthly_payments).
+--   client_balances: por cliente, la suma de sus meses: cobrado, pagado (meses
+--                    pagados), saldo (meses sin pagar) y meses pendientes.
+-- Los triggers ajustan solo el mes y el cliente de cada sesión o pago que se
+-- escribe o se borra. rebuild_ledger() recalcula todo y dice cuántas filas no
+-- coincidían. Las mismas tablas y triggers que SQLiteBackend._init_ledger.
+
+create table if not exists public.ledger_months(
+  client_id bigint not null references public.clients(id) on delete cascade,
+  year integer not null,
+  month integer not null,
+  owner_email text,
+  classes integer not null default 0,
+  charged_int bigint not null default 0,
+  paid boolean not null default false,
+  primary key (client_id, year, month)
+);
+
+create table if not exists public.client_balances(
+  client_id bigint primary key references public.clients(id) on delete cascade,
+  owner_email text,
+  classes integer not null default 0,
+  charged_int bigint not null default 0,
+  paid_int bigint not null default 0,
+  balance_int bigint not null default 0,
+  unpaid_months integer not null default 0
+);
+
+-- outstanding_balances: owner_email=eq.x & balance_int=gt.0 & order=balance_int.desc
+create index if not exists client_balances_owner_owed
+  on public.client_balances(owner_email, balance_int desc) where balance_int > 0;
+
+-- sesiones -> su mes
+create or replace function public.ledger_on_session() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update public.ledger_months
+       set classes = classes - 1, charged_int = charged_int - old.amount_int
+     where client_id = old.client_id
+       and year = substr(old.ts_iso, 1, 4)::int and month = substr(old.ts_iso, 6, 2)::int;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into public.ledger_months(client_id, year, month, owner_email, classes, charged_int)
+    values (new.client_id, substr(new.ts_iso, 1, 4)::int, substr(new.ts_iso, 6, 2)::int,
+            new.owner_email, 1, new.amount_int)
+    on conflict (client_id, year, month) do update
+       set classes = ledger_months.classes + 1,
+           charged_int = ledger_months.charged_int + excluded.charged_int;
+  end if;
+  return null;
+end $$;
+
+drop trigger if exists ledger_sessions on public.sessions;
+create trigger ledger_sessions
+  after insert or delete or update of client_id, ts_iso, amount_int on public.sessions
+  for each row execute function public.ledger_on_session();
+
+-- pagos -> el estado de su mes
+create or replace function public.ledger_on_payment() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  if tg_op = 'DELETE' then
+    update public.ledger_months set paid = false
+     where client_id = old.client_id and year = old.year and month = old.month;
+  else
+    insert into public.ledger_months(client_id, year, month, owner_email, paid)
+    values (new.client_id, new.year, new.month, new.owner_email, new.paid)
+    on conflict (client_id, year, month) do update set paid = excluded.paid;
+  end if;
+  return null;
+end $$;
+
+drop trigger if exists ledger_payments on public.monthly_payments;
+create trigger ledger_payments
+  after insert or delete or update of paid on public.monthly_payments
+  for each row execute function public.ledger_on_payment();
+
+-- mes -> saldo del cliente (se suma lo nuevo y se resta lo viejo)
+create or replace function public.ledger_on_month() returns trigger
+language plpgsql security definer set search_path = public as $$
+declare
+  d_classes integer := 0;
+  d_charged bigint := 0;
+  d_paid bigint := 0;
+  d_balance bigint := 0;
+  d_unpaid integer := 0;
+begin
+  if tg_op in ('INSERT', 'UPDATE') then
+    d_classes := new.classes;
+    d_charged := new.charged_int;
+    d_paid := case when new.paid then new.charged_int else 0 end;
+    d_balance := case when new.paid then 0 else new.charged_int end;
+    d_unpaid := (not new.paid and new.classes > 0)::int;
+  end if;
+  if tg_op in ('UPDATE', 'DELETE') then
+    d_classes := d_classes - old.classes;
+    d_charged := d_charged - old.charged_int;
+    d_paid := d_paid - case when old.paid then old.charged_int else 0 end;
+    d_balance := d_balance - case when old.paid then 0 else old.charged_int end;
+    d_unpaid := d_unpaid - (not old.paid and old.classes > 0)::int;
+  end if;
+  -- al borrar solo se descuenta: si es un cliente borrado (cascade) su saldo
+  -- también se está borrando
+  if tg_op = 'DELETE' then
+    update public.client_balances
+       set classes = classes + d_classes, charged_int = charged_int + d_charged,
+           paid_int = paid_int + d_paid, balance_int = balance_int + d_balance,
+           unpaid_months = unpaid_months + d_unpaid
+     where client_id = old.client_id;
+    return null;
+  end if;
+  insert into public.client_balances(client_id, owner_email, classes, charged_int, paid_int, balance_int, unpaid_months)
+  values (new.client_id, new.owner_email, d_classes, d_charged, d_paid, d_balance, d_unpaid)
+  on conflict (client_id) do update
+     set classes = client_balances.classes + excluded.classes,
+         charged_int = client_balances.charged_int + excluded.charged_int,
+         paid_int = client_balances.paid_int + excluded.paid_int,
+         balance_int = client_balances.balance_int + excluded.balance_int,
+         unpaid_months = client_balances.unpaid_months + excluded.unpaid_months;
+  return null;
+end $$;
+
+drop trigger if exists ledger_months_balance on public.ledger_months;
+create trigger ledger_months_balance
+  after insert or delete or update on public.ledger_months
+  for each row execute function public.ledger_on_month();
+
+-- Recalcula el libro de un dueño desde sesiones y pagos. Devuelve
+-- {"months": n, "clients": n}: las filas que no coincidían. p_dry_run=true
+-- solo compara. También llena las tablas la primera vez.
+create or replace function public.rebuild_ledger(p_owner_email text default null, p_dry_run boolean default false)
+returns json
+language plpgsql security definer set search_path = public as $$
+declare
+  n_months integer;
+  n_clients integer;
+begin
+  create temp table ledger_expected on commit drop as
+  select client_id, year, month, sum(classes)::int as classes, sum(charged_int)::bigint as charged_int,
+         bool_or(paid) as paid
+    from (
+      select s.client_id, substr(s.ts_iso, 1, 4)::int as year, substr(s.ts_iso, 6, 2)::int as month,
+             count(*) as classes, sum(s.amount_int) as charged_int, false as paid
+        from public.sessions s
+       where s.owner_email is not distinct from p_owner_email
+       group by 1, 2, 3
+      union all
+      select p.client_id, p.year, p.month, 0, 0, p.paid
+        from public.monthly_payments p
+       where p.owner_email is not distinct from p_owner_email
+    ) x
+   group by 1, 2, 3;
+
+  select count(*) into n_months from (
+    (select client_id, year, month, classes, charged_int, paid from public.ledger_months
+      where owner_email is not distinct from p_owner_email and (classes <> 0 or paid)
+     except
+     select client_id, year, month, classes, charged_int, paid from ledger_expected
+      where classes <> 0 or paid)
+    union all
+    (select client_id, year, month, classes, charged_int, paid from ledger_expected
+      where classes <> 0 or paid
+     except
+     select client_id, year, month, classes, charged_int, paid from public.ledger_months
+      where owner_email is not distinct from p_owner_email and (classes <> 0 or paid))
+  ) d;
+
+  select count(*) into n_clients from (
+    select e.client_id
+      from (select client_id, sum(classes) as classes, sum(charged_int) as charged_int,
+                   sum(case when paid then charged_int else 0 end) as paid_int,
+                   sum(case when paid then 0 else charged_int end) as balance_int,
+                   sum((not paid and classes > 0)::int) as unpaid_months
+              from ledger_expected group by client_id) e
+      full join (select * from public.client_balances
+                  where owner_email is not distinct from p_owner_email) b using (client_id)
+     where (coalesce(e.classes, 0), coalesce(e.charged_int, 0), coalesce(e.paid_int, 0),
+            coalesce(e.balance_int, 0), coalesce(e.unpaid_months, 0))
+           is distinct from
+           (coalesce(b.classes, 0), coalesce(b.charged_int, 0), coalesce(b.paid_int, 0),
+            coalesce(b.balance_int, 0), coalesce(b.unpaid_months, 0))
+  ) d;
+
+  if not p_dry_run then
+    -- ledger_months primero (su trigger toca client_balances); al volver a
+    -- insertar, el trigger arma los saldos
+    delete from public.ledger_months where owner_email is not distinct from p_owner_email;
+    delete from public.client_balances where owner_email is not distinct from p_owner_email;
+    insert into public.ledger_months(client_id, year, month, owner_email, classes, charged_int, paid)
+    select client_id, year, month, p_owner_email, classes, charged_int, paid from ledger_expected;
+  end if;
+  drop table ledger_expected;
+  return json_build_object('months', n_months, 'clients', n_clients);
+end $$;
+
+grant select on public.ledger_months, public.client_balances to anon, authenticated;
+-- rebuild_ledger es security definer y acepta cualquier p_owner_email: solo
+-- para administración (service_role), ver 011_rebuild_ledger_grants.sql.
+revoke execute on function public.rebuild_ledger(text, boolean) from public, anon, authenticated;
+grant execute on function public.rebuild_ledger(text, boolean) to service_role;
+
+-- Relleno inicial con lo que ya hay, un dueño a la vez:
+--   select public.rebuild_ledger(owner_email) from (select distinct owner_email from public.clients) o;
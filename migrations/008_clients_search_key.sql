@@ -0,0 +1,23 @@
+-- Búsqueda sin tildes en Supabase (SupabaseBackend.search_clients): "jose"
+-- encuentra a "José". search_key es el nombre normalizado (espacios
+-- colapsados, minúsculas) y sin tildes, igual que utils.search_key y la
+-- columna search_key de SQLiteBackend. Es una columna generada: nadie la
+-- escribe y se mantiene sola al cambiar el nombre.
+-- Reemplaza el índice trigram sobre name de 001_clients_search.sql.
+create extension if not exists unaccent;
+create extension if not exists pg_trgm;
+
+-- unaccent() no es immutable (depende de search_path); una columna generada
+-- lo exige, así que se envuelve fijando el diccionario.
+create or replace function public.search_key(p_name text) returns text
+language sql immutable parallel safe set search_path = public, extensions as $$
+  select unaccent('unaccent'::regdictionary, lower(regexp_replace(btrim(p_name), '\s+', ' ', 'g')))
+$$;
+
+alter table public.clients add column if not exists search_key text
+  generated always as (public.search_key(name)) stored;
+
+-- search_clients: search_key ilike '%palabra%' por cada palabra
+create index if not exists clients_search_key_trgm
+  on public.clients using gin (search_key gin_trgm_ops);
+drop index if exists public.clients_name_trgm;
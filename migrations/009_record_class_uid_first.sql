@@ -0,0 +1,74 @@
+-- record_class: un cliente nuevo solo queda si de verdad se inserta la sesión.
+-- 005_sessions_uid.sql ya busca primero la sesión por p_uid, pero si otro
+-- request con el mismo uid la inserta entre esa búsqueda y el insert, el
+-- cliente recién creado quedaba huérfano y se devolvía en vez del de la
+-- sesión guardada. Ahora, si el uid ya existe, se devuelve la sesión con su
+-- cliente real y se borra el que este request acababa de crear.
+-- Requiere 005_sessions_uid.sql.
+
+create or replace function public.record_class(
+  p_ts_iso text,
+  p_amount_int integer,
+  p_client_id bigint default null,
+  p_name text default null,
+  p_owner_email text default null,
+  p_uid text default null
+) returns json
+language plpgsql as $$
+declare
+  c public.clients;
+  s public.sessions;
+  k text := lower(regexp_replace(btrim(p_name), '\s+', ' ', 'g'));
+  created bigint;
+begin
+  if p_uid is not null then
+    select * into s from public.sessions
+     where uid = p_uid and owner_email is not distinct from p_owner_email;
+  end if;
+
+  if s.id is not null then
+    select * into c from public.clients where id = s.client_id;
+  elsif p_client_id is not null then
+    select * into c from public.clients
+     where id = p_client_id and owner_email is not distinct from p_owner_email;
+  else
+    insert into public.clients(name, name_norm, created_at, owner_email)
+    values (p_name, k, now(), p_owner_email)
+    on conflict (owner_email, name_norm) do nothing
+    returning * into c;
+    created := c.id;
+    if c.id is null then
+      select * into c from public.clients
+       where name_norm = k and owner_email is not distinct from p_owner_email;
+    end if;
+  end if;
+
+  if c.id is null then
+    return json_build_object('client', null, 'session', null);
+  end if;
+
+  if s.id is null then
+    insert into public.sessions(client_id, ts_iso, amount_int, owner_email, uid)
+    values (c.id, p_ts_iso, p_amount_int, p_owner_email, p_uid)
+    on conflict (uid) do nothing
+    returning * into s;
+    -- otro request con el mismo uid ganó la carrera: su sesión y su cliente
+    if s.id is null then
+      select * into s from public.sessions where uid = p_uid;
+      if created is not null and created <> s.client_id then
+        delete from public.clients where id = created;
+      end if;
+      select * into c from public.clients where id = s.client_id;
+    end if;
+  end if;
+
+  return json_build_object(
+    'client', json_build_object(
+      'id', c.id, 'name', c.name, 'phone', c.phone, 'payment_method', c.payment_method,
+      'account', c.account, 'note', c.note, 'created_at', c.created_at),
+    'session', json_build_object(
+      'id', s.id, 'client_id', s.client_id, 'ts_iso', s.ts_iso, 'amount_int', s.amount_int)
+  );
+end $$;
+
+grant execute on function public.record_class(text, integer, bigint, text, text, text) to anon, authenticated;
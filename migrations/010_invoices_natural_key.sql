@@ -0,0 +1,17 @@
+-- Clave natural de invoices: (client_id, year, month, created_at). Sin ella
+-- restaurar dos veces el mismo respaldo (backup.py restore) duplicaba las
+-- cuentas; SupabaseBackend.insert_rows ahora inserta con
+-- on_conflict=client_id,year,month,created_at y resolution=ignore-duplicates.
+-- Las copias que ya hubiera de una restauración repetida se borran (queda la
+-- de menor id) antes de crear el índice.
+
+delete from public.invoices i
+ using public.invoices o
+ where i.client_id = o.client_id
+   and i.year = o.year
+   and i.month = o.month
+   and i.created_at is not distinct from o.created_at
+   and i.id > o.id;
+
+create unique index if not exists invoices_natural
+  on public.invoices(client_id, year, month, created_at);
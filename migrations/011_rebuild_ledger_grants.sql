@@ -0,0 +1,9 @@
+-- rebuild_ledger solo para administración. 007_ledger.sql lo concedía a anon y,
+-- como es security definer y acepta cualquier p_owner_email, con la clave
+-- pública se podía recalcular (o comparar) el libro de otro dueño. Ahora solo
+-- lo ejecuta service_role: `python cli.py ledger` con SUPABASE_ANON_KEY
+-- apuntando a la clave service_role. Los triggers del libro no cambian.
+-- Requiere 007_ledger.sql.
+
+revoke execute on function public.rebuild_ledger(text, boolean) from public, anon, authenticated;
+grant execute on function public.rebuild_ledger(text, boolean) to service_role;
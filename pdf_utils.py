@@ -1,3 +1,5 @@
+import os
+import sys
 from io import BytesIO
 from reportlab.lib.pagesizes import LETTER
 from reportlab.pdfgen import canvas
@@ -7,23 +9,43 @@ from reportlab.platypus import Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.utils import ImageReader
 
-import requests
-try:
-    import streamlit as st  # disponible en la app
-except Exception:
-    st = None  # por si se ejecuta fuera de Streamlit
-
 from utils import format_cop, ym_to_label
 
+# url -> bytes del logo: se descarga una vez por proceso
+_logos = {}
+
+
+def _secret(name):
+    # st.secrets solo si la app ya cargó Streamlit; fuera de ella (cli.py,
+    # bench.py, los workers de PDF) se lee la variable de entorno
+    if "streamlit" in sys.modules:
+        try:
+            return sys.modules["streamlit"].secrets.get(name, "")
+        except Exception:
+            pass
+    return os.getenv(name, "")
+
+
+def _logo_bytes(url):
+    if url not in _logos:
+        import requests
+
+        resp = requests.get(url, timeout=10)
+        resp.raise_for_status()
+        _logos[url] = resp.content
+    return _logos[url]
+
 
 def build_invoice_pdf(datos):
     """
-    datos:
+    datos (reports.invoice_data los arma):
       - cliente: {name, phone, payment_method, account, note}
       - year, month
       - clases: list[{fecha_str, hora_str, valor_int}]
       - total_int
       - hoy_str
+      - logo_url, emisor, nota (opcionales; si faltan, de st.secrets). Pasarlos
+        en datos permite generar el PDF fuera del hilo de Streamlit (jobs.py).
     """
     buf = BytesIO()
     c = canvas.Canvas(buf, pagesize=LETTER)
@@ -33,18 +55,11 @@ def build_invoice_pdf(datos):
     y = H - margin
 
     # ---------- Logo (opcional desde secrets) ----------
-    logo_url = ""
-    if st is not None:
-        try:
-            logo_url = st.secrets.get("APP_LOGO_URL", "")
-        except Exception:
-            logo_url = ""
+    logo_url = datos["logo_url"] if "logo_url" in datos else _secret("APP_LOGO_URL")
 
     if logo_url:
         try:
-            resp = requests.get(logo_url, timeout=10)
-            resp.raise_for_status()
-            img = ImageReader(BytesIO(resp.content))
+            img = ImageReader(BytesIO(_logo_bytes(logo_url)))
             c.drawImage(img, x, y - 20 * mm, width=30 * mm, height=15 * mm, mask="auto")
         except Exception:
             c.setFillColor(colors.lightgrey)
@@ -54,12 +69,7 @@ def build_invoice_pdf(datos):
         c.rect(x, y - 20 * mm, 30 * mm, 15 * mm, fill=1, stroke=0)
 
     # Emisor (opcional)
-    emisor = ""
-    if st is not None:
-        try:
-            emisor = st.secrets.get("EMISOR_NOMBRE", "")
-        except Exception:
-            emisor = ""
+    emisor = datos["emisor"] if "emisor" in datos else _secret("EMISOR_NOMBRE")
 
     if emisor:
         c.setFont("Helvetica-Bold", 10)
@@ -129,12 +139,7 @@ def build_invoice_pdf(datos):
     c.drawRightString(W - margin, y, f"Total: {format_cop(datos['total_int'])}")
 
     # Nota final opcional
-    nota = ""
-    if st is not None:
-        try:
-            nota = st.secrets.get("EMISOR_NOTA", "")
-        except Exception:
-            nota = ""
+    nota = datos["nota"] if "nota" in datos else _secret("EMISOR_NOTA")
     if nota:
         c.setFont("Helvetica", 9)
         c.drawString(x, y - 12, nota[:120])
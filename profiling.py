@@ -0,0 +1,95 @@
+# profiling.py — Perfil de un rerun de la app (cProfile + muestreo de pila).
+#
+# Se activa con ?profile=1 en la URL o con PROFILE = "1" en secrets. Por cada
+# rerun se guardan en PROFILE_DIR (profiles/ por defecto):
+#   <fecha>_<vista>.pstats   ->  python -m pstats archivo  /  snakeviz archivo
+#   <fecha>_<vista>.folded   ->  flamegraph.pl archivo > perfil.svg  /  speedscope
+#
+# cProfile mide todas las llamadas (exacto pero con sobrecosto); el muestreo
+# toma la pila del hilo cada `interval` segundos y da el formato "collapsed"
+# que entienden las herramientas de flamegraph.
+import collections
+import cProfile
+import datetime as dt
+import os
+import pstats
+import re
+import sys
+import threading
+
+
+class Profiler:
+    def __init__(self, out_dir="profiles", interval=0.005):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.files = []
+        self._prof = cProfile.Profile()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._tid = None
+
+    # ---- ciclo ----
+    def start(self):
+        self._tid = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        self._prof.enable()
+        return self
+
+    def stop(self):
+        self._prof.disable()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._tid)
+            if frame is None:  # el hilo del rerun ya terminó
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    # ---- resultados ----
+    def top_functions(self, n=15, sort="tottime"):
+        """Las `n` funciones con más tiempo propio (o acumulado con sort='cumtime')."""
+        stats = pstats.Stats(self._prof).stats
+        out = []
+        for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.items():
+            out.append({
+                "función": f"{func} ({os.path.basename(filename)}:{line})",
+                "llamadas": nc,
+                "tottime_ms": round(tt * 1000, 2),
+                "cumtime_ms": round(ct * 1000, 2),
+            })
+        key = "cumtime_ms" if sort == "cumtime" else "tottime_ms"
+        out.sort(key=lambda r: r[key], reverse=True)
+        return out[:n]
+
+    def save(self, label="rerun"):
+        """Escribe .pstats y .folded; devuelve las rutas."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = os.path.join(self.out_dir, f"{stamp}_{_slug(label)}")
+        self._prof.dump_stats(base + ".pstats")
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.files = [base + ".pstats", base + ".folded"]
+        return self.files
+
+
+def _slug(label):
+    return re.sub(r"[^0-9A-Za-z]+", "-", label or "").strip("-").lower() or "rerun"
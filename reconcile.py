@@ -0,0 +1,223 @@
+# reconcile.py — Conciliación de extractos (Nequi, Bancolombia, Nu, Lulo) con lo que se cobra cada mes.
+#
+#   tx = read_statements(["nequi_marzo.csv", "bancolombia_marzo.csv"])
+#   charges = charges_frame(clientes, sesiones_sin_pagar_del_mes)
+#   res = reconcile(tx, charges, 2025, 3)
+#   res["matches"]      # propuesta: transacción, cliente, score, estado
+#   res["sin_cliente"]  # abonos que no coinciden con ningún total
+#   res["pendientes"]   # clientes sin un abono que coincida
+#   payment_rows(res["matches"], 2025, 3)   # -> backend.set_month_payments(...)
+#
+# Desde la terminal: python cli.py reconcile 2025-03 extractos/*.csv [--apply]
+#
+# No depende de Streamlit (igual que reports.py y analytics.py). Los extractos
+# se leen a un solo DataFrame y el cruce con los totales del mes es un
+# pd.merge por monto (un hash join): cada abono solo se compara con los
+# clientes que deben exactamente ese valor. Sobre esos pares se puntúa, con
+# operaciones por columna, si el abono cae en la ventana de fechas, si el
+# texto trae la cuenta/alias o el teléfono del cliente, su nombre y el canal
+# con el que suele pagar. Un par queda "confirmado" solo si es el mejor tanto
+# para el abono como para el cliente y no empata con otro; el resto queda
+# "revisar". Pagos parciales o de varios meses juntos no se cruzan.
+import os
+import re
+from typing import Dict, Iterable, List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from analytics import month_range
+from utils import PAGO_METODOS, fold_accents
+
+# Encabezados que se reconocen en los extractos (sin tildes, en minúsculas)
+DATE_COLS = ("fecha", "date", "fecha transaccion", "fecha de la transaccion", "fecha movimiento", "fecha_movimiento")
+AMOUNT_COLS = ("valor", "monto", "amount", "importe", "valor transaccion", "credito", "abono", "entrada")
+DEBIT_COLS = ("debito", "cargo", "salida")
+
+# Puntos de cada señal (el monto ya coincide por construcción)
+SCORE_ALIAS = 0.45  # la cuenta/alias o el teléfono del cliente en el texto
+SCORE_NAME = 0.35  # nombre y un apellido del cliente en el texto
+SCORE_CHANNEL = 0.1  # el canal del extracto es el método de pago del cliente
+SCORE_DATE = 0.1  # dentro del mes (y no en los días de gracia)
+CONFIRM_AT = 0.45  # score mínimo para confirmar sin revisar
+
+# Días después del fin de mes en que todavía llegan pagos de ese mes
+GRACE_DAYS = 10
+
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", " ", fold_accents(str(s or "")).lower()).strip()
+
+
+def _digits(s: str) -> str:
+    return re.sub(r"\D", "", str(s or ""))
+
+
+def channel_from_name(path: str) -> str:
+    """'extractos/nequi_marzo.csv' -> 'Nequi' (o 'Otro' si el nombre no dice el canal)."""
+    base = _norm(os.path.basename(str(path)))
+    return next((m for m in PAGO_METODOS if m != "Otro" and m.lower() in base), "Otro")
+
+
+def parse_amounts(values: "pd.Series") -> "pd.Series":
+    """'$ 120.000', '120000.00', '-1.234,50' -> float (formato colombiano o con punto decimal)."""
+    import numpy as np
+    import pandas as pd
+
+    s = values.astype("string").str.replace(r"[^\d,.\-]", "", regex=True).fillna("")
+    comma_dec = s.str.contains(r",\d{1,2}$")
+    dot_dec = s.str.contains(r"^[^.]*\.\d{1,2}$") & ~comma_dec
+    out = np.where(
+        comma_dec, s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False),
+        np.where(dot_dec, s.str.replace(",", "", regex=False), s.str.replace(r"[.,]", "", regex=True)),
+    )
+    return pd.to_numeric(pd.Series(out, index=values.index), errors="coerce")
+
+
+def read_statement(src, channel: str = None) -> "pd.DataFrame":
+    """
+    Un extracto CSV (ruta o archivo abierto) -> abonos: date, amount, channel,
+    text. Se busca la columna de fecha y la de valor (o crédito) por el
+    encabezado; todo lo demás se junta en `text` (descripción, referencia,
+    nombre de quien envía). Los débitos y valores negativos se descartan.
+    """
+    import pandas as pd
+
+    name = getattr(src, "name", src)
+    raw = pd.read_csv(src, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+    cols = {_norm(c): c for c in raw.columns}
+    date_col = next((cols[c] for c in DATE_COLS if c in cols), None)
+    amount_col = next((cols[c] for c in AMOUNT_COLS if c in cols), None)
+    if date_col is None or amount_col is None:
+        raise ValueError(f"{name}: no se encontró la columna de fecha o de valor ({', '.join(raw.columns)})")
+    amount = parse_amounts(raw[amount_col])
+    keep = amount > 0
+    for c in DEBIT_COLS:
+        if c in cols:
+            keep &= ~(parse_amounts(raw[cols[c]]).fillna(0) > 0)
+    rest = [c for c in raw.columns if c not in (date_col, amount_col)]
+    text = raw[rest].fillna("").astype(str).agg(" ".join, axis=1) if rest else pd.Series("", index=raw.index)
+    df = pd.DataFrame({
+        "date": pd.to_datetime(raw[date_col], dayfirst=True, errors="coerce", format="mixed").dt.normalize(),
+        "amount": amount.round().astype("Int64"),
+        "channel": channel or channel_from_name(name),
+        "text": text.map(_norm),
+        "source": os.path.basename(str(name)),
+    })
+    return df[keep.fillna(False) & df["date"].notna()].reset_index(drop=True)
+
+
+def read_statements(sources: Iterable, channel: str = None) -> "pd.DataFrame":
+    """Varios extractos en un solo DataFrame, con un id por transacción (tx)."""
+    import pandas as pd
+
+    frames = [read_statement(s, channel) for s in sources]
+    if not frames:
+        raise ValueError("No hay extractos para conciliar.")
+    df = pd.concat(frames, ignore_index=True)
+    df.insert(0, "tx", range(len(df)))
+    return df
+
+
+def charges_frame(clients: List[Dict], sessions: List[Dict]) -> "pd.DataFrame":
+    """
+    Lo que debe cada cliente en el mes (sus sesiones sin pagar, p. ej.
+    query_sessions(paid=False) del mes): client_id, client, amount, method y
+    las claves con que puede aparecer en un extracto (alias, phone, name_keys).
+    """
+    import pandas as pd
+
+    tot = {}
+    for r in sessions:
+        tot[r["client_id"]] = tot.get(r["client_id"], 0) + int(r["amount_int"] or 0)
+    info = {c["id"]: c for c in clients}
+    ids = [cid for cid in tot if cid in info]
+    acc = [_norm(info[cid].get("account")) for cid in ids]
+    names = [_norm(info[cid].get("name")).split(" ") for cid in ids]
+    return pd.DataFrame({
+        "client_id": pd.array(ids, dtype="Int64"),
+        "client": [info[cid].get("name") for cid in ids],
+        "amount": pd.array([tot[cid] for cid in ids], dtype="Int64"),
+        "method": [info[cid].get("payment_method") or "Otro" for cid in ids],
+        # alias: la cuenta tal cual (p. ej. "@ana.gomez") y, si trae 4+ dígitos, solo los dígitos
+        "alias": acc,
+        "alias_digits": [d if len(d) >= 4 else "" for d in map(_digits, acc)],
+        "phone": [_digits(info[cid].get("phone"))[-10:] for cid in ids],
+        # nombre + primer apellido, que es lo que suelen mostrar los bancos
+        "name_keys": [" ".join(n[:2]) if len(n) > 1 else n[0] for n in names],
+        "surname": [n[1] if len(n) > 1 else "" for n in names],
+    })
+
+
+def _contains(needles: "pd.Series", haystack: "pd.Series") -> "pd.Series":
+    """needle in haystack por fila (vacío -> False)."""
+    import numpy as np
+    import pandas as pd
+
+    return pd.Series(
+        np.fromiter((bool(n) and n in h for n, h in zip(needles, haystack)), dtype=bool, count=len(needles)),
+        index=needles.index,
+    )
+
+
+def reconcile(tx: "pd.DataFrame", charges: "pd.DataFrame", year: int, month: int,
+              grace_days: int = GRACE_DAYS) -> Dict[str, "pd.DataFrame"]:
+    """
+    Cruza los abonos (read_statements) con los totales del mes
+    (charges_frame). Devuelve "matches" (un par abono-cliente por fila con su
+    score y estado "confirmado" o "revisar"), "sin_cliente" y "pendientes".
+    """
+    import numpy as np
+    import pandas as pd
+
+    start, end = month_range(year, month, 1)
+    lo, hi = pd.Timestamp(start), pd.Timestamp(end) + pd.Timedelta(days=grace_days)
+    window = tx[(tx["date"] >= lo) & (tx["date"] < hi)]
+
+    # hash join por monto: solo los pares con el valor exacto
+    pairs = window.merge(charges, on="amount", how="inner")
+    digits = pairs["text"].str.replace(r"\D", "", regex=True)
+    alias = (_contains(pairs["alias"], pairs["text"]) | _contains(pairs["alias_digits"], digits)
+             | _contains(pairs["phone"], digits))
+    name = _contains(pairs["name_keys"], pairs["text"]) | (
+        _contains(pairs["surname"], pairs["text"]) & _contains(pairs["client"].map(_norm).str.split(" ").str[0], pairs["text"])
+    )
+    channel = pairs["channel"].str.lower() == pairs["method"].str.lower()
+    in_month = pairs["date"] < pd.Timestamp(end)
+    pairs["score"] = np.round(
+        SCORE_ALIAS * alias + SCORE_NAME * name + SCORE_CHANNEL * channel + SCORE_DATE * in_month, 2
+    )
+    why = pd.DataFrame({"alias": alias, "nombre": name, "canal": channel, "en el mes": in_month})
+    pairs["motivo"] = why.apply(lambda r: ", ".join(k for k, v in r.items() if v), axis=1) if len(why) else ""
+
+    # confirmado: el mejor par para su abono y para su cliente, sin empate y con score suficiente
+    best_tx = pairs.groupby("tx")["score"].transform("max")
+    best_cli = pairs.groupby("client_id")["score"].transform("max")
+    top = (pairs["score"] == best_tx) & (pairs["score"] == best_cli)
+    ties_tx = top.groupby(pairs["tx"]).transform("sum")
+    ties_cli = top.groupby(pairs["client_id"]).transform("sum")
+    sure = top & (ties_tx == 1) & (ties_cli == 1) & (pairs["score"] >= CONFIRM_AT)
+    pairs["estado"] = np.where(sure, "confirmado", "revisar")
+    # de lo que no se confirma, solo los pares que siguen abiertos (abono y cliente libres)
+    taken_tx = set(pairs.loc[sure, "tx"])
+    taken_cli = set(pairs.loc[sure, "client_id"])
+    keep = sure | (~pairs["tx"].isin(taken_tx) & ~pairs["client_id"].isin(taken_cli))
+    matches = pairs[keep].sort_values(["estado", "score", "date"], ascending=[True, False, True])
+
+    cols = ["tx", "date", "amount", "channel", "source", "text", "client_id", "client", "score", "motivo", "estado"]
+    return {
+        "matches": matches[cols].reset_index(drop=True),
+        "sin_cliente": window[~window["tx"].isin(pairs["tx"])].reset_index(drop=True),
+        "pendientes": charges[~charges["client_id"].isin(taken_cli)][["client_id", "client", "amount", "method"]]
+        .reset_index(drop=True),
+    }
+
+
+def payment_rows(matches: "pd.DataFrame", year: int, month: int, only_confirmed: bool = True) -> List[Dict]:
+    """Filas para backend.set_month_payments: pagado con la fecha del abono."""
+    m = matches[matches["estado"] == "confirmado"] if only_confirmed else matches
+    m = m.drop_duplicates("client_id")
+    return [
+        dict(client_id=int(cid), year=year, month=month, paid=True, paid_on_iso=d.date().isoformat())
+        for cid, d in zip(m["client_id"], m["date"])
+    ]
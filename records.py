@@ -0,0 +1,74 @@
+# records.py — Filas compactas para clientes y sesiones.
+#
+# Un dict por fila ocupa varias veces lo que ocupan sus datos; con __slots__
+# cada registro guarda solo sus campos. Se siguen pudiendo leer como dict
+# (r["name"], r.get("name"), "name" in r, dict(r)) para no tocar a quien ya
+# los usaba así.
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, *values, **fields):
+        for k, v in zip(self.__slots__, values):
+            setattr(self, k, v)
+        for k in self.__slots__[len(values):]:
+            setattr(self, k, fields.get(k))
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(*(d.get(k) for k in cls.__slots__))
+
+    # ---- interfaz tipo dict ----
+    def get(self, key, default=None):
+        if key in self.__slots__:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def keys(self):
+        return self.__slots__
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Client(Record):
+    __slots__ = ("id", "name", "phone", "payment_method", "account", "note", "created_at")
+
+
+class Session(Record):
+    __slots__ = ("id", "client_id", "client", "ts_iso", "amount_int")
+
+
+def interner():
+    """
+    Función que reutiliza el mismo objeto para valores repetidos (nombres de
+    cliente, montos): en un mes hay miles de sesiones pero pocos nombres y
+    valores distintos.
+    """
+    seen = {}
+    return lambda v: seen.setdefault(v, v)
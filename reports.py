@@ -0,0 +1,158 @@
+# reports.py — Transformaciones de datos para tablas, resumen y calendario.
+#
+# No depende de Streamlit: lo usan app.py y los scripts de benchmark.
+# pandas se importa dentro de cada función: el calendario y la pantalla de
+# acceso no lo necesitan y así no se paga su carga al arrancar.
+import datetime as dt
+import io
+from typing import List, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+from utils import format_cop
+
+
+def month_start_end(year: int, month: int):
+    start = dt.datetime(year, month, 1, 0, 0, 0)
+    if month == 12:
+        end = dt.datetime(year + 1, 1, 1, 0, 0, 0) - dt.timedelta(seconds=1)
+    else:
+        end = dt.datetime(year, month + 1, 1, 0, 0, 0) - dt.timedelta(seconds=1)
+    return start, end
+
+def parse_ts(ts: str) -> dt.datetime:
+    try:
+        return dt.datetime.fromisoformat(ts.replace("Z", "+00:00")).astimezone(None)
+    except Exception:
+        # best effort
+        return dt.datetime.fromisoformat(ts[:19])
+
+def month_table(rows: List[Dict]) -> "pd.DataFrame":
+    """Tabla amigable de las clases del mes (con N° y el ID real)."""
+    import pandas as pd
+
+    # Por columnas: sin un dict intermedio por fila
+    ids, clientes, fechas, horas, valores = [], [], [], [], []
+    for r in sorted(rows, key=lambda x: x.get("ts_iso")):
+        dtt = parse_ts(r.get("ts_iso"))
+        ids.append(r.get("id"))
+        clientes.append(r.get("client"))
+        fechas.append(dtt.strftime("%d/%m/%Y"))
+        horas.append(dtt.strftime("%H:%M"))
+        valores.append(format_cop(int(r.get("amount_int", 0))))
+    if not ids:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        "N°": range(1, len(ids) + 1),
+        "ID": ids,
+        "Cliente": clientes,
+        "Fecha": fechas,
+        "Hora": horas,
+        "Valor": valores,
+    })
+
+def summary_from_totals(totals: Dict[int, Dict]) -> "pd.DataFrame":
+    """Mismo resultado que monthly_summary, a partir de los totales ya agregados."""
+    import pandas as pd
+
+    grp = pd.DataFrame(
+        [{"Cliente": t["client"], "Clases": t["clases"], "Monto": t["monto"]} for t in totals.values()],
+        columns=["Cliente", "Clases", "Monto"],
+    )
+    return grp.sort_values(["Cliente"]).reset_index(drop=True)
+
+def monthly_summary(rows: List[Dict]) -> "pd.DataFrame":
+    import pandas as pd
+
+    if not rows:
+        return pd.DataFrame(columns=["Cliente", "Clases", "Monto"])
+    # campos esperados: client (str) y amount_int (int)
+    df = pd.DataFrame({
+        "Cliente": [r.get("client", "") for r in rows],
+        "Monto": [int(r.get("amount_int", 0) or 0) for r in rows],
+    })
+    grp = df.groupby("Cliente", dropna=False, as_index=False).agg(
+        Clases=("Cliente", "count"),
+        Monto=("Monto", "sum")
+    )
+    grp = grp.sort_values(["Cliente"]).reset_index(drop=True)
+    return grp
+
+def to_calendar(rows: List[Dict]) -> Dict[int, List[tuple]]:
+    """Día del mes -> [(datetime, fila)], sin copiar las filas; solo días con clases."""
+    cal = {}
+    for r in rows:
+        dtm = parse_ts(r.get("ts_iso"))
+        cal.setdefault(dtm.day, []).append((dtm, r))
+    return cal
+
+# ----------------
+# Cuenta de cobro
+# ----------------
+def invoice_data(cliente: Dict, year: int, month: int, rows: List[Dict], **extra) -> Dict:
+    """
+    Datos para pdf_utils.build_invoice_pdf con las clases (rows) de un
+    cliente en el mes. `extra` se agrega tal cual (logo_url, emisor, nota).
+    """
+    clases, total = [], 0
+    for r in sorted(rows, key=lambda x: x.get("ts_iso") or ""):
+        dtt = parse_ts(r.get("ts_iso"))
+        valor = int(r.get("amount_int", 0) or 0)
+        clases.append({"fecha_str": dtt.strftime("%d/%m/%Y"), "hora_str": dtt.strftime("%H:%M"), "valor_int": valor})
+        total += valor
+    return {
+        "cliente": {k: cliente.get(k) for k in ("name", "phone", "payment_method", "account", "note")},
+        "year": year,
+        "month": month,
+        "clases": clases,
+        "total_int": total,
+        "hoy_str": dt.date.today().strftime("%d/%m/%Y"),
+        **extra,
+    }
+
+# ----------------
+# Export helpers
+# ----------------
+# formato -> (extensión, mime). Todas escriben directo desde el DataFrame que
+# ya tiene la vista; `columns` elige columnas sin crear una copia con drop().
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+def available_export_formats() -> List[str]:
+    """CSV siempre; XLSX si está openpyxl y Parquet si está pyarrow."""
+    import importlib.util
+
+    out = ["CSV"]
+    if importlib.util.find_spec("openpyxl"):
+        out.append("XLSX")
+    if importlib.util.find_spec("pyarrow"):
+        out.append("Parquet")
+    return out
+
+def df_to_csv_bytes(df: "pd.DataFrame", columns: Optional[List[str]] = None) -> bytes:
+    return df.to_csv(index=False, columns=columns).encode("utf-8")
+
+def df_to_xlsx_bytes(df: "pd.DataFrame", columns: Optional[List[str]] = None, sheet: str = "Datos") -> bytes:
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, columns=columns, sheet_name=sheet, engine="openpyxl")
+    return buf.getvalue()
+
+def df_to_parquet_bytes(df: "pd.DataFrame", columns: Optional[List[str]] = None) -> bytes:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, columns=columns, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+def export_bytes(df: "pd.DataFrame", fmt: str, columns: Optional[List[str]] = None) -> bytes:
+    if fmt == "XLSX":
+        return df_to_xlsx_bytes(df, columns)
+    if fmt == "Parquet":
+        return df_to_parquet_bytes(df, columns)
+    return df_to_csv_bytes(df, columns)
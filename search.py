@@ -0,0 +1,97 @@
+# search.py — Índice en memoria para buscar clientes mientras se escribe.
+#
+# Las claves salen de utils.search_key (minúsculas, sin tildes), así que
+# "jose" encuentra a "José". Se indexan los trigramas de cada nombre:
+#   - cada palabra de la consulta debe aparecer en el nombre, en cualquier orden
+#   - palabras de 1-2 letras: prefijo de alguna palabra del nombre
+#   - desde 3 letras: intersección de trigramas + verificación de subcadena
+#   - si nada contiene la consulta (errores de tipeo), los nombres con más
+#     trigramas en común
+import bisect
+
+from utils import name_norm_key, search_key
+
+
+def _trigrams(s):
+    s = f"  {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class ClientIndex:
+    def __init__(self, clients):
+        self.clients = list(clients)
+        self.keys = [search_key(c.get("name", "")) for c in self.clients]
+        self.by_norm = {name_norm_key(c.get("name", "")): c for c in self.clients}
+        # palabra -> posiciones, ordenado para buscar prefijos con bisect
+        words = sorted(
+            (w, i) for i, k in enumerate(self.keys) for w in set(k.split())
+        )
+        self._words = [w for w, _ in words]
+        self._word_pos = [i for _, i in words]
+        self._grams = {}
+        for i, k in enumerate(self.keys):
+            for g in _trigrams(k):
+                self._grams.setdefault(g, set()).add(i)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def get(self, name):
+        """Cliente por nombre exacto (case-insensitive), sin recorrer la lista."""
+        return self.by_norm.get(name_norm_key(name))
+
+    def search(self, query, limit=20, fuzzy=True):
+        q = search_key(query)
+        if not q:
+            return self.clients[:limit]
+        # cada palabra de la consulta tiene que aparecer (en cualquier orden)
+        hits = None
+        for w in q.split():
+            found = self._word_hits(w)
+            hits = found if hits is None else hits & found
+            if not hits:
+                break
+        if not hits:
+            return self._fuzzy(_trigrams(q), limit) if fuzzy and len(q) >= 3 else []
+        return [self.clients[i] for i in sorted(hits, key=lambda i: self._rank(i, q))[:limit]]
+
+    def _word_hits(self, w):
+        if len(w) < 3:
+            return self._prefix(w)
+        inner = {w[i:i + 3] for i in range(len(w) - 2)}  # sin los bordes: w puede ir en medio
+        cand = set.intersection(*(self._grams.get(g, set()) for g in inner))
+        return {i for i in cand if w in self.keys[i]}
+
+    def _prefix(self, q):
+        lo = bisect.bisect_left(self._words, q)
+        hits = set()
+        for j in range(lo, len(self._words)):
+            if not self._words[j].startswith(q):
+                break
+            hits.add(self._word_pos[j])
+        return hits
+
+    def _rank(self, i, q):
+        k = self.keys[i]
+        # primero el nombre que empieza así, luego el que empieza por la
+        # primera palabra, luego el resto; dentro de cada grupo, alfabético
+        if k.startswith(q):
+            tier = 0
+        elif k.startswith(q.split()[0]):
+            tier = 1
+        else:
+            tier = 2
+        return (tier, k)
+
+    def _fuzzy(self, grams, limit, threshold=0.2):
+        score = {}
+        for g in grams:
+            for i in self._grams.get(g, ()):
+                score[i] = score.get(i, 0) + 1
+        ranked = []
+        for i, n in score.items():
+            sim = n / len(grams | _trigrams(self.keys[i]))
+            if sim >= threshold:
+                ranked.append((-sim, self.keys[i], i))
+        ranked.sort()
+        return [self.clients[i] for _, _, i in ranked[:limit]]
@@ -0,0 +1,144 @@
+# sqlite_writer.py — Un solo hilo escritor por archivo SQLite, con commits agrupados.
+#
+# SQLite admite un escritor a la vez: con varias sesiones de Streamlit
+# escribiendo en entrenos.db, cada una con su conexión y su commit, se ven
+# "database is locked" y un fsync por clic. Aquí un hilo es dueño de la
+# conexión de escritura:
+#
+#   w = writer_for("entrenos.db")
+#   fila = w.run(lambda con: con.execute("INSERT ... RETURNING ...").fetchall())
+#
+# Los trabajos llegan por una cola; el hilo junta los que ya esperan y, si hay
+# concurrencia, los que llegan dentro de `window` segundos, y los confirma en
+# un solo COMMIT. Cada trabajo corre en su propio SAVEPOINT: si uno falla, se
+# deshace solo ese y su Future recibe la excepción; los demás siguen. Los resultados se entregan después del COMMIT,
+# así quien espera ya puede leer lo que escribió.
+#
+# La base queda en modo WAL: las lecturas (con sus propias conexiones) no
+# esperan al escritor. Lo que no puede ir dentro de una transacción (ATTACH,
+# VACUUM) se encola con transaction=False y corre solo, entre dos lotes.
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Writer:
+    def __init__(self, path, window=0.002, max_batch=256):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.jobs = 0
+        self.commits = 0
+        self._q = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, transaction=True):
+        """
+        Encola fn(con) y devuelve un Future con su resultado. Con
+        transaction=False fn recibe la conexión sin transacción abierta y
+        maneja sus propios BEGIN/COMMIT.
+        """
+        fut = Future()
+        self._q.put((fn, fut, transaction))
+        return fut
+
+    def run(self, fn, transaction=True):
+        """Como submit, pero espera el resultado (o relanza la excepción)."""
+        return self.submit(fn, transaction).result()
+
+    # ---- hilo escritor ----
+    def _connect(self):
+        con = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        # con WAL, NORMAL no pierde consistencia; solo el último commit ante un corte de luz
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _loop(self):
+        con = self._connect()
+        grouped = False
+        while True:
+            batch, alone = [self._q.get()], None
+            if not batch[0][2]:
+                alone = batch.pop()
+            # Solo se espera a más trabajos si el lote anterior ya venía
+            # acompañado: con un usuario solo, cada escritura sale de inmediato.
+            deadline = time.monotonic() + (self.window if grouped else 0)
+            while batch and len(batch) < self.max_batch:
+                wait = deadline - time.monotonic()
+                try:
+                    job = self._q.get(timeout=wait) if wait > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if not job[2]:
+                    alone = job
+                    break
+                batch.append(job)
+            if batch:
+                self._commit(con, batch)
+                grouped = len(batch) > 1
+            if alone:
+                self._run_alone(con, alone)
+
+    def _commit(self, con, batch):
+        done = []
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            for fn, fut, _ in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                con.execute("SAVEPOINT job")
+                try:
+                    res = fn(con)
+                except Exception as e:
+                    con.execute("ROLLBACK TO job")
+                    con.execute("RELEASE job")
+                    fut.set_exception(e)
+                    continue
+                con.execute("RELEASE job")
+                done.append((fut, res))
+            con.execute("COMMIT")
+        except Exception as e:
+            # falló el BEGIN o el COMMIT: no quedó nada del lote
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.jobs += len(done)
+        self.commits += 1
+        for fut, res in done:
+            fut.set_result(res)
+
+    def _run_alone(self, con, job):
+        fn, fut, _ = job
+        if not fut.set_running_or_notify_cancel():
+            return
+        try:
+            res = fn(con)
+        except Exception as e:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            fut.set_exception(e)
+            return
+        self.jobs += 1
+        fut.set_result(res)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def writer_for(path):
+    """El Writer de ese archivo (uno por proceso, compartido por todas las sesiones)."""
+    key = os.path.abspath(path)
+    with _writers_lock:
+        w = _writers.get(key)
+        if w is None:
+            w = _writers[key] = Writer(path)
+        return w
@@ -0,0 +1,212 @@
+# store.py — Caché en memoria de los datos que la app ya leyó del backend.
+#
+# La app guarda un DataStore por sesión de usuario. Las lecturas pasan por aquí
+# y solo van al backend la primera vez; tras cada escritura se aplica la fila
+# que devolvió el backend a la copia en memoria (clientes, sesiones por rango,
+# totales por cliente y pagos) en vez de volver a leer todo el mes.
+import bisect
+import threading
+
+from search import ClientIndex
+
+
+class DataStore:
+    def __init__(self, backend):
+        self.backend = backend
+        # Sube con cada cambio; sirve de clave para cachés derivadas
+        self.generation = 0
+        self._clients = None
+        self._index = None  # ClientIndex de _clients; se rehace si cambian
+        self._searches = {}  # (consulta, límite) -> backend.search_clients; se vacía si cambian
+        self._ranges = {}  # (start_iso, end_iso) -> [sesiones ordenadas por ts_iso]
+        self._totals = {}  # (start_iso, end_iso) -> {client_id: {client, clases, monto}}
+        self._payments = {}  # (client_id, year, month) -> {paid, paid_on_iso}
+        self._queries = {}  # filtros de query_sessions -> [sesiones]; se vacía con cada escritura
+        self._balances = None  # outstanding_balances; también se descarta con cada escritura
+        self._lock = threading.RLock()
+        # Opcional: metrics.Metrics para contar aciertos/fallos de caché
+        self.metrics = None
+
+    def _count(self, name, hit):
+        if self.metrics is not None:
+            self.metrics.cache(name, hit)
+
+    # ---- lecturas ----
+    def clients(self):
+        with self._lock:
+            self._count("clients", self._clients is not None)
+            if self._clients is None:
+                self._clients = list(self.backend.list_clients())
+            return self._clients
+
+    def client_index(self):
+        with self._lock:
+            clients = self.clients()
+            if self._index is None:
+                self._index = ClientIndex(clients)
+            return self._index
+
+    def client_by_name(self, name):
+        return self.client_index().get(name)
+
+    def search_clients(self, query, limit=20):
+        """backend.search_clients con caché: no hace falta traer todos los clientes."""
+        with self._lock:
+            key = ((query or "").strip(), limit)
+            self._count("searches", key in self._searches)
+            if key not in self._searches:
+                self._searches[key] = list(self.backend.search_clients(key[0], limit))
+            return self._searches[key]
+
+    def sessions_between(self, start_iso, end_iso):
+        with self._lock:
+            rng = (start_iso, end_iso)
+            self._count("sessions", rng in self._ranges)
+            if rng not in self._ranges:
+                rows = list(self.backend.list_sessions_between(start_iso, end_iso))
+                rows.sort(key=lambda r: r.get("ts_iso") or "")
+                self._ranges[rng] = rows
+            return self._ranges[rng]
+
+    def totals_between(self, start_iso, end_iso):
+        """Clases y monto por cliente en el rango; se mantiene al día con cada parche."""
+        with self._lock:
+            rng = (start_iso, end_iso)
+            self._count("totals", rng in self._totals)
+            if rng not in self._totals:
+                tot = {}
+                for r in self.sessions_between(start_iso, end_iso):
+                    _add_total(tot, r, 1)
+                self._totals[rng] = tot
+            return self._totals[rng]
+
+    def query_sessions(self, **filters):
+        """backend.query_sessions con caché (p. ej. las clases de un cliente en el mes)."""
+        with self._lock:
+            key = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in filters.items()))
+            self._count("queries", key in self._queries)
+            if key not in self._queries:
+                self._queries[key] = list(self.backend.query_sessions(**filters))
+            return self._queries[key]
+
+    def outstanding_balances(self):
+        """Saldos pendientes por cliente (backend.outstanding_balances)."""
+        with self._lock:
+            self._count("balances", self._balances is not None)
+            if self._balances is None:
+                self._balances = list(self.backend.outstanding_balances())
+            return self._balances
+
+    def month_payment(self, client_id, year, month):
+        with self._lock:
+            k = (client_id, year, month)
+            self._count("payments", k in self._payments)
+            if k not in self._payments:
+                self._payments[k] = self.backend.get_month_payment(client_id, year, month)
+            return self._payments[k]
+
+    def invalidate(self):
+        with self._lock:
+            self._clients = None
+            self._index = None
+            self._searches.clear()
+            self._ranges.clear()
+            self._totals.clear()
+            self._payments.clear()
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+    # ---- parches tras escribir ----
+    def apply_client(self, row):
+        """Inserta o reemplaza un cliente (por id) manteniendo el orden por nombre."""
+        with self._lock:
+            if self._clients is not None:
+                self._clients[:] = [c for c in self._clients if c.get("id") != row.get("id")]
+                names = [c.get("name", "") for c in self._clients]
+                self._clients.insert(bisect.bisect(names, row.get("name", "")), row)
+            self._index = None
+            self._searches.clear()
+            # el nombre va copiado en cada sesión y en los totales
+            for rows in self._ranges.values():
+                for r in rows:
+                    if r.get("client_id") == row.get("id"):
+                        r["client"] = row.get("name")
+            for tot in self._totals.values():
+                if row.get("id") in tot:
+                    tot[row.get("id")]["client"] = row.get("name")
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+    def remove_client(self, client_id):
+        with self._lock:
+            if self._clients is not None:
+                self._clients[:] = [c for c in self._clients if c.get("id") != client_id]
+            self._index = None
+            self._searches.clear()
+            for rows in self._ranges.values():
+                rows[:] = [r for r in rows if r.get("client_id") != client_id]
+            for tot in self._totals.values():
+                tot.pop(client_id, None)
+            for k in [k for k in self._payments if k[0] == client_id]:
+                del self._payments[k]
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+    def apply_session(self, row):
+        """
+        Agrega una sesión a cada rango cacheado que la contenga. Si ya está
+        (mismo id: un reintento con el mismo uid devuelve la sesión guardada),
+        no se repite.
+        """
+        ts = row.get("ts_iso") or ""
+        with self._lock:
+            if not row.get("client"):
+                cli = next((c for c in self._clients or [] if c.get("id") == row.get("client_id")), None)
+                row["client"] = cli.get("name") if cli else None
+            for rng, rows in self._ranges.items():
+                start, end = rng
+                if start <= ts < end:
+                    keys = [r.get("ts_iso") or "" for r in rows]
+                    lo, hi = bisect.bisect_left(keys, ts), bisect.bisect_right(keys, ts)
+                    if any(r.get("id") == row.get("id") for r in rows[lo:hi]):
+                        continue
+                    rows.insert(bisect.bisect(keys, ts), row)
+                    if rng in self._totals:
+                        _add_total(self._totals[rng], row, 1)
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+    def remove_session(self, session_id):
+        with self._lock:
+            for rng, rows in self._ranges.items():
+                gone = [r for r in rows if r.get("id") == session_id]
+                if not gone:
+                    continue
+                rows[:] = [r for r in rows if r.get("id") != session_id]
+                if rng in self._totals:
+                    for r in gone:
+                        _add_total(self._totals[rng], r, -1)
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+    def apply_payment(self, row):
+        with self._lock:
+            k = (row.get("client_id"), row.get("year"), row.get("month"))
+            self._payments[k] = dict(paid=bool(row.get("paid")), paid_on_iso=row.get("paid_on_iso"))
+            self._queries.clear()
+            self._balances = None
+            self.generation += 1
+
+
+def _add_total(tot, row, sign):
+    cid = row.get("client_id")
+    t = tot.setdefault(cid, {"client": row.get("client"), "clases": 0, "monto": 0})
+    t["clases"] += sign
+    t["monto"] += sign * int(row.get("amount_int", 0) or 0)
+    if t["clases"] <= 0:
+        del tot[cid]
@@ -0,0 +1,147 @@
+# synthetic.py — Datos sintéticos (reproducibles) para pruebas de carga y benchmarks.
+#
+#   python synthetic.py bench.db --clients 500 --sessions 100000 --years 3
+#   python synthetic.py bench.db --archive      # años cerrados a bench.<año>.db
+#
+# Genera clientes con nombres realistas (con tildes), clases repartidas en
+# varios años con horarios de entrenamiento plausibles y el estado de pago de
+# cada mes cerrado. Con la misma semilla siempre sale lo mismo.
+import argparse
+import datetime as dt
+import random
+import sqlite3
+
+from utils import name_norm_key, normalize_name, search_key, PAGO_METODOS
+
+NOMBRES = [
+    "Ana", "Andrés", "Camila", "Carlos", "Daniela", "David", "Diana", "Felipe",
+    "Gabriela", "Jorge", "José", "Juan", "Julián", "Laura", "Lucía", "Luis",
+    "Manuela", "María", "Mateo", "Natalia", "Nicolás", "Paula", "Santiago",
+    "Sara", "Sebastián", "Sofía", "Tomás", "Valentina", "Valeria", "Ximena",
+]
+APELLIDOS = [
+    "Álvarez", "Castaño", "Castro", "Díaz", "Duque", "Gómez", "González",
+    "Gutiérrez", "Henao", "Hernández", "Jaramillo", "López", "Marín",
+    "Martínez", "Mejía", "Muñoz", "Ospina", "Pérez", "Quintero", "Ramírez",
+    "Restrepo", "Ríos", "Rodríguez", "Rojas", "Sánchez", "Torres", "Uribe",
+    "Vargas", "Vélez", "Zapata",
+]
+VALORES = [25000, 30000, 30000, 30000, 35000, 40000]
+# Horas de clase más comunes (mañana temprano y tarde-noche)
+HORAS = [5, 6, 6, 7, 7, 8, 9, 12, 16, 17, 17, 18, 18, 18, 19, 19, 20]
+
+
+def gen_clients(n, rng):
+    """Lista de clientes con nombre único (por name_norm)."""
+    seen = set()
+    out = []
+    while len(out) < n:
+        name = f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+        if name_norm_key(name) in seen:
+            name = f"{name} {len(out)}"
+        seen.add(name_norm_key(name))
+        method = rng.choice(PAGO_METODOS)
+        out.append(dict(
+            name=normalize_name(name),
+            phone=f"3{rng.randint(0, 999999999):09d}",
+            payment_method=method,
+            account=f"{method.lower()}-{rng.randint(1000, 9999)}",
+            note=None,
+        ))
+    return out
+
+
+def gen_sessions(n_clients, n, start, end, rng):
+    """Genera (client_idx, ts_iso, amount_int) ordenados por fecha."""
+    days = (end - start).days
+    # Unos clientes entrenan mucho más que otros
+    weights = [rng.paretovariate(1.5) for _ in range(n_clients)]
+    idx = rng.choices(range(n_clients), weights=weights, k=n)
+    stamps = []
+    for _ in range(n):
+        d = start + dt.timedelta(days=rng.randrange(days))
+        if d.weekday() == 6:  # domingo casi no hay clases
+            d -= dt.timedelta(days=1)
+        stamps.append(dt.datetime(d.year, d.month, d.day, rng.choice(HORAS), rng.choice((0, 0, 30))))
+    stamps.sort()
+    for i, ts in zip(idx, stamps):
+        yield i, ts.isoformat(), rng.choice(VALORES)
+
+
+def build_sqlite(path, n_clients=500, n_sessions=100_000, years=3, seed=7, end=None, archive=False):
+    """
+    Llena una base SQLite (con el esquema de SQLiteBackend) con datos sintéticos.
+    Con archive=True los años cerrados quedan en sus archivos (archive_year).
+    Devuelve un resumen con conteos y el rango de fechas.
+    """
+    from db import SQLiteBackend
+
+    rng = random.Random(seed)
+    end = end or dt.date.today().replace(day=1)
+    start = end.replace(year=end.year - years)
+    backend = SQLiteBackend(path)  # crea el esquema
+
+    clients = gen_clients(n_clients, rng)
+    now = dt.datetime(end.year, end.month, end.day).isoformat()
+    con = sqlite3.connect(path)
+    try:
+        con.executemany(
+            "INSERT INTO clients(name,name_norm,search_key,phone,payment_method,account,note,created_at) "
+            "VALUES (?,?,?,?,?,?,?,?)",
+            [(c["name"], name_norm_key(c["name"]), search_key(c["name"]), c["phone"], c["payment_method"],
+              c["account"], c["note"], now) for c in clients],
+        )
+        ids = [r[0] for r in con.execute("SELECT id FROM clients ORDER BY id").fetchall()]
+
+        months = set()
+        batch = []
+        for i, ts_iso, amount in gen_sessions(len(ids), n_sessions, start, end, rng):
+            batch.append((ids[i], ts_iso, amount))
+            months.add((ids[i], int(ts_iso[:4]), int(ts_iso[5:7])))
+            if len(batch) >= 10_000:
+                con.executemany("INSERT INTO sessions(client_id,ts_iso,amount_int) VALUES (?,?,?)", batch)
+                batch.clear()
+        if batch:
+            con.executemany("INSERT INTO sessions(client_id,ts_iso,amount_int) VALUES (?,?,?)", batch)
+
+        # Meses cerrados: la gran mayoría pagados, unos pocos pendientes
+        payments = []
+        for cid, y, m in sorted(months):
+            paid = rng.random() < 0.9
+            paid_on = dt.date(y + (m == 12), m % 12 + 1, rng.randint(1, 10)).isoformat() if paid else None
+            payments.append((cid, y, m, int(paid), paid_on))
+        con.executemany(
+            "INSERT INTO monthly_payments(client_id,year,month,paid,paid_on_iso) VALUES (?,?,?,?,?)",
+            payments,
+        )
+        con.commit()
+    finally:
+        con.close()
+
+    archived = {}
+    if archive:
+        closed = [y for y in backend.session_years() if y < dt.date.today().year]
+        for y in closed:
+            archived[y] = backend.archive_year(y, vacuum=y == closed[-1])
+
+    return dict(
+        path=path, seed=seed, clients=len(clients), sessions=n_sessions,
+        payments=len(payments), start=start.isoformat(), end=end.isoformat(),
+        archived=archived,
+    )
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Genera una base SQLite con datos sintéticos.")
+    ap.add_argument("path")
+    ap.add_argument("--clients", type=int, default=500)
+    ap.add_argument("--sessions", type=int, default=100_000)
+    ap.add_argument("--years", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--archive", action="store_true", help="archivar los años cerrados")
+    args = ap.parse_args(argv)
+    print(build_sqlite(args.path, args.clients, args.sessions, args.years, args.seed, archive=args.archive))
+
+
+if __name__ == "__main__":
+    main()
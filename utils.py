@@ -1,5 +1,8 @@
 from datetime import datetime
+import os
 import re
+import time
+import unicodedata
 
 MESES_ES = [
     "enero","febrero","marzo","abril","mayo","junio",
@@ -30,6 +33,20 @@ def name_norm_key(name: str) -> str:
     """Clave de unicidad case-insensitive."""
     return normalize_spaces(name).lower()
 
+def fold_accents(s: str) -> str:
+    """'José Gómez' -> 'Jose Gomez' (quita tildes y diéresis; la ñ queda como n)."""
+    return "".join(
+        ch for ch in unicodedata.normalize("NFKD", s or "") if not unicodedata.combining(ch)
+    )
+
+def search_key(name: str) -> str:
+    """Clave de búsqueda: name_norm_key sin tildes."""
+    return fold_accents(name_norm_key(name))
+
+def file_key(name: str) -> str:
+    """Nombre de cliente apto para un nombre de archivo: 'José Gómez / 2' -> 'Jose_Gomez_2'."""
+    return re.sub(r"[^\w-]+", "_", fold_accents(normalize_spaces(name))).strip("_") or "cliente"
+
 def format_cop(value) -> str:
     try:
         n = int(round(float(value)))
@@ -37,6 +54,17 @@ def format_cop(value) -> str:
         return "$0"
     return f"${n:,}".replace(",", ".")
 
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+def new_uid() -> str:
+    """
+    ULID de 26 caracteres (milisegundos + 80 bits al azar), ordenable por
+    fecha de creación. Lo genera quien escribe: repetir un guardado con la
+    misma clave no crea la fila dos veces.
+    """
+    n = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    return "".join(_CROCKFORD[(n >> s) & 31] for s in range(125, -1, -5))
+
 def combine_date_time(d, t) -> datetime:
     return datetime(d.year, d.month, d.day, t.hour, t.minute, t.second)
 